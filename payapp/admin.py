@@ -1 +1,9 @@
-# Register your models here.
+from django.contrib import admin
+
+from .models import ExchangeRate
+
+
+@admin.register(ExchangeRate)
+class ExchangeRateAdmin(admin.ModelAdmin):
+    list_display = ('from_currency', 'to_currency', 'rate', 'updated_at')
+    ordering = ('from_currency', 'to_currency')
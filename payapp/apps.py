@@ -1,48 +1,49 @@
-#This module configures the payapp Django application and starts the
-#Thrift timestamp service in a separate thread when the app is ready.
+#This module configures the payapp Django application. Loading it has no
+#side effects beyond connecting signals: the Thrift timestamp server runs
+#on its own (python manage.py runtimestampserver) and the exchange-rate
+#refresher starts with the first rate lookup.
 
 import threading
 from django.apps import AppConfig
+from django.conf import settings
 
 class PayappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'payapp'
 
     def ready(self):
-        # Start the Thrift server in a separate thread
-        self.start_thrift_server()
+        from django.contrib.auth import get_user_model
+        from django.db.models.signals import post_delete, post_save
+        from . import ledger, rates
+        from .models import ExchangeRate
+
+        # Any change to the rate table bumps its version so every worker reloads it.
+        post_save.connect(rates.on_rate_change, sender=ExchangeRate)
+        post_delete.connect(rates.on_rate_change, sender=ExchangeRate)
+
+        # Every new account starts its ledger with an opening-balance snapshot.
+        post_save.connect(ledger.open_account, sender=get_user_model())
+
+        # Development convenience only: serve timestamps from this process.
+        if getattr(settings, 'TIMESTAMP_SERVER_EMBEDDED', False):
+            self.start_thrift_server()
 
     def start_thrift_server(self):
-        import time
         # Define the function that runs the Thrift server
         def run_thrift():
-            from thrift.transport import TSocket, TTransport
-            from thrift.protocol import TBinaryProtocol
-            from thrift.server import TServer
-            from datetime import datetime
+            from payapp.timestamp_server import build_server
 
+            mode = getattr(settings, 'TIMESTAMP_SERVER_MODE', 'threaded')
+            port = getattr(settings, 'TIMESTAMP_SERVICE_PORT', 10000)
+            server = build_server(mode, port=port, workers=getattr(settings, 'TIMESTAMP_SERVER_WORKERS', 16))
+            print(f"Thrift server ({mode}) running on port {port}...")
             try:
-                from payapp.gen import TimestampService
-            except ImportError as e:
-                print("Error importing Thrift generated code:", e)
-                return
-
-            class TimestampHandler:
-                def getTimestamp(self):
-                    return datetime.now().isoformat()
-
-            handler = TimestampHandler()
-            processor = TimestampService.Processor(handler)
-            transport = TSocket.TServerSocket(port=10000)
-            tfactory = TTransport.TBufferedTransportFactory()
-            pfactory = TBinaryProtocol.TBinaryProtocolFactory()
-            server = TServer.TSimpleServer(processor, transport, tfactory, pfactory)
-            print("Thrift server running on port 10000...")
-            # Run the server.
-            server.serve()
-
-        # Create and start a daemon thread to run the Thrift server
-        thread = threading.Thread(target=run_thrift, daemon=True)
+                server.serve()
+            except OSError as e:
+                # Another process (e.g. the runserver autoreloader's parent) already serves this port.
+                print(f"Thrift server not started on port {port}: {e}")
+
+        # Create and start a daemon thread to run the Thrift server. No need to wait:
+        # clients connect lazily and retry a failed call on a fresh connection.
+        thread = threading.Thread(target=run_thrift, name='thrift-server', daemon=True)
         thread.start()
-        # Wait a brief moment to ensure the server starts before other operations.
-        time.sleep(1)
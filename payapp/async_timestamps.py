@@ -0,0 +1,197 @@
+"""
+asyncio client for the Thrift remote timestamp service.
+
+The generated TimestampService.Client only speaks to blocking transports, so
+AsyncTimestampClient uses it for encoding and decoding only. A call is
+serialised into a TMemoryBuffer, written to an asyncio stream, and the reply
+is read back without blocking the event loop. With framed transport the reply
+length is known up front. With buffered transport the bytes read so far are
+decoded until decoding stops running out of data. Either way a slow service
+never ties up a worker thread.
+
+Connections are pooled per event loop (an asyncio stream cannot be used from
+another loop) and per configured endpoint, up to TIMESTAMP_POOL_SIZE each.
+Endpoints are chosen by the process's TimestampBalancer (see
+TimestampBalancer.acall), so async calls get the same power-of-two-choices
+selection, ejection and hedging as sync ones and share their health state.
+With a timestamp lease or the hybrid logical clock in use, stamps come from
+the sync path in a worker thread instead, so both kinds of view draw on the
+same lease or clock.
+"""
+
+import asyncio
+import struct
+import weakref
+
+from asgiref.sync import sync_to_async
+from thrift.Thrift import TException
+from thrift.protocol import TBinaryProtocol
+from thrift.transport import TTransport
+
+from payapp.gen import TimestampService
+from payapp.timestamp_server import MAX_TIMESTAMP_BATCH
+
+from .timestamps import TimestampUnavailable, get_clock, get_lease, get_pool, get_remote_timestamps
+
+_READ_CHUNK = 4096
+
+
+def _encode(method, *args):
+    buf = TTransport.TMemoryBuffer()
+    client = TimestampService.Client(TBinaryProtocol.TBinaryProtocol(buf))
+    getattr(client, 'send_' + method)(*args)
+    return buf.getvalue()
+
+
+def _decode(method, data):
+    """Decodes a reply; raises EOFError if data holds only part of it."""
+    client = TimestampService.Client(TBinaryProtocol.TBinaryProtocol(TTransport.TMemoryBuffer(data)))
+    return getattr(client, 'recv_' + method)()
+
+
+class AsyncTimestampClient:
+    """One asyncio connection to the timestamp server."""
+
+    def __init__(self, reader, writer, framed):
+        self.reader = reader
+        self.writer = writer
+        self.framed = framed
+
+    @classmethod
+    async def connect(cls, host, port, framed=False):
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer, framed)
+
+    async def call(self, method, *args):
+        payload = _encode(method, *args)
+        if self.framed:
+            payload = struct.pack('!i', len(payload)) + payload
+        self.writer.write(payload)
+        await self.writer.drain()
+
+        if self.framed:
+            (length,) = struct.unpack('!i', await self.reader.readexactly(4))
+            return _decode(method, await self.reader.readexactly(length))
+        data = b''
+        while True:
+            chunk = await self.reader.read(_READ_CHUNK)
+            if not chunk:
+                raise EOFError("Timestamp server closed the connection")
+            data += chunk
+            try:
+                return _decode(method, data)
+            except EOFError:
+                continue
+
+    def is_closing(self):
+        return self.writer.is_closing() or self.reader.at_eof()
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncTimestampPool:
+    """
+    Pool of AsyncTimestampClient connections for one endpoint on one event loop.
+
+    Args:
+        host, port: Address of the timestamp server.
+        size: Maximum number of connections (idle plus in use).
+        timeout: Seconds allowed for connecting plus the call itself.
+        framed: Use framed transport (required by the 'nonblocking' server mode).
+    """
+
+    def __init__(self, host, port, size=8, timeout=2.0, framed=False):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.framed = framed
+        self._idle = []
+        self._slots = asyncio.Semaphore(size)
+
+    async def _checkout(self):
+        while self._idle:
+            conn = self._idle.pop()
+            if not conn.is_closing():
+                return conn
+            conn.close()
+        return await AsyncTimestampClient.connect(self.host, self.port, self.framed)
+
+    async def _call_once(self, method, *args):
+        async with self._slots:
+            conn = await self._checkout()
+            try:
+                result = await conn.call(method, *args)
+            except BaseException:
+                # Covers cancellation mid-reply too: the stream is no longer in a known state.
+                conn.close()
+                raise
+            self._idle.append(conn)
+            return result
+
+    async def call(self, method, *args):
+        """
+        Invokes a TimestampService method, reconnecting and retrying once if a
+        pooled connection turns out to be broken.
+        """
+        for attempt in range(2):
+            try:
+                return await asyncio.wait_for(self._call_once(method, *args), self.timeout)
+            except (TException, OSError, EOFError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                if attempt:
+                    raise TimestampUnavailable(f"{method} failed on {self.host}:{self.port}: {e}") from e
+
+
+_pools = weakref.WeakKeyDictionary()
+
+
+def get_async_pools():
+    """
+    Returns the running event loop's AsyncTimestampPools, keyed by endpoint
+    name ("host:port") as in the process's TimestampBalancer.
+    """
+    loop = asyncio.get_running_loop()
+    pools = _pools.get(loop)
+    if pools is None:
+        pools = _pools[loop] = {}
+    for endpoint in get_pool().endpoints:
+        if endpoint.name not in pools:
+            sync_pool = endpoint.pool
+            pools[endpoint.name] = AsyncTimestampPool(
+                sync_pool.host, sync_pool.port,
+                size=sync_pool.size,
+                timeout=sync_pool.timeout_ms / 1000.0,
+                framed=sync_pool.framed,
+            )
+    return pools
+
+
+async def _acall(method, *args):
+    return await get_pool().acall(get_async_pools(), method, *args)
+
+
+async def aget_remote_timestamps(count):
+    """
+    Async counterpart of timestamps.get_remote_timestamps(): returns count
+    strictly increasing ISO timestamps, or None if the service could not be
+    reached.
+
+    With leasing, or in 'hlc' mode, the stamps come from the process's lease
+    or hybrid logical clock, which normally need no I/O at all.
+    """
+    if get_clock() is not None or get_lease() is not None:
+        return await sync_to_async(get_remote_timestamps, thread_sensitive=False)(count)
+    stamps = []
+    try:
+        while len(stamps) < count:
+            stamps.extend(await _acall('getTimestamps', min(count - len(stamps), MAX_TIMESTAMP_BATCH)))
+    except TimestampUnavailable as e:
+        print("Error retrieving remote timestamp:", e)
+        return None
+    return stamps
+
+
+async def aget_remote_timestamp():
+    """Async counterpart of timestamps.get_remote_timestamp()."""
+    stamps = await aget_remote_timestamps(1)
+    return stamps[0] if stamps else None
@@ -0,0 +1,147 @@
+"""
+Async versions of the payment and timestamp views, for ASGI deployments.
+
+With ASYNC_PAYMENT_VIEWS enabled, webapps2025/urls.py routes make_payment,
+request_payment and remote_timestamp to these views. The remote timestamp
+comes from the asyncio Thrift client (payapp/async_timestamps.py), and the
+exchange rate is looked up at the same time. A slow timestamp service then
+parks a coroutine rather than a worker thread. The database work runs in a
+single sync_to_async call wrapped in one transaction, as in the sync views.
+"""
+
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.contrib.auth import get_user_model
+from django.contrib.auth.decorators import login_required
+from django.db import transaction
+from django.http import HttpResponse
+from django.shortcuts import redirect, render
+
+from . import rates, settlement, transfers
+from .async_timestamps import aget_remote_timestamp
+from .idempotency import idempotent, new_key
+from .stamping import async_stamping_enabled, request_stamp
+from .views import PaymentForm, get_transaction_rate, queued_message, record_payment, record_request
+from decimal import Decimal, ROUND_HALF_UP
+
+
+async def _no_timestamp():
+    return None
+
+
+def _commit(record, *args):
+    """Runs record(*args) in its own transaction, deferring the stamp if it is missing."""
+    with transaction.atomic():
+        if args[-1] is None:
+            transaction.on_commit(request_stamp)
+        return record(*args)
+
+
+async def _prepare(request, form, error_route, not_found_message, self_message, check_funds, stamp=True):
+    """
+    Validates a payment form and resolves the counterparty, then fetches the
+    conversion rate and the remote timestamp concurrently.
+
+    Returns (sender, recipient, amount, converted_amount, remote_ts), or an
+    HttpResponse to return straight away. With stamp=False no timestamp is
+    fetched and remote_ts is None.
+    """
+    recipient_name = form.cleaned_data['recipient']
+    amount = form.cleaned_data['amount']
+    sender = await request.auser()
+    recipient = await get_user_model().objects.filter(username=recipient_name).afirst()
+
+    if not recipient:
+        messages.error(request, not_found_message)
+        return redirect(error_route)
+    if sender.pk == recipient.pk:
+        messages.error(request, self_message)
+        return redirect(error_route)
+    if check_funds and sender.balance < amount:
+        messages.error(request, "Insufficient funds.")
+        return redirect(error_route)
+
+    if not stamp or async_stamping_enabled():
+        stamp = _no_timestamp()
+    else:
+        stamp = aget_remote_timestamp()
+    if sender.currency != recipient.currency:
+        rate = sync_to_async(get_transaction_rate)(sender.currency, recipient.currency)
+    else:
+        rate = None
+
+    if rate is None:
+        remote_ts = await stamp
+        converted = amount
+    else:
+        try:
+            conversion_rate, remote_ts = await asyncio.gather(rate, stamp)
+        except rates.UnsupportedConversion:
+            messages.error(request, f"Cannot convert {sender.currency} to {recipient.currency}.")
+            return redirect(error_route)
+        converted = (amount * conversion_rate).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    return sender, recipient, amount, converted, remote_ts
+
+
+@login_required
+@idempotent
+async def make_payment(request):
+    """Async make_payment: see payapp.views.make_payment."""
+    if request.method == 'POST':
+        form = PaymentForm(request.POST)
+        if form.is_valid():
+            queued = settlement.queue_enabled()
+            prepared = await _prepare(request, form, 'make_payment', "Recipient not found.",
+                                     "You cannot send payment to yourself.", check_funds=True, stamp=not queued)
+            if isinstance(prepared, HttpResponse):
+                return prepared
+            sender, recipient, amount, converted, remote_ts = prepared
+            if queued:
+                payment = await sync_to_async(settlement.enqueue)(sender, recipient, amount, converted)
+                messages.success(request, queued_message(payment, sender, recipient))
+                return redirect('transaction_history')
+            try:
+                await sync_to_async(_commit)(record_payment, sender, recipient, amount, converted, remote_ts)
+            except transfers.InsufficientFunds:
+                messages.error(request, "Insufficient funds.")
+                return redirect('make_payment')
+            messages.success(request, f"Payment of {amount} {sender.currency} to {recipient.username} completed.")
+            return redirect('transaction_history')
+        messages.error(request, "Please correct the errors below.")
+    else:
+        form = PaymentForm()
+    return await sync_to_async(render)(request, 'payapp/make_payment.html', {'form': form, 'idempotency_key': new_key()})
+
+
+@login_required
+@idempotent
+async def request_payment(request):
+    """Async request_payment: see payapp.views.request_payment."""
+    if request.method == 'POST':
+        form = PaymentForm(request.POST)
+        if form.is_valid():
+            prepared = await _prepare(request, form, 'request_payment', "User not found.",
+                                     "You cannot request payment from yourself.", check_funds=False)
+            if isinstance(prepared, HttpResponse):
+                return prepared
+            sender, recipient, amount, converted, remote_ts = prepared
+            await sync_to_async(_commit)(record_request, sender, recipient, amount, converted, remote_ts)
+            messages.success(
+                request,
+                f"Payment request of {amount} {sender.currency} (equivalent to {converted} {recipient.currency}) sent to {recipient.username}."
+            )
+            return redirect('transaction_history')
+        messages.error(request, "Please correct the errors below.")
+    else:
+        form = PaymentForm()
+    return await sync_to_async(render)(request, 'payapp/request_payment.html', {'form': form, 'idempotency_key': new_key()})
+
+
+@login_required
+async def remote_timestamp_view(request):
+    ts = await aget_remote_timestamp()
+    if ts is None:
+        return HttpResponse("Error retrieving remote timestamp.")
+    return HttpResponse(f"Remote timestamp: {ts}")
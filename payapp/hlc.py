@@ -0,0 +1,153 @@
+"""
+Hybrid logical clock (HLC) for stamping transactions without an RPC each time.
+
+With TIMESTAMP_MODE = 'hlc' a process produces stamps locally. A background
+thread calls the TimestampService's getEpochMillis every HLC_SYNC_INTERVAL seconds
+to estimate the offset between the local clock and the service clock. Each
+stamp is max(last stamp, corrected local time) plus a logical counter, so
+stamps are strictly increasing within the process and never behind any
+service time this process has seen.
+
+Stamps are rendered in the same ISO format as the service (microsecond
+precision, naive local time). The physical part fills the milliseconds and
+the logical counter (0-999) the remaining three microsecond digits, so stamps
+still parse and sort as timestamps.
+
+If the last measured drift (how far the local clock wandered between two
+syncs) exceeds HLC_MAX_DRIFT_MS, or the clock has not synced recently,
+healthy() turns False and callers fall back to the RPC.
+"""
+
+import threading
+import time
+from datetime import datetime
+
+LOGICAL_LIMIT = 1000
+
+
+def _parse_service_time(iso):
+    """Converts a service timestamp into epoch milliseconds (with fraction)."""
+    return datetime.fromisoformat(iso).timestamp() * 1000.0
+
+
+def format_hlc(physical_ms, logical):
+    """Renders an HLC reading as an ISO timestamp with microsecond precision."""
+    moment = datetime.fromtimestamp(physical_ms // 1000)
+    micros = (physical_ms % 1000) * 1000 + logical
+    return moment.replace(microsecond=micros).isoformat(timespec='microseconds')
+
+
+class HybridLogicalClock:
+    """
+    A hybrid logical clock kept in line with the remote timestamp service.
+
+    Args:
+        fetch_service_time: Callable returning the service's current time in
+            epoch milliseconds (normally a pooled getEpochMillis() call).
+        sync_interval: Seconds between background syncs.
+        max_drift_ms: Largest tolerated drift between syncs before falling back.
+    """
+
+    def __init__(self, fetch_service_time, sync_interval=5.0, max_drift_ms=50.0):
+        self.fetch_service_time = fetch_service_time
+        self.sync_interval = sync_interval
+        self.max_drift_ms = max_drift_ms
+        self._lock = threading.Lock()
+        self._physical = 0
+        self._logical = 0
+        self._offset_ms = None
+        self._synced_at = None
+        self._thread = None
+        self.metrics = {
+            'syncs': 0,
+            'sync_failures': 0,
+            'offset_ms': None,
+            'rtt_ms': None,
+            'drift_ms': None,
+            'max_drift_ms': 0.0,
+            'stamps': 0,
+            'fallbacks': 0,
+        }
+
+    def _wall_ms(self):
+        return time.time() * 1000.0
+
+    def _advance(self, physical_ms):
+        """Moves the clock to at least physical_ms; caller holds the lock."""
+        if physical_ms > self._physical:
+            self._physical = physical_ms
+            self._logical = 0
+        else:
+            self._logical += 1
+            if self._logical >= LOGICAL_LIMIT:
+                self._physical += 1
+                self._logical = 0
+
+    def sync(self):
+        """Measures the offset to the service clock and merges its time in."""
+        started = self._wall_ms()
+        try:
+            service_ms = float(self.fetch_service_time())
+        except Exception as e:
+            self.metrics['sync_failures'] += 1
+            print("HLC sync failed:", e)
+            return False
+        finished = self._wall_ms()
+        offset = service_ms - (started + finished) / 2.0
+        with self._lock:
+            if self._offset_ms is not None:
+                drift = abs(offset - self._offset_ms)
+                self.metrics['drift_ms'] = round(drift, 3)
+                self.metrics['max_drift_ms'] = round(max(self.metrics['max_drift_ms'], drift), 3)
+            self._offset_ms = offset
+            self._synced_at = time.monotonic()
+            # getEpochMillis truncates; start in the next millisecond so no local
+            # stamp sorts before one the service has already issued.
+            self._advance(int(service_ms) + 1)
+            self.metrics['syncs'] += 1
+            self.metrics['offset_ms'] = round(offset, 3)
+            self.metrics['rtt_ms'] = round(finished - started, 3)
+        return True
+
+    def observe(self, iso):
+        """Merges a timestamp obtained from the service (e.g. on fallback)."""
+        service_ms = _parse_service_time(iso)
+        with self._lock:
+            # The service stamp may carry sub-millisecond digits; the next local
+            # stamp starts in the following millisecond so it sorts after it.
+            self._advance(int(service_ms) + 1)
+
+    def healthy(self):
+        """True if the clock has synced recently and drift is within bounds."""
+        self.start()
+        if self._synced_at is None:
+            self.sync()
+        if self._synced_at is None or time.monotonic() - self._synced_at > 3 * self.sync_interval:
+            return False
+        drift = self.metrics['drift_ms']
+        return drift is None or drift <= self.max_drift_ms
+
+    def now(self, count=1):
+        """Returns count strictly increasing HLC stamps as ISO strings."""
+        with self._lock:
+            stamps = []
+            for _ in range(count):
+                self._advance(int(self._wall_ms() + self._offset_ms))
+                stamps.append(format_hlc(self._physical, self._logical))
+            self.metrics['stamps'] += count
+            return stamps
+
+    def start(self):
+        """Starts the background sync thread if it is not running."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        def run():
+            while True:
+                time.sleep(self.sync_interval)
+                self.sync()
+
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=run, name='hlc-sync', daemon=True)
+                self._thread.start()
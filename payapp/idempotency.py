@@ -0,0 +1,212 @@
+"""
+Idempotency keys for payment submissions.
+
+A POST to a view wrapped with @idempotent may carry an Idempotency-Key header
+(or an idempotency_key form field, which the payment forms include). The
+first submission with a key runs the view and stores its outcome against
+(user, key). A repeat submission gets that outcome back, without running the
+view again. The outcome is the redirect and its flash messages, or the JSON
+body. So a double-click, or a proxy or load balancer retrying the POST,
+cannot pay twice.
+
+For sync views the key is claimed in the same transaction as the view's own
+writes. A concurrent duplicate waits on the (user, key) unique index, then
+replays the committed outcome. If the view fails, the claim rolls back with
+it and the request can be retried. Async views cannot share their
+transaction, so they claim the key in a transaction of its own first. A
+duplicate that arrives while the first submission is still running gets a
+409 and should retry.
+
+Responses that changed nothing and are not worth storing, such as a form
+re-rendered with validation errors, release the key. A key older than
+IDEMPOTENCY_KEY_TTL seconds counts as unused, so a new submission with it
+runs the view again, and `python manage.py sweep_idempotency_keys` removes
+such keys in bulk.
+"""
+
+import asyncio
+import hashlib
+import json
+import uuid
+from datetime import timedelta
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, JsonResponse
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+FIELD = 'idempotency_key'
+MAX_KEY_LENGTH = 255
+
+_stats = {'claimed': 0, 'replayed': 0, 'in_progress': 0, 'mismatched': 0}
+
+
+def new_key():
+    """A fresh key for a form's hidden idempotency_key field."""
+    return uuid.uuid4().hex
+
+
+def request_key(request):
+    """The request's idempotency key (header first, then form field), or None."""
+    key = request.headers.get(HEADER) or request.POST.get(FIELD)
+    key = (key or '').strip()
+    return key or None
+
+
+def fingerprint(request):
+    """Hash of the path and the submitted parameters, excluding tokens and the key itself."""
+    digest = hashlib.sha256(request.path.encode())
+    if request.content_type == 'application/json':
+        digest.update(request.body)
+    else:
+        for name in sorted(request.POST):
+            if name not in ('csrfmiddlewaretoken', FIELD):
+                digest.update(f"\0{name}={request.POST.getlist(name)}".encode())
+    return digest.hexdigest()
+
+
+def idempotency_stats():
+    return dict(_stats)
+
+
+def _expiry_cutoff():
+    """Keys created before this are expired and count as unused."""
+    return timezone.now() - timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 86400))
+
+
+def _claim(user_id, key, print_):
+    """
+    Inserts a pending row for (user_id, key), replacing an expired one.
+    Returns (row, True) if this request now owns the key, or (existing row,
+    False) if another request used it within the TTL. Must run inside a
+    transaction.
+    """
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(user_id=user_id, key=key, fingerprint=print_), True
+        except IntegrityError:
+            expired = IdempotencyKey.objects.filter(user_id=user_id, key=key, created_at__lt=_expiry_cutoff())
+            if not expired.delete()[0]:
+                break
+    return IdempotencyKey.objects.get(user_id=user_id, key=key), False
+
+
+def _claim_committed(user_id, key, print_):
+    with transaction.atomic():
+        return _claim(user_id, key, print_)
+
+
+def _capture_messages(request):
+    """Records the flash messages the view adds, so a replay can show them again."""
+    captured = []
+    storage = messages.get_messages(request)
+    add = storage.add
+
+    def add_and_capture(level, message, extra_tags=''):
+        captured.append([level, str(message), extra_tags])
+        add(level, message, extra_tags)
+
+    storage.add = add_and_capture
+    return captured
+
+
+def _finish(row, response, captured):
+    """Stores the view's outcome against row, or releases the key if there is nothing to replay."""
+    if isinstance(response, HttpResponseRedirect):
+        row.response = {'location': response['Location'], 'messages': captured}
+    elif isinstance(response, JsonResponse):
+        row.response = {'json': json.loads(response.content)}
+    else:
+        row.delete()
+        return
+    row.status_code = response.status_code
+    row.save(update_fields=['status_code', 'response'])
+
+
+def _release(row):
+    IdempotencyKey.objects.filter(pk=row.pk).delete()
+
+
+def _replay(request, row, print_):
+    """The response for a repeated key: the stored outcome, or an error if there is none to give."""
+    if row.fingerprint != print_:
+        _stats['mismatched'] += 1
+        return HttpResponse("This idempotency key was already used for a different request.", status=422)
+    if row.status_code is None:
+        _stats['in_progress'] += 1
+        response = HttpResponse("A request with this idempotency key is still in progress.", status=409)
+        response['Retry-After'] = '1'
+        return response
+    _stats['replayed'] += 1
+    if 'json' in row.response:
+        response = JsonResponse(row.response['json'], status=row.status_code, safe=False)
+    else:
+        for level, message, extra_tags in row.response['messages']:
+            messages.add_message(request, level, message, extra_tags=extra_tags)
+        response = HttpResponseRedirect(row.response['location'], status=row.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _lookup(user_id, key):
+    return IdempotencyKey.objects.filter(user_id=user_id, key=key, created_at__gte=_expiry_cutoff()).first()
+
+
+def idempotent(view):
+    """
+    Makes POSTs to view that carry an idempotency key safe to repeat. Apply it
+    below @login_required. Requests without a key run as before.
+    """
+    if asyncio.iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            key = request_key(request) if request.method == 'POST' else None
+            if key is None:
+                return await view(request, *args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return HttpResponseBadRequest(f"Idempotency keys are at most {MAX_KEY_LENGTH} characters.")
+            user = await request.auser()
+            print_ = fingerprint(request)
+            row, created = await sync_to_async(_claim_committed)(user.pk, key, print_)
+            if not created:
+                return _replay(request, row, print_)
+            _stats['claimed'] += 1
+            captured = _capture_messages(request)
+            try:
+                response = await view(request, *args, **kwargs)
+            except BaseException:
+                await sync_to_async(_release)(row)
+                raise
+            await sync_to_async(_finish)(row, response, captured)
+            return response
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request_key(request) if request.method == 'POST' else None
+        if key is None:
+            return view(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return HttpResponseBadRequest(f"Idempotency keys are at most {MAX_KEY_LENGTH} characters.")
+        print_ = fingerprint(request)
+        # Cheap path for retries of a finished submission: one indexed read, no locks.
+        row = _lookup(request.user.pk, key)
+        if row is not None:
+            return _replay(request, row, print_)
+        with transaction.atomic(savepoint=False):
+            row, created = _claim(request.user.pk, key, print_)
+            if not created:
+                return _replay(request, row, print_)
+            _stats['claimed'] += 1
+            captured = _capture_messages(request)
+            response = view(request, *args, **kwargs)
+            _finish(row, response, captured)
+        return response
+    return wrapper
@@ -0,0 +1,101 @@
+"""
+Append-only double-entry ledger behind CustomUser.balance.
+
+transfers.transfer() writes one LedgerEntry per side of every transfer (a
+debit on the payer, a credit on the payee), in the same transaction as the
+balance update; bulk payouts write one pair per payout. Entries are numbered
+per account by CustomUser.ledger_sequence, which is bumped in the same UPDATE
+as the balance. When an account's
+sequence reaches a multiple of LEDGER_SNAPSHOT_INTERVAL, its new balance is
+also written as a BalanceSnapshot. New accounts get an opening snapshot at
+sequence 0.
+
+Historical balances and audits then start from the nearest snapshot and
+replay at most LEDGER_SNAPSHOT_INTERVAL entries, instead of summing an
+account's whole history.
+"""
+
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import BalanceSnapshot, LedgerEntry
+
+
+def snapshot_interval():
+    return getattr(settings, 'LEDGER_SNAPSHOT_INTERVAL', 100)
+
+
+def record_entries(locked, movements):
+    """
+    Writes ledger entries, and any snapshots that fall due, for balance
+    movements that apply_balance_deltas() has just made.
+
+    locked is {account_id: (balance, ledger_sequence)} as read under lock
+    before the update. movements is a list of (account_id, amount, record)
+    in the order they happened, where record is the Transaction settled (or None).
+    Entries and snapshots are each written with one bulk insert.
+    """
+    now = timezone.now()
+    interval = snapshot_interval()
+    state = dict(locked)
+    entries = []
+    snapshots = []
+    for account_id, amount, record in movements:
+        balance, sequence = state[account_id]
+        balance += amount
+        sequence += 1
+        state[account_id] = (balance, sequence)
+        entries.append(LedgerEntry(account_id=account_id, transaction_id=record.pk if record is not None else None,
+                                   sequence=sequence, amount=amount, created_at=now))
+        if sequence % interval == 0:
+            snapshots.append(BalanceSnapshot(account_id=account_id, sequence=sequence,
+                                             balance=balance, taken_at=now))
+    LedgerEntry.objects.bulk_create(entries)
+    if snapshots:
+        BalanceSnapshot.objects.bulk_create(snapshots)
+
+
+def open_account(sender, instance, created, raw=False, **kwargs):
+    """post_save handler: records a new account's opening balance as snapshot 0."""
+    if created and not raw:
+        BalanceSnapshot.objects.create(account_id=instance.pk, sequence=instance.ledger_sequence,
+                                       balance=instance.balance)
+
+
+def _replay(account_id, snapshot, until=None):
+    """Balance after snapshot plus the entries that follow it (up to until)."""
+    tail = LedgerEntry.objects.filter(account_id=account_id, sequence__gt=snapshot.sequence)
+    if until is not None:
+        tail = tail.filter(created_at__lte=until)
+    return snapshot.balance + (tail.aggregate(total=Sum('amount'))['total'] or Decimal('0.00'))
+
+
+def balance_at(account_id, when):
+    """
+    Returns the account's balance as of when, or None if the account had no
+    ledger yet at that time.
+    """
+    snapshot = (BalanceSnapshot.objects.filter(account_id=account_id, taken_at__lte=when)
+                .order_by('-sequence').first())
+    if snapshot is None:
+        return None
+    return _replay(account_id, snapshot, until=when)
+
+
+def audit_account(account_id):
+    """
+    Recomputes an account's balance from its latest snapshot and the entries
+    after it, and compares it with the stored balance.
+
+    Returns (ledger_balance, stored_balance); ledger_balance is None if the
+    account has no snapshot to start from.
+    """
+    stored = get_user_model().objects.filter(pk=account_id).values_list('balance', flat=True).first()
+    snapshot = BalanceSnapshot.objects.filter(account_id=account_id).order_by('-sequence').first()
+    if snapshot is None:
+        return None, stored
+    return _replay(account_id, snapshot), stored
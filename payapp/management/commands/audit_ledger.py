@@ -0,0 +1,38 @@
+"""
+Checks every account's stored balance against its ledger.
+
+Usage: python manage.py audit_ledger [--account ID ...]
+
+Each account is recomputed from its latest BalanceSnapshot plus the ledger
+entries after it, so the audit reads at most LEDGER_SNAPSHOT_INTERVAL entries
+per account, however long its history. Exits non-zero if any account
+disagrees.
+"""
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from payapp.ledger import audit_account
+
+
+class Command(BaseCommand):
+    help = "Reconcile CustomUser balances against the ledger."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--account', type=int, nargs='*', help="Only audit these account ids.")
+
+    def handle(self, *args, **options):
+        accounts = get_user_model().objects.order_by('id').values_list('id', flat=True)
+        if options['account']:
+            accounts = accounts.filter(id__in=options['account'])
+        checked = 0
+        mismatched = 0
+        for account_id in accounts.iterator():
+            ledger_balance, stored = audit_account(account_id)
+            checked += 1
+            if ledger_balance != stored:
+                mismatched += 1
+                self.stdout.write(f"account {account_id}: stored {stored}, ledger {ledger_balance}")
+        if mismatched:
+            raise CommandError(f"{mismatched} of {checked} accounts disagree with the ledger.")
+        self.stdout.write(self.style.SUCCESS(f"All {checked} accounts match the ledger."))
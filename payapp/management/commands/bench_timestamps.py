@@ -0,0 +1,76 @@
+"""
+Benchmarks the Thrift timestamp server in each server mode.
+
+Usage: python manage.py bench_timestamps [--modes threaded nonblocking] [--clients 16] [--requests 5000]
+
+For each mode a throwaway server is started in-process on a free local port.
+Then --clients threads, each with its own pooled connection, make --requests
+getTimestamp() calls between them. The command reports throughput and
+p50/p99 latency per mode.
+"""
+
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from payapp.timestamp_server import SERVER_MODES, build_server, uses_framed_transport, wait_until_ready
+from payapp.timestamps import TimestampClientPool
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Command(BaseCommand):
+    help = "Measure timestamp RPC throughput and tail latency for each Thrift server mode."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', nargs='+', choices=SERVER_MODES,
+                            default=['threaded', 'threadpool', 'nonblocking'])
+        parser.add_argument('--clients', type=int, default=16, help="Concurrent client threads.")
+        parser.add_argument('--requests', type=int, default=5000, help="Total RPCs per mode.")
+        parser.add_argument('--workers', type=int, default=32, help="Server handler threads.")
+
+    def handle(self, *args, **options):
+        clients = options['clients']
+        total = options['requests']
+        self.stdout.write(f"{'mode':<12} {'rpc/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+        for mode in options['modes']:
+            port = _free_port()
+            workers = max(options['workers'], clients) if mode == 'threadpool' else options['workers']
+            server = build_server(mode, host='127.0.0.1', port=port, workers=workers)
+            threading.Thread(target=server.serve, daemon=True).start()
+            if not wait_until_ready('127.0.0.1', port, uses_framed_transport(mode)):
+                raise CommandError(f"Benchmark server ({mode}) did not start on port {port}")
+
+            pool = TimestampClientPool('127.0.0.1', port, size=clients, timeout_ms=5000,
+                                       framed=uses_framed_transport(mode))
+            # Open every pooled connection before timing starts.
+            with ThreadPoolExecutor(clients) as executor:
+                list(executor.map(lambda _: pool.call('getTimestamp'), range(clients * 2)))
+
+            def timed_call(_):
+                start = time.perf_counter()
+                pool.call('getTimestamp')
+                return time.perf_counter() - start
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(clients) as executor:
+                latencies = sorted(executor.map(timed_call, range(total)))
+            elapsed = time.perf_counter() - started
+            pool.close()
+
+            self.stdout.write(
+                f"{mode:<12} {total / elapsed:>10.0f} "
+                f"{_percentile(latencies, 0.50) * 1000:>8.2f} {_percentile(latencies, 0.99) * 1000:>8.2f}"
+            )
@@ -0,0 +1,46 @@
+"""
+Moves credits from striped accounts' shards into their balances.
+
+Usage: python manage.py consolidate_shards [--once]
+
+Without --once it runs as a worker, consolidating every
+STRIPE_CONSOLIDATE_INTERVAL seconds. Credits to a striped account can only
+be spent after this has moved them into its balance, so the interval should
+stay short. Each account is consolidated in its own short transaction.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from payapp.striping import consolidate_all
+
+
+class Command(BaseCommand):
+    help = "Consolidate striped account shards into their balances."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Consolidate once, then exit.")
+
+    def handle(self, *args, **options):
+        if options['once']:
+            count = consolidate_all()
+            self.stdout.write(self.style.SUCCESS(f"Consolidated {count} accounts."))
+            return
+
+        interval = getattr(settings, 'STRIPE_CONSOLIDATE_INTERVAL', 5.0)
+        self.stdout.write(f"Consolidating shards every {interval}s (Ctrl+C to stop)...")
+        try:
+            while True:
+                close_old_connections()
+                try:
+                    count = consolidate_all()
+                    if count:
+                        self.stdout.write(f"Consolidated {count} accounts.")
+                except Exception as e:
+                    self.stderr.write(f"Consolidation failed ({e}); retrying in {interval}s.")
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,33 @@
+"""
+Streams a CSV file of historical rates into the RateHistory table.
+
+Usage: python manage.py import_rate_history rates.csv [--batch-size 5000]
+
+The CSV needs a header row with effective_at, base_currency, quote_currency
+and rate columns.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from payapp.rate_history import import_csv
+
+
+class Command(BaseCommand):
+    help = "Bulk-import historical exchange rates from a CSV file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV file to import ('-' for stdin).")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Rows per INSERT.")
+
+    def handle(self, *args, **options):
+        import sys
+
+        try:
+            if options['path'] == '-':
+                count = import_csv(sys.stdin, options['batch_size'])
+            else:
+                with open(options['path'], newline='') as f:
+                    count = import_csv(f, options['batch_size'])
+        except (OSError, KeyError, ValueError, ArithmeticError) as e:
+            raise CommandError(f"Import failed: {e}")
+        self.stdout.write(self.style.SUCCESS(f"Imported {count} historical rates."))
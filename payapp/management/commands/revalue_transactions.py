@@ -0,0 +1,39 @@
+"""
+Re-prices transactions at the exchange rate in effect when each was created.
+
+Usage: python manage.py revalue_transactions [--since ISO] [--until ISO] > report.csv
+
+Writes a CSV report with each transaction's recorded converted amount next to
+the amount implied by the rate history, for audit.
+"""
+
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from payapp.models import Transaction
+from payapp.rate_history import RateHistoryIndex, revalue_transactions
+
+
+class Command(BaseCommand):
+    help = "Report the historical rate applicable to each transaction."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help="Only transactions created at or after this ISO timestamp.")
+        parser.add_argument('--until', help="Only transactions created before this ISO timestamp.")
+
+    def handle(self, *args, **options):
+        queryset = Transaction.objects.all()
+        for option, lookup in (('since', 'timestamp__gte'), ('until', 'timestamp__lt')):
+            if options[option]:
+                value = parse_datetime(options[option])
+                if value is None:
+                    raise CommandError(f"Invalid --{option} timestamp.")
+                queryset = queryset.filter(**{lookup: value})
+
+        index = RateHistoryIndex.load()
+        writer = csv.writer(self.stdout)
+        writer.writerow(['transaction_id', 'historical_rate', 'revalued_amount', 'recorded_converted_amount'])
+        for row in revalue_transactions(queryset, index):
+            writer.writerow(['' if value is None else value for value in row])
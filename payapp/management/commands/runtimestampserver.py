@@ -0,0 +1,72 @@
+"""
+Runs the Thrift timestamp server as its own process.
+
+Usage: python manage.py runtimestampserver [--mode threaded] [--host 0.0.0.0] [--port 10000] [--workers 16]
+       python manage.py runtimestampserver --check
+
+The server starts, and "ready" is printed only once it has answered a
+getEpochMillis() call. --check instead probes the configured
+TIMESTAMP_SERVICE_HOST:TIMESTAMP_SERVICE_PORT and exits non-zero if no
+server answers, which makes it usable as a readiness or liveness probe.
+"""
+
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from payapp.timestamp_server import SERVER_MODES, build_server, uses_framed_transport, wait_until_ready
+
+
+class Command(BaseCommand):
+    help = "Run the Thrift timestamp server, or check that one is answering."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=SERVER_MODES,
+                            default=getattr(settings, 'TIMESTAMP_SERVER_MODE', 'threaded'))
+        parser.add_argument('--host', default=None, help="Interface to bind (default: all interfaces).")
+        parser.add_argument('--port', type=int, default=getattr(settings, 'TIMESTAMP_SERVICE_PORT', 10000))
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'TIMESTAMP_SERVER_WORKERS', 16))
+        parser.add_argument('--ready-timeout', type=float, default=10.0,
+                            help="Seconds to wait for the server (or the probed server) to answer.")
+        parser.add_argument('--check', action='store_true',
+                            help="Probe the configured server instead of starting one.")
+
+    def handle(self, *args, **options):
+        framed = uses_framed_transport(options['mode'])
+        if options['check']:
+            host = getattr(settings, 'TIMESTAMP_SERVICE_HOST', 'localhost')
+            port = getattr(settings, 'TIMESTAMP_SERVICE_PORT', 10000)
+            if not wait_until_ready(host, port, framed, options['ready_timeout']):
+                raise CommandError(f"No timestamp server answering on {host}:{port}.")
+            self.stdout.write(self.style.SUCCESS(f"Timestamp server on {host}:{port} is ready."))
+            return
+
+        port = options['port']
+        probe_host = options['host'] or '127.0.0.1'
+        if wait_until_ready(probe_host, port, framed, timeout=0):
+            raise CommandError(f"A timestamp server is already answering on port {port}.")
+        server = build_server(options['mode'], host=options['host'], port=port, workers=options['workers'])
+        failure = []
+
+        def serve():
+            try:
+                server.serve()
+            except Exception as e:
+                failure.append(e)
+
+        thread = threading.Thread(target=serve, name='thrift-server', daemon=True)
+        thread.start()
+        if not wait_until_ready(probe_host, port, framed, options['ready_timeout']):
+            reason = failure[0] if failure else "no answer"
+            raise CommandError(f"Timestamp server failed to start on port {port}: {reason}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Timestamp server ({options['mode']}) ready on port {port}. Quit with CONTROL-C."
+        ))
+        try:
+            while thread.is_alive():
+                thread.join(1.0)
+        except KeyboardInterrupt:
+            return
+        if failure:
+            raise CommandError(f"Timestamp server stopped: {failure[0]}")
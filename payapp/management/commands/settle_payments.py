@@ -0,0 +1,54 @@
+"""
+Settles queued payments in batches.
+
+Usage: python manage.py settle_payments [--once] [--batch-size N]
+
+Without --once it runs as a dedicated worker, settling whatever is queued
+every PAYMENT_SETTLE_INTERVAL seconds (every PAYMENT_NETTING_WINDOW seconds,
+netted, when that is set). Several workers can run side by side:
+each claims its batch with SKIP LOCKED and leaves alone any sender whose
+older payments another worker holds. Set PAYMENT_SETTLER_IN_PROCESS = False
+when running it, so web processes do not start their own settler threads.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from payapp.settlement import netting_window, settle_all, settlement_stats
+
+
+class Command(BaseCommand):
+    help = "Settle queued payments, many per database commit."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Settle what is queued now, then exit.")
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="Payments settled per commit (default PAYMENT_SETTLE_BATCH).")
+
+    def handle(self, *args, **options):
+        if options['once']:
+            count = settle_all(options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"Processed {count} queued payments."))
+            return
+
+        interval = netting_window() or getattr(settings, 'PAYMENT_SETTLE_INTERVAL', 1.0)
+        self.stdout.write(f"Settling queued payments every {interval}s (Ctrl+C to stop)...")
+        try:
+            while True:
+                close_old_connections()
+                try:
+                    count = settle_all(options['batch_size'])
+                    if count:
+                        stats = settlement_stats()
+                        self.stdout.write(
+                            f"Processed {count}; {stats['queued']} queued, "
+                            f"oldest {stats['oldest_queued_age']}s."
+                        )
+                except Exception as e:
+                    self.stderr.write(f"Settlement failed ({e}); retrying in {interval}s.")
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,59 @@
+"""
+Stamps transactions that were committed without a remote timestamp.
+
+Usage: python manage.py stamp_transactions [--once] [--batch-size N]
+
+Without --once it runs as a dedicated worker, polling every
+TIMESTAMP_STAMP_INTERVAL seconds and backing off while the timestamp service
+is unreachable. Set TIMESTAMP_STAMPER_IN_PROCESS = False when running it, so
+web processes do not start their own stamper threads.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from payapp.stamping import stamp_all_pending, stamping_stats
+
+
+class Command(BaseCommand):
+    help = "Stamp pending transactions with remote timestamps in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Stamp what is pending now, then exit.")
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="Transactions per getTimestamps() call (default TIMESTAMP_STAMP_BATCH).")
+
+    def handle(self, *args, **options):
+        if options['once']:
+            try:
+                count = stamp_all_pending(options['batch_size'])
+            except RuntimeError as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS(f"Stamped {count} transactions."))
+            return
+
+        interval = getattr(settings, 'TIMESTAMP_STAMP_INTERVAL', 1.0)
+        max_backoff = getattr(settings, 'TIMESTAMP_STAMP_MAX_BACKOFF', 60.0)
+        delay = interval
+        self.stdout.write(f"Stamping pending transactions every {interval}s (Ctrl+C to stop)...")
+        try:
+            while True:
+                close_old_connections()
+                try:
+                    count = stamp_all_pending(options['batch_size'])
+                    if count:
+                        stats = stamping_stats()
+                        self.stdout.write(
+                            f"Stamped {count}; {stats['pending']} pending, "
+                            f"oldest {stats['oldest_pending_age']}s."
+                        )
+                    delay = interval
+                except Exception as e:
+                    delay = min(delay * 2, max_backoff)
+                    self.stderr.write(f"Stamping failed ({e}); retrying in {delay}s.")
+                time.sleep(delay)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,41 @@
+"""
+Turns balance striping on or off for hot accounts.
+
+Usage: python manage.py stripe_account USERNAME [USERNAME ...] --shards N
+
+With N > 0, single payments to the account credit one of N shard rows at
+random instead of locking its balance row. With --shards 0, payments go
+straight to the balance again. Anything still in the shards is consolidated
+at once, so it does not have to wait for the next consolidate_shards run.
+The accounts to stripe are the ones at the top of hot_accounts in the
+metrics view.
+"""
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from payapp.striping import consolidate, set_shards
+
+
+class Command(BaseCommand):
+    help = "Enable (--shards N) or disable (--shards 0) balance striping for accounts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='+')
+        parser.add_argument('--shards', type=int, required=True, help="Number of shard rows (0 disables striping).")
+
+    def handle(self, *args, **options):
+        shards = options['shards']
+        if not 0 <= shards <= 256:
+            raise CommandError("--shards must be between 0 and 256.")
+        accounts = dict(
+            get_user_model().objects.filter(username__in=options['usernames']).values_list('username', 'id')
+        )
+        missing = set(options['usernames']) - accounts.keys()
+        if missing:
+            raise CommandError(f"Unknown users: {', '.join(sorted(missing))}")
+        for username, account_id in accounts.items():
+            set_shards(account_id, shards)
+            if not shards:
+                consolidate(account_id)
+            self.stdout.write(f"{username}: {shards or 'no'} shards")
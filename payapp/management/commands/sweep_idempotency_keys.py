@@ -0,0 +1,38 @@
+"""
+Deletes idempotency keys older than their time-to-live.
+
+Usage: python manage.py sweep_idempotency_keys [--ttl SECONDS] [--batch-size N]
+
+Keys are deleted oldest first in batches of --batch-size rows, using the
+index on created_at. This keeps each delete short enough to run alongside
+live traffic, for example from cron every few minutes.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from payapp.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = "Delete expired idempotency keys."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl', type=int, default=None,
+                            help="Keep keys this many seconds (default IDEMPOTENCY_KEY_TTL).")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows deleted per statement.")
+
+    def handle(self, *args, **options):
+        ttl = options['ttl'] if options['ttl'] is not None else getattr(settings, 'IDEMPOTENCY_KEY_TTL', 86400)
+        cutoff = timezone.now() - timedelta(seconds=ttl)
+        expired = IdempotencyKey.objects.filter(created_at__lt=cutoff).order_by('created_at')
+        deleted = 0
+        while True:
+            ids = list(expired.values_list('id', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            deleted += IdempotencyKey.objects.filter(id__in=ids).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired idempotency keys."))
@@ -0,0 +1,30 @@
+"""
+Pulls base rates from the upstream rate source into the ExchangeRate table.
+
+Usage: python manage.py sync_rates
+
+Direct quotes between two other currencies are rewritten to match the new
+base rates (see rates.store_base_rates).
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from payapp import rates
+from payapp.rate_client import RateSourceError, get_client
+
+
+class Command(BaseCommand):
+    help = "Fetch base rates from RATE_SOURCE_URL and store them in the ExchangeRate table."
+
+    def handle(self, *args, **options):
+        client = get_client()
+        if client is None:
+            raise CommandError("RATE_SOURCE_URL is not configured.")
+        pivot = getattr(settings, 'RATE_PIVOT_CURRENCY', 'GBP')
+        try:
+            base_rates = client.fetch_base_rates(pivot)
+        except RateSourceError as e:
+            raise CommandError(str(e))
+        count = rates.store_base_rates(base_rates, pivot)
+        self.stdout.write(self.style.SUCCESS(f"Stored {count} base rates against {pivot}."))
@@ -0,0 +1,53 @@
+# Generated by Django 5.1.7 on 2026-10-16 23:45
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+# The GBP rates previously hard-coded in payapp.views.conversion. The other
+# pairs are triangulated through GBP, so a round trip returns the amount.
+INITIAL_RATES = [
+    ('GBP', 'USD', Decimal('1.20')),
+    ('GBP', 'EUR', Decimal('1.13')),
+]
+
+
+def seed_rates(apps, schema_editor):
+    ExchangeRate = apps.get_model('payapp', 'ExchangeRate')
+    RateTableVersion = apps.get_model('payapp', 'RateTableVersion')
+    ExchangeRate.objects.bulk_create([
+        ExchangeRate(from_currency=from_currency, to_currency=to_currency, rate=rate)
+        for from_currency, to_currency, rate in INITIAL_RATES
+    ])
+    RateTableVersion.objects.update_or_create(pk=1, defaults={'version': 1})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payapp', '0004_transaction_converted_amount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RateTableVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_currency', models.CharField(max_length=3)),
+                ('to_currency', models.CharField(max_length=3)),
+                ('rate', models.DecimalField(decimal_places=8, max_digits=18)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('from_currency', 'to_currency'), name='unique_exchange_rate_pair')],
+            },
+        ),
+        migrations.RunPython(seed_rates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.7 on 2026-10-16 23:51
+
+from django.db import migrations, models
+
+
+def record_current_rates(apps, schema_editor):
+    ExchangeRate = apps.get_model('payapp', 'ExchangeRate')
+    RateHistory = apps.get_model('payapp', 'RateHistory')
+    RateHistory.objects.bulk_create([
+        RateHistory(base_currency=rate.from_currency, quote_currency=rate.to_currency,
+                    rate=rate.rate, effective_at=rate.updated_at)
+        for rate in ExchangeRate.objects.all()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payapp', '0005_exchangerate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RateHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('base_currency', models.CharField(max_length=3)),
+                ('quote_currency', models.CharField(max_length=3)),
+                ('rate', models.DecimalField(decimal_places=8, max_digits=18)),
+                ('effective_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['base_currency', 'quote_currency', 'effective_at'], name='rate_history_pair_time')],
+            },
+        ),
+        migrations.RunPython(record_current_rates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.1.7 on 2026-10-16 23:59
+
+from datetime import datetime
+
+from django.db import migrations, models, transaction
+
+BACKFILL_CHUNK = 2000
+
+
+def backfill_epoch_ms(apps, schema_editor):
+    """
+    Parses the existing ISO remote_timestamp strings into remote_epoch_ms, in
+    id-ordered chunks that each commit on their own so a large table is never
+    locked for the whole backfill. Unparseable strings are left as NULL.
+    """
+    Transaction = apps.get_model('payapp', 'Transaction')
+    rows = Transaction.objects.filter(remote_epoch_ms__isnull=True, remote_timestamp__isnull=False).order_by('id')
+    last_id = 0
+    while True:
+        chunk = list(rows.filter(id__gt=last_id).only('id', 'remote_timestamp')[:BACKFILL_CHUNK])
+        if not chunk:
+            return
+        last_id = chunk[-1].id
+        for tx in chunk:
+            try:
+                tx.remote_epoch_ms = int(datetime.fromisoformat(tx.remote_timestamp).timestamp() * 1000)
+            except ValueError:
+                pass
+        with transaction.atomic(using=schema_editor.connection.alias):
+            Transaction.objects.bulk_update(chunk, ['remote_epoch_ms'])
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('payapp', '0006_ratehistory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='remote_epoch_ms',
+            field=models.BigIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(backfill_epoch_ms, migrations.RunPython.noop),
+    ]
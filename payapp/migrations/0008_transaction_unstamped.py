@@ -0,0 +1,19 @@
+# Generated by Django 5.1.7 on 2026-10-17 00:00
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payapp', '0007_transaction_remote_epoch_ms'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(condition=models.Q(('remote_timestamp__isnull', True)), fields=['id'], name='transaction_unstamped'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.1.7 on 2026-10-17 00:08
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def open_existing_accounts(apps, schema_editor):
+    """Starts every existing account's ledger with its current balance as snapshot 0."""
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    BalanceSnapshot = apps.get_model('payapp', 'BalanceSnapshot')
+    rows = User.objects.order_by('id').values_list('id', 'balance', 'ledger_sequence')
+    batch = []
+    for account_id, balance, sequence in rows.iterator(chunk_size=2000):
+        batch.append(BalanceSnapshot(account_id=account_id, sequence=sequence, balance=balance))
+        if len(batch) >= 2000:
+            BalanceSnapshot.objects.bulk_create(batch)
+            batch = []
+    BalanceSnapshot.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payapp', '0008_transaction_unstamped'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('register', '0004_customuser_ledger_sequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence', models.PositiveBigIntegerField()),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('taken_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_snapshots', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['account', 'taken_at'], name='snapshot_account_time')],
+                'constraints': [models.UniqueConstraint(fields=('account', 'sequence'), name='unique_snapshot_account_sequence')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence', models.PositiveBigIntegerField()),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to=settings.AUTH_USER_MODEL)),
+                ('transaction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='payapp.transaction')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['account', 'created_at'], name='ledger_account_time')],
+                'constraints': [models.UniqueConstraint(fields=('account', 'sequence'), name='unique_ledger_account_sequence')],
+            },
+        ),
+        migrations.RunPython(open_existing_accounts, migrations.RunPython.noop),
+    ]
@@ -6,6 +6,7 @@ and the CustomUser model extending Django's AbstractUser to include currency and
 
 from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
 
 class Transaction(models.Model):
@@ -20,6 +21,8 @@ class Transaction(models.Model):
            converted_amount: The monetary value converted to the recipient's currency.
            timestamp: The date and time when the transaction was created.
            remote_timestamp: The timestamp obtained from the remote Thrift service.
+           remote_epoch_ms: The same timestamp as indexed epoch milliseconds, for range
+               queries and ordering by remote time.
            status: The current status of the transaction (Pending, Completed, or Rejected).
        """
 
@@ -45,11 +48,273 @@ class Transaction(models.Model):
     converted_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
     remote_timestamp = models.CharField(max_length=50, null=True, blank=True)
+    remote_epoch_ms = models.BigIntegerField(null=True, blank=True, db_index=True)
     status = models.CharField(
         max_length=10,
         choices=[('Pending', 'Pending'), ('Completed', 'Completed'), ('Rejected', 'Rejected')],
         default='Pending'
     )
 
+    class Meta:
+        indexes = [
+            # Keeps the background stamper's scan for unstamped rows cheap.
+            models.Index(fields=['id'], condition=models.Q(remote_timestamp__isnull=True), name='transaction_unstamped'),
+        ]
+
     def __str__(self):
         return f"{self.transaction_type}: {self.sender} -> {self.recipient}, {self.amount}"
+
+
+class ExchangeRate(models.Model):
+    """
+       A conversion rate between two currencies, editable without a redeploy.
+
+       Attributes:
+           from_currency: ISO code of the currency being converted from.
+           to_currency: ISO code of the currency being converted to.
+           rate: Multiplier converting one unit of from_currency into to_currency.
+           updated_at: When the rate was last changed.
+
+       Saving or deleting a rate bumps RateTableVersion (see PayappConfig.ready), which
+       tells every worker to swap in a fresh snapshot of the table.
+       """
+    from_currency = models.CharField(max_length=3)
+    to_currency = models.CharField(max_length=3)
+    rate = models.DecimalField(max_digits=18, decimal_places=8)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['from_currency', 'to_currency'], name='unique_exchange_rate_pair'),
+        ]
+
+    def __str__(self):
+        return f"{self.from_currency}/{self.to_currency}: {self.rate}"
+
+
+class RateTableVersion(models.Model):
+    """
+       Single-row counter identifying the current contents of the ExchangeRate table.
+
+       Workers compare this version with the version of their in-memory snapshot and
+       reload the table only when it has changed.
+       """
+    version = models.BigIntegerField(default=0)
+
+    @classmethod
+    def bump(cls):
+        """Increments the shared rate table version, creating the row if needed."""
+        if not cls.objects.filter(pk=1).update(version=models.F('version') + 1):
+            cls.objects.get_or_create(pk=1, defaults={'version': 1})
+
+    @classmethod
+    def current(cls):
+        """Returns the shared rate table version (0 if no rates were ever loaded)."""
+        return cls.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+
+
+class RateHistory(models.Model):
+    """
+       Append-only record of a rate quote and the moment it took effect.
+
+       Attributes:
+           base_currency: ISO code of the currency the rate is quoted from.
+           quote_currency: ISO code of the currency the rate converts into.
+           rate: Multiplier converting one unit of base_currency into quote_currency.
+           effective_at: When the rate started to apply.
+
+       Rows are never updated; a new rate is a new row. Point-in-time lookups are
+       served from payapp.rate_history.RateHistoryIndex rather than per-row queries.
+       """
+    base_currency = models.CharField(max_length=3)
+    quote_currency = models.CharField(max_length=3)
+    rate = models.DecimalField(max_digits=18, decimal_places=8)
+    effective_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['base_currency', 'quote_currency', 'effective_at'], name='rate_history_pair_time'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("RateHistory is append-only; record a new rate instead.")
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.base_currency}/{self.quote_currency} @ {self.effective_at}: {self.rate}"
+
+
+class LedgerEntry(models.Model):
+    """
+       Append-only record of one balance movement on one account.
+
+       Attributes:
+           account: The user whose balance moved.
+           transaction: The Transaction this movement settles (payment or accepted request).
+           sequence: Position of the entry in the account's ledger (1, 2, 3, ...),
+               taken from CustomUser.ledger_sequence while the account is locked.
+           amount: Signed change to the balance, in the account's currency.
+           created_at: When the movement happened.
+
+       Every transfer writes two entries, a debit on the payer and a credit on the
+       payee. Rows are never updated or deleted.
+       """
+    account = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='ledger_entries')
+    transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE, null=True, blank=True,
+                                    related_name='ledger_entries')
+    sequence = models.PositiveBigIntegerField()
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'sequence'], name='unique_ledger_account_sequence'),
+        ]
+        indexes = [
+            models.Index(fields=['account', 'created_at'], name='ledger_account_time'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("LedgerEntry is append-only; record a new entry instead.")
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.account_id} #{self.sequence}: {self.amount}"
+
+
+class BalanceSnapshot(models.Model):
+    """
+       An account's balance as of one of its ledger entries.
+
+       Attributes:
+           account: The user the snapshot belongs to.
+           sequence: The last ledger entry included (0 is the opening balance).
+           balance: The balance after that entry.
+           taken_at: When that entry was made.
+
+       A snapshot is written every LEDGER_SNAPSHOT_INTERVAL entries, so a balance at
+       any time is the nearest earlier snapshot plus a short tail of entries.
+       """
+    account = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='balance_snapshots')
+    sequence = models.PositiveBigIntegerField()
+    balance = models.DecimalField(max_digits=10, decimal_places=2)
+    taken_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'sequence'], name='unique_snapshot_account_sequence'),
+        ]
+        indexes = [
+            models.Index(fields=['account', 'taken_at'], name='snapshot_account_time'),
+        ]
+
+    def __str__(self):
+        return f"{self.account_id} @ #{self.sequence}: {self.balance}"
+
+
+class IdempotencyKey(models.Model):
+    """
+       The stored outcome of a submission made with an idempotency key.
+
+       Attributes:
+           user: The user who made the submission; keys are unique per user.
+           key: The client-chosen key (Idempotency-Key header or idempotency_key field).
+           fingerprint: Hash of the request path and parameters, so a key reused for a
+               different submission is rejected rather than replayed.
+           status_code: HTTP status of the original response; None while the first
+               submission is still running.
+           response: What is needed to replay the response: its redirect location and
+               flash messages, or its JSON body.
+           created_at: When the key was first used; keys older than IDEMPOTENCY_KEY_TTL
+               are removed by `manage.py sweep_idempotency_keys`.
+
+       See payapp/idempotency.py.
+       """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response = models.JSONField(default=dict)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_user_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}/{self.key}: {self.status_code}"
+
+
+class QueuedPayment(models.Model):
+    """
+       A validated payment waiting for the settlement worker.
+
+       Attributes:
+           sender: The user paying.
+           recipient: The user being paid.
+           amount: The amount debited, in the sender's currency.
+           converted_amount: The amount credited, in the recipient's currency, priced
+               when the payment was queued.
+           status: Queued until a settlement batch picks it up, then Settled or Failed.
+           failure_reason: Why a Failed payment was refused.
+           transaction: The Transaction created when the payment settled.
+           created_at: When the payment was queued.
+           settled_at: When its settlement batch committed.
+
+       Only used with PAYMENT_QUEUE_ENABLED; see payapp/settlement.py.
+       """
+    STATUS_CHOICES = [('Queued', 'Queued'), ('Settled', 'Settled'), ('Failed', 'Failed')]
+
+    sender = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='queued_payments')
+    recipient = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+                                  related_name='incoming_queued_payments')
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    converted_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='Queued')
+    failure_reason = models.CharField(max_length=100, blank=True)
+    transaction = models.OneToOneField(Transaction, on_delete=models.SET_NULL, null=True, blank=True,
+                                       related_name='queued_payment')
+    created_at = models.DateTimeField(default=timezone.now)
+    settled_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The settlement worker only ever scans the queued rows, in id order.
+            models.Index(fields=['id'], condition=models.Q(status='Queued'), name='queued_payment_pending'),
+        ]
+
+    def __str__(self):
+        return f"{self.sender} -> {self.recipient}, {self.amount} ({self.status})"
+
+
+class AccountShard(models.Model):
+    """
+       One stripe of a hot account's incoming credits.
+
+       Attributes:
+           account: The striped user.
+           shard: Stripe number, 0 to CustomUser.balance_shards - 1.
+           balance: Credits received through this stripe since it was last consolidated,
+               in the account's currency.
+           credits: Number of those credits.
+
+       Payments to a striped account lock and update one of its shard rows at random
+       instead of its CustomUser row, so concurrent payers rarely wait on each other.
+       Consolidation moves the shard balances into CustomUser.balance and the ledger.
+       See payapp/striping.py.
+       """
+    account = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='shards')
+    shard = models.PositiveSmallIntegerField()
+    balance = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    credits = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'shard'], name='unique_account_shard'),
+        ]
+
+    def __str__(self):
+        return f"{self.account_id}/{self.shard}: {self.balance}"
@@ -0,0 +1,180 @@
+"""
+Bulk payouts: one sender paying many recipients in a single atomic batch.
+
+bulk_payout() keeps the statement count independent of the batch size (up
+to the database's per-statement limits):
+
+- one query resolves every recipient username;
+- one pass over a single rate snapshot (rates.batch_rates) converts every amount;
+- one getTimestamps() call stamps every payout (or none, with async stamping),
+  before any account is locked;
+- one SELECT ... FOR UPDATE locks the sender and all recipients in id order;
+- set-based UPDATEs apply every balance change (transfers.apply_balance_deltas);
+- bulk inserts write the Transaction rows and their ledger entries.
+
+Recipients with striping enabled (payapp/striping.py) are not locked, as in
+transfers.transfer(): each gets one UPDATE crediting one of its shards with
+its payouts' total, and only the sender's side of their payouts goes into
+the ledger until the shards are consolidated.
+
+Either every payout in the batch is made or none is.
+"""
+
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from . import ledger, rates, striping
+from .models import Transaction
+from .stamping import stamp_or_defer_many
+from .timestamps import epoch_millis
+from .transfers import InsufficientFunds, apply_balance_deltas, lock_balances
+
+CENT = Decimal('0.01')
+# Transaction.amount is a DecimalField(max_digits=10, decimal_places=2), as in PaymentForm.
+MAX_DIGITS = 10
+
+
+class PayoutError(ValueError):
+    """
+    Raised when a payout batch is rejected as a whole.
+
+    errors lists (index, message) for the offending items, where index is the
+    item's position in the batch (None for problems with the batch itself).
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("; ".join(f"item {i}: {msg}" if i is not None else msg for i, msg in errors))
+
+
+def parse_payouts(items):
+    """
+    Validates raw payout items ({"recipient": username, "amount": "12.50"}).
+    Returns a list of (username, Decimal amount); raises PayoutError.
+    """
+    max_items = getattr(settings, 'PAYOUT_MAX_ITEMS', 10000)
+    if not isinstance(items, list) or not items:
+        raise PayoutError([(None, "Expected a non-empty list of payouts")])
+    if len(items) > max_items:
+        raise PayoutError([(None, f"At most {max_items} payouts per batch")])
+    parsed = []
+    errors = []
+    for i, item in enumerate(items):
+        try:
+            username = str(item['recipient'])
+            amount = Decimal(str(item['amount']))
+        except (KeyError, TypeError, InvalidOperation):
+            errors.append((i, "Invalid payout item"))
+            continue
+        if not amount.is_finite() or amount <= 0:
+            errors.append((i, "Amount must be positive"))
+            continue
+        if amount.adjusted() >= MAX_DIGITS - 2:
+            errors.append((i, f"Amount must have at most {MAX_DIGITS} digits"))
+            continue
+        if amount != amount.quantize(CENT):
+            errors.append((i, "Amount must have at most 2 decimal places"))
+            continue
+        parsed.append((username, amount))
+    if errors:
+        raise PayoutError(errors)
+    return parsed
+
+
+def bulk_payout(sender, payouts):
+    """
+    Pays every (username, amount) in payouts from sender, amounts being in the
+    sender's currency, atomically.
+
+    Returns the list of created Transaction rows in payout order. Raises
+    PayoutError if any recipient is unknown, is the sender, or cannot be paid
+    in their currency, and InsufficientFunds if the sender cannot cover the
+    total. Nothing is written in either case.
+    """
+    User = get_user_model()
+    usernames = {username for username, _ in payouts}
+    recipients = {
+        username: (user_id, currency)
+        for user_id, username, currency in User.objects.filter(username__in=usernames)
+        .values_list('id', 'username', 'currency')
+    }
+    shards = dict(
+        User.objects.filter(username__in=usernames, balance_shards__gt=0).values_list('id', 'balance_shards')
+    )
+
+    errors = []
+    for i, (username, _) in enumerate(payouts):
+        if username not in recipients:
+            errors.append((i, f"Recipient {username!r} not found"))
+        elif recipients[username][0] == sender.id:
+            errors.append((i, "You cannot send payment to yourself"))
+    if errors:
+        raise PayoutError(errors)
+
+    _, pair_rates = rates.batch_rates([(sender.currency, recipients[username][1]) for username, _ in payouts])
+    converted = []
+    for i, ((username, amount), rate) in enumerate(zip(payouts, pair_rates)):
+        if rate is None:
+            errors.append((i, f"Cannot convert {sender.currency} to {recipients[username][1]}"))
+            continue
+        credit = (amount * rate).quantize(CENT, rounding=ROUND_HALF_UP)
+        if credit.adjusted() >= MAX_DIGITS - 2:
+            errors.append((i, f"Converted amount {credit} {recipients[username][1]} is too large"))
+        else:
+            converted.append(credit)
+    if errors:
+        raise PayoutError(errors)
+
+    total = sum((amount for _, amount in payouts), Decimal('0.00'))
+    deltas = defaultdict(Decimal)
+    counts = defaultdict(int)
+    shard_credits = defaultdict(Decimal)
+    deltas[sender.id] = -total
+    counts[sender.id] = len(payouts)
+    for (username, _), credit in zip(payouts, converted):
+        recipient_id = recipients[username][0]
+        if recipient_id in shards:
+            shard_credits[recipient_id] += credit
+        else:
+            deltas[recipient_id] += credit
+            counts[recipient_id] += 1
+
+    with transaction.atomic():
+        # Stamp before locking, so no account stays locked across the RPC.
+        stamps = stamp_or_defer_many(len(payouts))
+        locked = lock_balances(list(deltas))
+        if sender.id not in locked or locked[sender.id][0] < total:
+            raise InsufficientFunds(f"Balance does not cover the batch total {total}")
+        apply_balance_deltas(deltas, counts)
+        for recipient_id, credit in shard_credits.items():
+            if not striping.credit_shard(recipient_id, shards[recipient_id], credit):
+                raise PayoutError([(None, f"Recipient account {recipient_id} no longer exists")])
+
+        created = Transaction.objects.bulk_create([
+            Transaction(
+                sender_id=sender.id,
+                recipient_id=recipients[username][0],
+                transaction_type='PAYMENT',
+                amount=amount,
+                converted_amount=credit,
+                status='Completed',
+                remote_timestamp=stamp,
+                remote_epoch_ms=epoch_millis(stamp),
+            )
+            for (username, amount), credit, stamp in zip(payouts, converted, stamps)
+        ])
+
+        movements = []
+        for payment in created:
+            movements.append((sender.id, -payment.amount, payment))
+            if payment.recipient_id not in shards:
+                movements.append((payment.recipient_id, payment.converted_amount, payment))
+        ledger.record_entries(locked, movements)
+
+    striping.note_credits(payment.recipient_id for payment in created)
+    sender.balance = locked[sender.id][0] - total
+    return created
@@ -0,0 +1,175 @@
+"""
+HTTP client for the upstream exchange-rate source.
+
+All HTTP rate lookups go through one shared RateSourceClient. It keeps a
+pooled keep-alive requests.Session, applies connect/read timeouts and a
+bounded number of retries to every call, and sits behind a circuit breaker.
+While the upstream source is failing, callers get CircuitOpenError at once
+instead of each waiting for its own timeout.
+
+The source is expected to answer GET RATE_SOURCE_URL?base=<pivot> with JSON of
+the form {"base": "GBP", "rates": {"USD": 1.2, "EUR": 1.13, ...}}.
+"""
+
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class RateSourceError(Exception):
+    """Raised when the upstream rate source cannot be reached or returns bad data."""
+
+
+class CircuitOpenError(RateSourceError):
+    """Raised instead of calling the rate source while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    A thread-safe circuit breaker.
+
+    After failure_threshold consecutive failures the breaker opens and every
+    call is rejected until reset_timeout seconds have passed. It then lets a
+    single trial call through (half-open). Success closes the breaker again;
+    failure re-opens it for another reset_timeout.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self):
+        """Returns True if a call may be made now."""
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+class RateSourceClient:
+    """
+    Pooled, keep-alive client for the upstream rate source.
+
+    Args:
+        base_url: URL of the rate source endpoint.
+        timeout: (connect, read) timeout in seconds applied to every request.
+        retries: Retries for connection errors and 502/503/504 responses.
+        pool_size: Maximum number of kept-alive connections to the source.
+        breaker: CircuitBreaker guarding the source.
+    """
+
+    def __init__(self, base_url, timeout=(3.05, 5.0), retries=2, pool_size=10, breaker=None):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.2,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(['GET']),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get_json(self, params=None):
+        """
+        GETs the rate source and returns the decoded JSON body.
+        Raises CircuitOpenError while the breaker is open, RateSourceError otherwise.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"Rate source {self.base_url} is unavailable")
+        try:
+            response = self.session.get(self.base_url, params=params, timeout=self.timeout)
+            response.raise_for_status()
+            data = response.json()
+        except (requests.RequestException, ValueError) as e:
+            self.breaker.record_failure()
+            raise RateSourceError(f"Rate source request failed: {e}") from e
+        self.breaker.record_success()
+        return data
+
+    def fetch_base_rates(self, base):
+        """
+        Returns {currency: Decimal rate} quoted against the base currency.
+        """
+        data = self.get_json(params={'base': base})
+        try:
+            if data.get('base', base).upper() != base.upper():
+                raise RateSourceError(f"Rate source quoted {data.get('base')} instead of {base}")
+            return {code.upper(): Decimal(str(rate)) for code, rate in data['rates'].items()}
+        except (AttributeError, KeyError, TypeError, InvalidOperation) as e:
+            raise RateSourceError(f"Malformed rate source response: {e}") from e
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Returns the process-wide RateSourceClient configured from settings, or None
+    if RATE_SOURCE_URL is not set.
+    """
+    global _client
+    url = getattr(settings, 'RATE_SOURCE_URL', None)
+    if not url:
+        return None
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = RateSourceClient(
+                    url,
+                    timeout=getattr(settings, 'RATE_SOURCE_TIMEOUT', (3.05, 5.0)),
+                    retries=getattr(settings, 'RATE_SOURCE_RETRIES', 2),
+                    pool_size=getattr(settings, 'RATE_SOURCE_POOL_SIZE', 10),
+                    breaker=CircuitBreaker(
+                        failure_threshold=getattr(settings, 'RATE_SOURCE_BREAKER_THRESHOLD', 5),
+                        reset_timeout=getattr(settings, 'RATE_SOURCE_BREAKER_RESET', 30.0),
+                    ),
+                )
+    return _client
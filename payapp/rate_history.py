@@ -0,0 +1,160 @@
+"""
+Point-in-time exchange-rate lookups over the RateHistory table.
+
+RateHistoryIndex loads the history once into one pair of parallel sorted
+arrays per currency pair (effective times as epoch seconds, and rates).
+"What was the rate at time T" is then a binary search, so re-valuing a large
+batch of transactions costs one streaming query for the history plus one
+for the transactions, not one query per row.
+
+Pairs with no direct quote are triangulated through RATE_PIVOT_CURRENCY as
+of the same instant, and never priced through an inverse quote. This is how
+rates.build_snapshot() prices pairs, so a revaluation reports the rate
+payments were actually priced at.
+"""
+
+import csv
+from array import array
+from bisect import bisect_right
+from datetime import timezone as dt_timezone
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .rates import RATE_QUANTUM
+
+ONE = Decimal(1)
+
+
+def _epoch(when):
+    if timezone.is_naive(when):
+        when = timezone.make_aware(when, dt_timezone.utc)
+    return when.timestamp()
+
+
+class RateHistoryIndex:
+    """
+    In-memory, per-pair sorted rate history supporting "rate as of T" lookups.
+    """
+
+    def __init__(self, pivot=None):
+        self.pivot = pivot or getattr(settings, 'RATE_PIVOT_CURRENCY', 'GBP')
+        self._times = {}
+        self._rates = {}
+
+    @classmethod
+    def load(cls, chunk_size=10000):
+        """Builds an index from the whole RateHistory table in one streaming query."""
+        from .models import RateHistory
+
+        index = cls()
+        rows = RateHistory.objects.order_by('base_currency', 'quote_currency', 'effective_at').values_list(
+            'base_currency', 'quote_currency', 'effective_at', 'rate'
+        )
+        for base, quote, effective_at, rate in rows.iterator(chunk_size=chunk_size):
+            index.append(base, quote, effective_at, rate)
+        return index
+
+    def append(self, base, quote, effective_at, rate):
+        """Adds a quote. Quotes for a pair must be appended in time order."""
+        key = (base, quote)
+        times = self._times.get(key)
+        if times is None:
+            times = self._times[key] = array('d')
+            self._rates[key] = []
+        ts = _epoch(effective_at)
+        if times and ts < times[-1]:
+            raise ValueError(f"Rate history for {base}/{quote} must be appended in time order")
+        times.append(ts)
+        self._rates[key].append(rate)
+
+    def _direct(self, key, ts):
+        times = self._times.get(key)
+        if times is None:
+            return None
+        i = bisect_right(times, ts)
+        return self._rates[key][i - 1] if i else None
+
+    def _pivot_leg(self, currency, ts):
+        # Like build_snapshot(), triangulate only over quotes from the pivot.
+        if currency == self.pivot:
+            return ONE
+        return self._direct((self.pivot, currency), ts)
+
+    def rate_as_of(self, from_currency, to_currency, when):
+        """
+        Returns the Decimal rate from_currency -> to_currency in effect at when,
+        or None if the history does not cover that pair at that time.
+
+        Like rates.build_snapshot(), tries a direct quote, then triangulation
+        through the pivot.
+        """
+        from_currency = from_currency.upper()
+        to_currency = to_currency.upper()
+        if from_currency == to_currency:
+            return ONE
+        ts = _epoch(when)
+        rate = self._direct((from_currency, to_currency), ts)
+        if rate is not None:
+            return rate
+        from_pivot = self._pivot_leg(from_currency, ts)
+        to_pivot = self._pivot_leg(to_currency, ts)
+        if from_pivot and to_pivot is not None:
+            return (to_pivot / from_pivot).quantize(RATE_QUANTUM)
+        return None
+
+
+def revalue_transactions(queryset, index, chunk_size=10000):
+    """
+    Re-prices transactions at the rate in effect when each was created.
+
+    Streams the queryset once and yields (transaction_id, rate, revalued_amount,
+    recorded_converted_amount) tuples; rate and revalued_amount are None where
+    the history has no rate for that time.
+    """
+    rows = queryset.order_by('id').values_list(
+        'id', 'timestamp', 'amount', 'converted_amount', 'sender__currency', 'recipient__currency'
+    )
+    for tx_id, created, amount, converted, from_currency, to_currency in rows.iterator(chunk_size=chunk_size):
+        rate = index.rate_as_of(from_currency, to_currency, created)
+        revalued = None
+        if rate is not None:
+            revalued = (amount * rate).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        yield tx_id, rate, revalued, converted
+
+
+def import_csv(fileobj, batch_size=5000):
+    """
+    Streams rate history rows from a CSV file into RateHistory.
+
+    The file needs a header row with effective_at, base_currency, quote_currency
+    and rate columns; naive timestamps are taken as UTC. Rows are inserted with
+    bulk_create in batches of batch_size so memory use stays flat however long
+    the file is. Returns the number of rows imported.
+    """
+    from .models import RateHistory
+
+    batch = []
+    total = 0
+    for line, row in enumerate(csv.DictReader(fileobj), start=2):
+        effective_at = parse_datetime(row['effective_at'].strip())
+        if effective_at is None:
+            raise ValueError(f"Line {line}: invalid effective_at {row['effective_at']!r}")
+        if timezone.is_naive(effective_at):
+            effective_at = timezone.make_aware(effective_at, dt_timezone.utc)
+        batch.append(RateHistory(
+            base_currency=row['base_currency'].strip().upper(),
+            quote_currency=row['quote_currency'].strip().upper(),
+            rate=Decimal(row['rate'].strip()),
+            effective_at=effective_at,
+        ))
+        if len(batch) >= batch_size:
+            RateHistory.objects.bulk_create(batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        RateHistory.objects.bulk_create(batch)
+        total += len(batch)
+    return total
@@ -0,0 +1,115 @@
+"""
+Exchange-rate providers used by the background rate refresher.
+
+A provider turns some rate source into a RateSnapshot. The refresher calls
+fetch(known_version) on the provider named by RATE_PROVIDER every
+RATE_REFRESH_INTERVAL seconds. fetch() returns a new snapshot, or None when
+the source still holds the version the process already has. When a lookup
+misses the snapshot, fetch_pair(from_currency, to_currency) is asked for that
+one rate; it returns None if the source cannot price the pair either.
+
+- DatabaseRateProvider reads the ExchangeRate table (the default).
+- HttpRateProvider reads base rates from RATE_SOURCE_URL through the pooled
+  rate_client.
+- StaticRateProvider serves a fixed table (RATE_STATIC_RATES, or the built-in
+  defaults). It is a local stand-in for offline development and tests.
+"""
+
+import hashlib
+from decimal import Decimal
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from . import rates
+from .rate_client import RateSourceError, get_client
+
+
+def content_version(quotes):
+    """
+    Derives a version number from the contents of a quote table, so processes
+    that fetched identical rates agree on the version (and on the ETag).
+    """
+    digest = hashlib.sha1()
+    for (from_currency, to_currency), rate in sorted(quotes.items()):
+        digest.update(f"{from_currency}{to_currency}{Decimal(str(rate)).normalize()};".encode())
+    return int(digest.hexdigest()[:15], 16)
+
+
+class DatabaseRateProvider:
+    """Builds snapshots from the ExchangeRate table, versioned by RateTableVersion."""
+
+    def fetch(self, known_version):
+        from .models import ExchangeRate, RateTableVersion
+
+        version = RateTableVersion.current()
+        if version == known_version:
+            return None
+        quotes = {
+            (from_currency, to_currency): rate
+            for from_currency, to_currency, rate in
+            ExchangeRate.objects.values_list('from_currency', 'to_currency', 'rate')
+        }
+        return rates.build_snapshot(version, quotes)
+
+    def fetch_pair(self, from_currency, to_currency):
+        from .models import ExchangeRate
+
+        pivot = getattr(settings, 'RATE_PIVOT_CURRENCY', 'GBP')
+        quotes = dict(
+            ((f, t), rate) for f, t, rate in ExchangeRate.objects.filter(
+                from_currency__in=[from_currency, pivot],
+                to_currency__in=[to_currency, from_currency],
+            ).values_list('from_currency', 'to_currency', 'rate')
+        )
+        return rates.build_snapshot(None, quotes, pivot).rate(from_currency, to_currency)
+
+
+class HttpRateProvider:
+    """Builds snapshots from the base rates served by RATE_SOURCE_URL."""
+
+    def fetch(self, known_version):
+        client = get_client()
+        if client is None:
+            raise RateSourceError("RATE_SOURCE_URL is not configured.")
+        pivot = getattr(settings, 'RATE_PIVOT_CURRENCY', 'GBP')
+        quotes = {(pivot, code): rate for code, rate in client.fetch_base_rates(pivot).items()}
+        version = content_version(quotes)
+        if version == known_version:
+            return None
+        return rates.build_snapshot(version, quotes, pivot)
+
+    def fetch_pair(self, from_currency, to_currency):
+        client = get_client()
+        if client is None:
+            return None
+        return client.fetch_base_rates(from_currency).get(to_currency)
+
+
+class StaticRateProvider:
+    """Serves RATE_STATIC_RATES (or the built-in defaults) without any I/O."""
+
+    def fetch(self, known_version):
+        quotes = getattr(settings, 'RATE_STATIC_RATES', None)
+        pivot = None
+        if not quotes:
+            quotes, pivot = rates.DEFAULT_RATES, 'GBP'
+        version = content_version(quotes)
+        if version == known_version:
+            return None
+        return rates.build_snapshot(version, quotes, pivot)
+
+    def fetch_pair(self, from_currency, to_currency):
+        return None
+
+
+_provider = None
+
+
+def get_provider():
+    """Returns the process-wide provider instance named by RATE_PROVIDER."""
+    global _provider
+    if _provider is None:
+        path = getattr(settings, 'RATE_PROVIDER', 'payapp.rate_providers.DatabaseRateProvider')
+        _provider = import_string(path)()
+    return _provider
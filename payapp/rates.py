@@ -0,0 +1,420 @@
+"""
+In-process currency rate engine for the Online Payment Service.
+
+The conversion REST endpoint, the payment helpers in payapp.views and the
+registration helper in register.views all read rates from this module, so the
+rate table lives in one place and no view has to call back into the server
+over HTTP to price a transfer.
+
+Rates are quoted as base rates against a single pivot currency
+(RATE_PIVOT_CURRENCY), plus optional direct quotes for individual pairs. Each
+process keeps an immutable snapshot holding the full N x N cross-rate matrix
+triangulated through the pivot, tagged with the version it was built from. A
+lookup is two dict hits and a list index, with no lock, no query and no
+arithmetic.
+
+Snapshots come from the provider named by RATE_PROVIDER (see
+payapp.rate_providers; by default the ExchangeRate table). A background
+RateRefresher polls the provider every RATE_REFRESH_INTERVAL seconds and swaps
+a newer snapshot in with a single assignment, so rate I/O never sits on the
+payment path.
+"""
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from decimal import Decimal, ROUND_HALF_UP
+from types import MappingProxyType
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+
+from register.currencies import CURRENCY_CODES
+
+from .singleflight import SingleFlight
+
+
+class UnsupportedConversion(ValueError):
+    """Raised when no rate is known for the requested currency pair."""
+
+
+# Base rates against GBP, used until the ExchangeRate table has been loaded.
+DEFAULT_RATES = {
+    ('GBP', 'USD'): Decimal('1.20'),
+    ('GBP', 'EUR'): Decimal('1.13'),
+}
+
+# Decimal places kept for triangulated cross rates (matches ExchangeRate.rate).
+RATE_QUANTUM = Decimal('0.00000001')
+
+
+class RateSnapshot(namedtuple('RateSnapshot', ['version', 'currencies', 'index', 'matrix'])):
+    """
+    An immutable cross-rate matrix at a given RateTableVersion.
+
+    currencies lists the known codes, index maps each code to its position and
+    matrix is a flat tuple where matrix[i * n + j] converts currencies[i] into
+    currencies[j] (None if the pair cannot be priced).
+    """
+    __slots__ = ()
+
+    def rate(self, from_currency, to_currency):
+        """Returns the Decimal rate for an upper-case pair, or None if unknown."""
+        i = self.index.get(from_currency)
+        j = self.index.get(to_currency)
+        if i is None or j is None:
+            return None
+        return self.matrix[i * len(self.currencies) + j]
+
+
+def _pivot_currency():
+    return getattr(settings, 'RATE_PIVOT_CURRENCY', 'GBP')
+
+
+def _refresh_interval():
+    return getattr(settings, 'RATE_REFRESH_INTERVAL', 30)
+
+
+def build_snapshot(version, quotes, pivot=None):
+    """
+    Builds a RateSnapshot from (from_currency, to_currency) -> rate quotes.
+
+    Quotes from the pivot currency are the base rates used to triangulate
+    every other pair (rate(a, b) = base(b) / base(a)); any other quote is a
+    direct rate that overrides the triangulated value for that pair only.
+    """
+    pivot = pivot or _pivot_currency()
+    base = {pivot: Decimal(1)}
+    direct = {}
+    for (from_currency, to_currency), rate in quotes.items():
+        if from_currency == pivot:
+            base[to_currency] = Decimal(rate)
+        else:
+            direct[(from_currency, to_currency)] = Decimal(rate)
+
+    currencies = sorted(set(base) | {c for pair in direct for c in pair})
+    index = {code: i for i, code in enumerate(currencies)}
+    one = Decimal(1)
+    matrix = []
+    for a in currencies:
+        base_a = base.get(a)
+        for b in currencies:
+            if a == b:
+                matrix.append(one)
+            elif (a, b) in direct:
+                matrix.append(direct[(a, b)])
+            elif base_a and b in base:
+                matrix.append((base[b] / base_a).quantize(RATE_QUANTUM))
+            else:
+                matrix.append(None)
+    return RateSnapshot(version, tuple(currencies), MappingProxyType(index), tuple(matrix))
+
+
+_snapshot = build_snapshot(0, DEFAULT_RATES, pivot='GBP')
+_loaded_at = None
+_refresh_lock = threading.Lock()
+_background_refresh = threading.Lock()
+_refresher = None
+# Coalesces concurrent loads of the same snapshot or currency pair.
+_flights = SingleFlight()
+# Per-pair results fetched on a snapshot miss, least recently used first:
+# (from, to) -> (version, fetched_at, rate). Bounded by RATE_PAIR_CACHE_SIZE.
+_pair_cache = OrderedDict()
+_pair_cache_lock = threading.Lock()
+
+
+def install_snapshot(snapshot):
+    """
+    Atomically replaces the process-wide snapshot. Readers holding the old
+    snapshot keep a consistent view of it.
+    """
+    global _snapshot
+    _snapshot = snapshot
+
+
+def refresh_snapshot():
+    """
+    Asks the configured rate provider for a newer snapshot and installs it.
+
+    Errors from the provider (an unreachable rate source, or a database that
+    has not been migrated yet) are reported and leave the last good snapshot
+    in place.
+    """
+    global _loaded_at
+    from .rate_client import RateSourceError
+    from .rate_providers import get_provider
+
+    with _refresh_lock:
+        try:
+            snapshot = get_provider().fetch(_snapshot.version)
+            if snapshot is not None and snapshot.currencies:
+                install_snapshot(snapshot)
+        except (DatabaseError, RateSourceError) as e:
+            print("Error refreshing exchange rates:", e)
+        finally:
+            _loaded_at = time.monotonic()
+    return _snapshot
+
+
+def _refresh_in_background():
+    """Starts a refresh without waiting for it, unless one is already running."""
+    if _refresher is not None and _refresher.is_alive():
+        _refresher.wake()
+        return
+    if not _background_refresh.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            refresh_snapshot()
+        finally:
+            # This thread owns its connection; the caller's stays open.
+            close_old_connections()
+            _background_refresh.release()
+
+    threading.Thread(target=run, name='rate-refresh', daemon=True).start()
+
+
+def invalidate():
+    """Refreshes the snapshot in the background after a local rate change."""
+    _refresh_in_background()
+
+
+def _first_load():
+    # The refresher starts with the first reader rather than in AppConfig.ready(),
+    # so loading Django (migrate, shell, tests) never spawns threads.
+    if getattr(settings, 'RATE_REFRESHER_ENABLED', True):
+        start_refresher()
+    return refresh_snapshot()
+
+
+def current_snapshot():
+    """
+    Returns the last good RateSnapshot immediately (stale-while-revalidate).
+
+    The first call in a process loads the rates synchronously. After that a
+    snapshot older than RATE_REFRESH_INTERVAL is still served as-is while a
+    refresh runs in the background, so readers never wait on rate I/O.
+    """
+    if _loaded_at is None:
+        return _flights.do('snapshot', _first_load)
+    if time.monotonic() - _loaded_at >= _refresh_interval() and not _refresh_lock.locked():
+        _refresh_in_background()
+    return _snapshot
+
+
+class RateRefresher(threading.Thread):
+    """
+    Daemon thread that refreshes the rate snapshot every RATE_REFRESH_INTERVAL
+    seconds. wake() makes it refresh straight away. The first load is left to
+    the first reader, so starting the thread never touches the database.
+    """
+
+    def __init__(self, interval):
+        super().__init__(name='rate-refresher', daemon=True)
+        self.interval = interval
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopped.is_set():
+                break
+            try:
+                refresh_snapshot()
+            finally:
+                close_old_connections()
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+
+def start_refresher():
+    """Starts the process-wide RateRefresher if it is not already running."""
+    global _refresher
+    if _refresher is None or not _refresher.is_alive():
+        _refresher = RateRefresher(_refresh_interval())
+        _refresher.start()
+    return _refresher
+
+
+def _fetch_missing_pair(from_currency, to_currency, snapshot):
+    """
+    Asks the provider for a pair the snapshot cannot price (for example a
+    currency added since the last refresh). Concurrent misses on the same pair
+    share one upstream lookup, and the answer (including "unsupported") is
+    remembered for RATE_REFRESH_INTERVAL or until the snapshot changes.
+
+    Codes that are not ISO 4217 currencies (register.currencies) are refused
+    without a lookup, so junk from the public conversion endpoints can neither
+    reach the provider nor fill the cache.
+    """
+    if from_currency not in CURRENCY_CODES or to_currency not in CURRENCY_CODES:
+        return None
+    key = (from_currency, to_currency)
+    with _pair_cache_lock:
+        cached = _pair_cache.get(key)
+        if cached is not None:
+            _pair_cache.move_to_end(key)
+    if cached is not None and cached[0] == snapshot.version and time.monotonic() - cached[1] < _refresh_interval():
+        return cached[2]
+
+    def fetch():
+        from .rate_client import RateSourceError
+        from .rate_providers import get_provider
+
+        try:
+            rate = get_provider().fetch_pair(from_currency, to_currency)
+        except (DatabaseError, RateSourceError) as e:
+            print("Error fetching exchange rate:", e)
+            rate = None
+        with _pair_cache_lock:
+            _pair_cache[key] = (snapshot.version, time.monotonic(), rate)
+            _pair_cache.move_to_end(key)
+            while len(_pair_cache) > getattr(settings, 'RATE_PAIR_CACHE_SIZE', 1024):
+                _pair_cache.popitem(last=False)
+        return rate
+
+    return _flights.do(key, fetch)
+
+
+def lookup_stats():
+    """Returns counters describing rate lookups in this process."""
+    snapshot = _snapshot
+    return {
+        'version': snapshot.version,
+        'currencies': len(snapshot.currencies),
+        'upstream_lookups': _flights.stats(),
+        'cached_pairs': len(_pair_cache),
+    }
+
+
+def get_rate(from_currency, to_currency, snapshot=None):
+    """
+    Returns the Decimal multiplier converting from_currency into to_currency.
+
+    Uses the given snapshot, or the current one. Same-currency conversions
+    always have a rate of 1. Raises UnsupportedConversion if the pair is not
+    in the rate table.
+    """
+    from_currency = from_currency.upper()
+    to_currency = to_currency.upper()
+    if from_currency == to_currency:
+        return Decimal('1.0')
+    snapshot = snapshot or current_snapshot()
+    rate = snapshot.rate(from_currency, to_currency)
+    if rate is None:
+        rate = _fetch_missing_pair(from_currency, to_currency, snapshot)
+    if rate is None:
+        raise UnsupportedConversion(f"Unsupported currency conversion {from_currency} -> {to_currency}")
+    return rate
+
+
+def batch_rates(pairs):
+    """
+    Looks up the rates for many (from_currency, to_currency) pairs in one pass
+    over a single snapshot, so every result is priced at the same version.
+
+    Returns a tuple of (version, rates) where rates is a list aligned with pairs
+    holding the Decimal rate for each pair, or None if the snapshot cannot
+    price it. Unlike get_rate(), a miss is not looked up with the provider:
+    one batch could otherwise make an upstream call per distinct pair.
+    """
+    snapshot = current_snapshot()
+    one = Decimal('1.0')
+    seen = {}
+    results = []
+    for from_currency, to_currency in pairs:
+        key = (from_currency, to_currency)
+        if key not in seen:
+            from_upper = from_currency.upper()
+            to_upper = to_currency.upper()
+            seen[key] = one if from_upper == to_upper else snapshot.rate(from_upper, to_upper)
+        results.append(seen[key])
+    return snapshot.version, results
+
+
+def convert(amount, from_currency, to_currency):
+    """
+    Converts a Decimal amount between currencies, rounded to 2 decimal places.
+    """
+    rate = get_rate(from_currency, to_currency)
+    return (amount * rate).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def store_base_rates(base_rates, pivot=None):
+    """
+    Upserts {currency: rate} base rates quoted against the pivot currency and
+    bumps the rate table version once for the whole set.
+
+    Direct quotes between two other currencies would keep overriding the
+    triangulated rate in build_snapshot(), so in the same transaction every
+    one that the pivot rates can price is rewritten to the triangulated rate.
+    Returns the number of base rates stored.
+    """
+    from django.db import transaction
+    from django.utils import timezone
+    from .models import ExchangeRate, RateHistory, RateTableVersion
+
+    pivot = pivot or _pivot_currency()
+    rows = [
+        ExchangeRate(from_currency=pivot, to_currency=code, rate=Decimal(rate).quantize(RATE_QUANTUM))
+        for code, rate in base_rates.items() if code != pivot
+    ]
+    now = timezone.now()
+    with transaction.atomic():
+        ExchangeRate.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['from_currency', 'to_currency'],
+            update_fields=['rate', 'updated_at'],
+        )
+        base = dict(ExchangeRate.objects.filter(from_currency=pivot).values_list('to_currency', 'rate'))
+        base[pivot] = Decimal(1)
+        crosses = [
+            ExchangeRate(from_currency=from_currency, to_currency=to_currency,
+                         rate=(base[to_currency] / base[from_currency]).quantize(RATE_QUANTUM))
+            for from_currency, to_currency in ExchangeRate.objects.exclude(from_currency=pivot)
+            .select_for_update().values_list('from_currency', 'to_currency')
+            if base.get(from_currency) and to_currency in base
+        ]
+        ExchangeRate.objects.bulk_create(
+            crosses,
+            update_conflicts=True,
+            unique_fields=['from_currency', 'to_currency'],
+            update_fields=['rate', 'updated_at'],
+        )
+        RateHistory.objects.bulk_create([
+            RateHistory(base_currency=row.from_currency, quote_currency=row.to_currency,
+                        rate=row.rate, effective_at=now)
+            for row in rows + crosses
+        ])
+        RateTableVersion.bump()
+        transaction.on_commit(invalidate)
+    return len(rows)
+
+
+def on_rate_change(sender, instance, **kwargs):
+    """
+    Signal handler for ExchangeRate saves and deletes: records a saved rate in
+    RateHistory, bumps the shared version so every worker reloads, and makes
+    this process revalidate immediately.
+    """
+    from django.db import transaction
+    from .models import RateHistory, RateTableVersion
+
+    if 'created' in kwargs:
+        RateHistory.objects.create(
+            base_currency=instance.from_currency,
+            quote_currency=instance.to_currency,
+            rate=instance.rate,
+            effective_at=instance.updated_at,
+        )
+    RateTableVersion.bump()
+    transaction.on_commit(invalidate)
@@ -0,0 +1,324 @@
+"""
+Queued payments, settled in batches.
+
+With PAYMENT_QUEUE_ENABLED, make_payment validates the payment, prices the
+conversion and inserts a QueuedPayment. It does not lock any account or wait
+for the timestamp service. A settlement worker then settles queued payments
+PAYMENT_SETTLE_BATCH at a time, all in one database transaction: one commit,
+and one fsync, per batch instead of per payment.
+
+Each batch:
+
+1. claims the oldest queued payments with SELECT ... FOR UPDATE SKIP LOCKED,
+   so several workers (threads or `manage.py settle_payments` processes) can
+   drain the queue together;
+2. drops any payment whose sender has an older queued payment claimed by
+   another worker, so each sender's payments settle in the order they were
+   made;
+3. locks every account involved in one query, in id order, and checks funds
+   payment by payment in queue order. A payment the sender cannot cover fails
+   and the rest still settle;
+4. applies the balance changes with set-based UPDATEs, then bulk-inserts the
+   Transaction rows and ledger entries and marks the queued rows.
+
+Recipients with striping enabled (payapp/striping.py) are not locked, as in
+transfers.transfer(). Each is credited with one UPDATE of one of its shards,
+its credits do not count towards its spendable balance in the funds check,
+and only the senders' side of those payments goes into the ledger until the
+shards are consolidated.
+
+Settled transactions are committed without a remote timestamp and stamped by
+the stamper afterwards (payapp/stamping.py), so no batch holds its account
+locks across a timestamp RPC.
+
+The in-process settler starts with the first payment queued by the process,
+or the first status poll of a payment still queued. Payments left queued
+across a restart therefore wait for one of those. Run `manage.py
+settle_payments` (with PAYMENT_SETTLER_IN_PROCESS = False) to have them
+settled regardless of traffic.
+
+With PAYMENT_NETTING_WINDOW set, the worker settles once per window rather
+than as soon as payments are queued. Each batch is then netted: one pass over
+its payments sums every account's net position, and funds are checked
+against balance plus net position. A payment back and forth between a chatty
+pair settles even when the payer could not cover it on its own. If an
+account would still go negative, its newest outgoing payments fail one by
+one until it would not. The accounts' balances are then updated once each,
+as in any batch. Every payment keeps its own Transaction row and ledger
+entries.
+
+Clients poll GET /webapps2025/pay/queued/<id>/ for the outcome.
+"""
+
+import threading
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import close_old_connections, transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from . import ledger, striping
+from .models import QueuedPayment, Transaction
+from .stamping import request_stamp
+from .transfers import UnknownAccount, apply_balance_deltas, lock_balances
+
+_stats = {'settled': 0, 'failed': 0, 'batches': 0, 'balance_writes': 0, 'pairs': 0, 'last_error': None}
+_settler = None
+
+
+def queue_enabled():
+    return getattr(settings, 'PAYMENT_QUEUE_ENABLED', False)
+
+
+def enqueue(sender, recipient, amount, converted_amount):
+    """
+    Queues a payment for settlement and wakes the settler once the caller's
+    transaction commits. Returns the QueuedPayment.
+    """
+    payment = QueuedPayment.objects.create(
+        sender=sender,
+        recipient=recipient,
+        amount=amount,
+        converted_amount=converted_amount,
+    )
+    transaction.on_commit(request_settlement)
+    return payment
+
+
+def netting_window():
+    """Seconds between netted settlements, or 0 to settle payments as they arrive."""
+    return getattr(settings, 'PAYMENT_NETTING_WINDOW', 0)
+
+
+def queued_payments():
+    """Payments still waiting to be settled."""
+    return QueuedPayment.objects.filter(status='Queued')
+
+
+def _in_sender_order(claimed):
+    """
+    The claimed payments that can settle now: those with no older queued
+    payment from the same sender held by another worker.
+    """
+    held = dict(
+        queued_payments()
+        .filter(sender_id__in={p.sender_id for p in claimed}, id__lt=claimed[-1].id)
+        .exclude(id__in=[p.id for p in claimed])
+        .values('sender_id')
+        .annotate(first=Min('id'))
+        .values_list('sender_id', 'first')
+    )
+    return [p for p in claimed if p.sender_id not in held or p.id < held[p.sender_id]]
+
+
+def _fail(payment, reason):
+    payment.status = 'Failed'
+    payment.failure_reason = reason
+
+
+def _check_in_order(batch, balances, striped):
+    """
+    Funds check payment by payment in queue order. Credits to striped
+    accounts are not spendable yet. Returns the payments that settle.
+    """
+    settled = []
+    for payment in batch:
+        if balances[payment.sender_id] < payment.amount:
+            _fail(payment, "Insufficient funds")
+            continue
+        balances[payment.sender_id] -= payment.amount
+        if payment.recipient_id not in striped:
+            balances[payment.recipient_id] += payment.converted_amount
+        settled.append(payment)
+    return settled
+
+
+def _check_net(batch, balances, striped):
+    """
+    Funds check on each account's net position over the whole batch. While an
+    account would end below zero, its newest outgoing payment fails, which
+    may leave that payment's recipient short in turn. Credits to striped
+    accounts are not spendable yet. Returns the payments that settle.
+    """
+    net = defaultdict(Decimal)
+    outgoing = defaultdict(list)
+    for payment in batch:
+        net[payment.sender_id] -= payment.amount
+        if payment.recipient_id not in striped:
+            net[payment.recipient_id] += payment.converted_amount
+        outgoing[payment.sender_id].append(payment)
+    short = [account_id for account_id in net if balances[account_id] + net[account_id] < 0]
+    while short:
+        account_id = short.pop()
+        while balances[account_id] + net[account_id] < 0:
+            payment = outgoing[account_id].pop()
+            _fail(payment, "Insufficient funds for the settlement window")
+            net[account_id] += payment.amount
+            if payment.recipient_id in striped:
+                continue
+            net[payment.recipient_id] -= payment.converted_amount
+            if balances[payment.recipient_id] + net[payment.recipient_id] < 0:
+                short.append(payment.recipient_id)
+    return [payment for payment in batch if payment.status != 'Failed']
+
+
+def settle_batch(batch_size=None):
+    """
+    Settles up to batch_size queued payments in one transaction, netted if
+    PAYMENT_NETTING_WINDOW is set.
+
+    Returns the number of payments settled or failed.
+    """
+    batch_size = batch_size or getattr(settings, 'PAYMENT_SETTLE_BATCH', 500)
+    with transaction.atomic():
+        claimed = list(queued_payments().order_by('id').select_for_update(skip_locked=True)[:batch_size])
+        if not claimed:
+            return 0
+        batch = _in_sender_order(claimed)
+        senders = {p.sender_id for p in batch}
+        striped = dict(
+            get_user_model().objects.filter(pk__in={p.recipient_id for p in batch}, balance_shards__gt=0)
+            .values_list('id', 'balance_shards')
+        )
+        locked = lock_balances(senders | ({p.recipient_id for p in batch} - striped.keys()))
+
+        balances = {account_id: balance for account_id, (balance, _) in locked.items()}
+        settled = (_check_net if netting_window() else _check_in_order)(batch, balances, striped)
+        deltas = defaultdict(Decimal)
+        counts = defaultdict(int)
+        shard_credits = defaultdict(Decimal)
+        for payment in settled:
+            deltas[payment.sender_id] -= payment.amount
+            counts[payment.sender_id] += 1
+            if payment.recipient_id in striped:
+                shard_credits[payment.recipient_id] += payment.converted_amount
+            else:
+                deltas[payment.recipient_id] += payment.converted_amount
+                counts[payment.recipient_id] += 1
+
+        if settled:
+            apply_balance_deltas(deltas, counts)
+            for account_id, credit in shard_credits.items():
+                if not striping.credit_shard(account_id, striped[account_id], credit):
+                    raise UnknownAccount(f"Account {account_id} does not exist")
+            records = Transaction.objects.bulk_create([
+                Transaction(
+                    sender_id=payment.sender_id,
+                    recipient_id=payment.recipient_id,
+                    transaction_type='PAYMENT',
+                    amount=payment.amount,
+                    converted_amount=payment.converted_amount,
+                    status='Completed',
+                )
+                for payment in settled
+            ])
+            transaction.on_commit(request_stamp)
+            debits = []
+            credits = []
+            in_order = []
+            for payment, record in zip(settled, records):
+                payment.status = 'Settled'
+                payment.transaction = record
+                debits.append((payment.sender_id, -payment.amount, record))
+                in_order.append(debits[-1])
+                if payment.recipient_id not in striped:
+                    credits.append((payment.recipient_id, payment.converted_amount, record))
+                    in_order.append(credits[-1])
+            if netting_window():
+                # Credits first, so no running balance in the ledger dips below zero mid-window.
+                ledger.record_entries(locked, credits + debits)
+            else:
+                ledger.record_entries(locked, in_order)
+
+        now = timezone.now()
+        for payment in batch:
+            payment.settled_at = now
+        QueuedPayment.objects.bulk_update(batch, ['status', 'failure_reason', 'transaction', 'settled_at'])
+    striping.note_credits(payment.recipient_id for payment in settled)
+    _stats['balance_writes'] += len(deltas)
+    _stats['pairs'] += len({frozenset((p.sender_id, p.recipient_id)) for p in settled})
+    _stats['settled'] += len(settled)
+    _stats['failed'] += len(batch) - len(settled)
+    _stats['batches'] += 1
+    return len(batch)
+
+
+def settle_all(batch_size=None):
+    """Settles batches until nothing is left to claim. Returns the number processed."""
+    total = 0
+    while True:
+        count = settle_batch(batch_size)
+        if not count:
+            return total
+        total += count
+
+
+def settlement_stats():
+    """The queue's length and the age in seconds of its oldest payment, plus this process's counters."""
+    oldest = queued_payments().aggregate(oldest=Min('created_at'))['oldest']
+    return dict(
+        _stats,
+        enabled=queue_enabled(),
+        netting_window=netting_window(),
+        queued=queued_payments().count(),
+        oldest_queued_age=round((timezone.now() - oldest).total_seconds(), 3) if oldest else 0.0,
+    )
+
+
+class PaymentSettler(threading.Thread):
+    """
+    Daemon thread that settles queued payments every interval seconds, or
+    straight away when wake() is called after a payment is queued. With
+    netting, wake() is ignored so that payments collect for the whole window.
+    """
+
+    def __init__(self, interval, netting=False):
+        super().__init__(name='payment-settler', daemon=True)
+        self.interval = interval
+        self.netting = netting
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopped.is_set():
+                break
+            close_old_connections()
+            try:
+                settle_all()
+            except Exception as e:
+                _stats['last_error'] = str(e)
+                print("Error settling payments:", e)
+                time.sleep(self.interval)
+            finally:
+                close_old_connections()
+
+    def wake(self):
+        if not self.netting:
+            self._wake.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+
+def start_settler():
+    """Starts the process-wide PaymentSettler if it is not already running."""
+    global _settler
+    if _settler is None or not _settler.is_alive():
+        window = netting_window()
+        _settler = PaymentSettler(window or getattr(settings, 'PAYMENT_SETTLE_INTERVAL', 1.0), netting=bool(window))
+        _settler.start()
+    return _settler
+
+
+def request_settlement():
+    """Called once a queued payment has committed."""
+    if getattr(settings, 'PAYMENT_SETTLER_IN_PROCESS', True):
+        start_settler().wake()
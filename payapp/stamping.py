@@ -0,0 +1,186 @@
+"""
+Remote timestamping off the payment commit path.
+
+With TIMESTAMP_ASYNC_STAMPING enabled, payments and requests commit with a
+NULL remote timestamp and never wait on the Thrift service inside their
+transaction. A TimestampStamper thread (or the stamp_transactions management
+command) then stamps pending rows in id order, TIMESTAMP_STAMP_BATCH at a
+time: one getTimestamps() call per batch, then one bulk UPDATE.
+
+The RPC happens before any row is locked, and rows are claimed with
+SKIP LOCKED, so several workers can run side by side. When the service is
+down the worker backs off exponentially, up to TIMESTAMP_STAMP_MAX_BACKOFF
+seconds. Without async stamping, a transaction committed while the service
+was unreachable is left to the same stamper rather than kept unstamped.
+
+A stamp filled in afterwards records when the transaction was stamped, not
+when it was made; the transaction's own timestamp column still holds the
+latter.
+"""
+
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from .models import Transaction
+from .timestamps import epoch_millis, get_remote_timestamp, get_remote_timestamps
+
+_stats = {'stamped': 0, 'batches': 0, 'failures': 0, 'last_error': None}
+_stamper = None
+
+
+def async_stamping_enabled():
+    return getattr(settings, 'TIMESTAMP_ASYNC_STAMPING', False)
+
+
+def stamp_or_defer():
+    """
+    Returns the remote timestamp for a transaction being created. With async
+    stamping this is None, and the stamper is woken once the caller's
+    transaction commits; otherwise it is fetched from the service now, and
+    only left to the stamper if the service cannot be reached.
+    """
+    stamp = None if async_stamping_enabled() else get_remote_timestamp()
+    if stamp is None:
+        transaction.on_commit(request_stamp)
+    return stamp
+
+
+def stamp_or_defer_many(count):
+    """
+    stamp_or_defer() for count transactions created together: a list of
+    count timestamps from one batched RPC, or of None if they are deferred to
+    the stamper (or the service is unreachable).
+    """
+    stamps = None if async_stamping_enabled() else get_remote_timestamps(count)
+    if stamps is None:
+        transaction.on_commit(request_stamp)
+        return [None] * count
+    return stamps
+
+
+def pending_transactions():
+    """Transactions still waiting for a remote timestamp."""
+    return Transaction.objects.filter(remote_timestamp__isnull=True)
+
+
+def stamp_pending(batch_size=None):
+    """
+    Stamps up to batch_size pending transactions.
+
+    Returns the number of rows stamped. Raises RuntimeError if the timestamp
+    service could not be reached.
+    """
+    batch_size = batch_size or getattr(settings, 'TIMESTAMP_STAMP_BATCH', 500)
+    ids = list(pending_transactions().order_by('id').values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return 0
+    stamps = get_remote_timestamps(len(ids))
+    if stamps is None:
+        _stats['failures'] += 1
+        _stats['last_error'] = "timestamp service unavailable"
+        raise RuntimeError("Timestamp service unavailable; pending transactions left unstamped.")
+    with transaction.atomic():
+        # Rows another worker is stamping right now are skipped, not waited on.
+        rows = list(
+            pending_transactions().filter(id__in=ids).order_by('id')
+            .select_for_update(skip_locked=True).only('id')
+        )
+        for tx, stamp in zip(rows, stamps):
+            tx.remote_timestamp = stamp
+            tx.remote_epoch_ms = epoch_millis(stamp)
+        Transaction.objects.bulk_update(rows, ['remote_timestamp', 'remote_epoch_ms'])
+    _stats['stamped'] += len(rows)
+    _stats['batches'] += 1
+    _stats['last_error'] = None
+    return len(rows)
+
+
+def stamp_all_pending(batch_size=None):
+    """Stamps batches until nothing is pending. Returns the number stamped."""
+    total = 0
+    while True:
+        count = stamp_pending(batch_size)
+        if not count:
+            return total
+        total += count
+
+
+def stamping_stats():
+    """
+    How far stamping has fallen behind: the number of unstamped transactions
+    and the age in seconds of the oldest, plus this process's worker counters.
+    """
+    oldest = pending_transactions().aggregate(oldest=Min('timestamp'))['oldest']
+    return dict(
+        _stats,
+        enabled=async_stamping_enabled(),
+        pending=pending_transactions().count(),
+        oldest_pending_age=round((timezone.now() - oldest).total_seconds(), 3) if oldest else 0.0,
+    )
+
+
+class TimestampStamper(threading.Thread):
+    """
+    Daemon thread that stamps pending transactions every interval seconds, or
+    straight away when wake() is called after a commit. Failures back off
+    exponentially up to max_backoff seconds.
+    """
+
+    def __init__(self, interval, max_backoff):
+        super().__init__(name='timestamp-stamper', daemon=True)
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._backoff_until = 0.0
+
+    def run(self):
+        delay = self.interval
+        while True:
+            self._wake.wait(delay)
+            self._wake.clear()
+            if self._stopped.is_set():
+                break
+            close_old_connections()
+            try:
+                stamp_all_pending()
+                delay = self.interval
+            except Exception as e:
+                _stats['last_error'] = str(e)
+                print("Error stamping transactions:", e)
+                delay = min(delay * 2, self.max_backoff)
+                self._backoff_until = time.monotonic() + delay
+            finally:
+                close_old_connections()
+
+    def wake(self):
+        # While backing off, new commits wait for the retry rather than hammer the service.
+        if time.monotonic() >= self._backoff_until:
+            self._wake.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+
+def start_stamper():
+    """Starts the process-wide TimestampStamper if it is not already running."""
+    global _stamper
+    if _stamper is None or not _stamper.is_alive():
+        _stamper = TimestampStamper(
+            getattr(settings, 'TIMESTAMP_STAMP_INTERVAL', 1.0),
+            getattr(settings, 'TIMESTAMP_STAMP_MAX_BACKOFF', 60.0),
+        )
+        _stamper.start()
+    return _stamper
+
+
+def request_stamp():
+    """Called once a transaction with no remote timestamp has committed."""
+    if getattr(settings, 'TIMESTAMP_STAMPER_IN_PROCESS', True):
+        start_stamper().wake()
@@ -0,0 +1,138 @@
+"""
+Balance striping for hot accounts.
+
+Every payment locks its payee's CustomUser row, so a merchant receiving
+thousands of payments a minute serializes all of them on that one row. With
+striping enabled for an account (CustomUser.balance_shards = N, set by
+`manage.py stripe_account`), transfers.transfer() credits one of the
+account's N AccountShard rows at random instead. Only that shard row is
+locked, and the payee's own row is not locked at all, so contention on it
+drops by about N times.
+
+Shard balances are not spendable, and are not in the ledger, until they
+are consolidated. `python manage.py consolidate_shards` locks the account
+and its shards and moves each shard's balance into CustomUser.balance, with
+one ledger entry per shard. The account's full balance is
+CustomUser.balance plus unconsolidated_balance().
+
+hot_accounts() reports the accounts credited most often by this process
+over the last HOT_ACCOUNT_WINDOW seconds, to show which accounts need
+striping.
+"""
+
+import random
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F, Sum
+
+from . import ledger, transfers
+from .models import AccountShard
+
+_lock = threading.Lock()
+_window = {'started': time.monotonic(), 'current': Counter(), 'previous': Counter()}
+
+
+def set_shards(account_id, shards):
+    """
+    Stripes account_id's incoming credits over shards rows (0 turns striping
+    off). Existing shard balances are kept until they are consolidated.
+    """
+    with transaction.atomic():
+        get_user_model().objects.filter(pk=account_id).update(balance_shards=shards)
+        AccountShard.objects.bulk_create(
+            [AccountShard(account_id=account_id, shard=shard) for shard in range(shards)],
+            ignore_conflicts=True,
+        )
+
+
+def credit_shard(account_id, shards, amount):
+    """
+    Adds amount to one of the account's shards, chosen at random. Returns
+    False if the shard row does not exist, i.e. the account is gone.
+    """
+    shard = random.randrange(shards)
+    return bool(AccountShard.objects.filter(account_id=account_id, shard=shard).update(
+        balance=F('balance') + amount,
+        credits=F('credits') + 1,
+    ))
+
+
+def unconsolidated_balance(account_id):
+    """Credits waiting in the account's shards (0.00 for unstriped accounts)."""
+    total = AccountShard.objects.filter(account_id=account_id, credits__gt=0).aggregate(total=Sum('balance'))['total']
+    return (total or Decimal('0')).quantize(Decimal('0.01'))
+
+
+def consolidate(account_id):
+    """
+    Moves the account's shard balances into its balance, writing one ledger
+    entry per shard. Returns the amount moved.
+    """
+    with transaction.atomic():
+        # Account row first, then shards: transfers lock in the same order.
+        locked = transfers.lock_balances([account_id])
+        shards = list(
+            AccountShard.objects.select_for_update().filter(account_id=account_id, credits__gt=0)
+            .order_by('shard').values_list('shard', 'balance')
+        )
+        if not locked or not shards:
+            return Decimal('0.00')
+        AccountShard.objects.filter(account_id=account_id, shard__in=[shard for shard, _ in shards]).update(
+            balance=Decimal('0.00'),
+            credits=0,
+        )
+        total = sum((balance for _, balance in shards), Decimal('0.00'))
+        transfers.apply_balance_deltas({account_id: total}, {account_id: len(shards)})
+        ledger.record_entries(locked, [(account_id, balance, None) for _, balance in shards])
+    return total
+
+
+def consolidate_all():
+    """Consolidates every account with credits in its shards. Returns the number of accounts."""
+    accounts = AccountShard.objects.filter(credits__gt=0).values_list('account_id', flat=True).distinct()
+    count = 0
+    for account_id in list(accounts):
+        consolidate(account_id)
+        count += 1
+    return count
+
+
+def note_credits(account_ids):
+    """Counts credits to the given accounts towards hot_accounts()."""
+    window = getattr(settings, 'HOT_ACCOUNT_WINDOW', 60)
+    with _lock:
+        now = time.monotonic()
+        if now - _window['started'] >= window:
+            # After a quiet spell of more than a whole window, the last counts are stale.
+            _window['previous'] = _window['current'] if now - _window['started'] < 2 * window else Counter()
+            _window['current'] = Counter()
+            _window['started'] = now
+        _window['current'].update(account_ids)
+
+
+def hot_accounts(limit=10):
+    """
+    The accounts this process credited most often in the last complete
+    HOT_ACCOUNT_WINDOW, with their credit rate and striping.
+    """
+    window = getattr(settings, 'HOT_ACCOUNT_WINDOW', 60)
+    with _lock:
+        top = (_window['previous'] or _window['current']).most_common(limit)
+    shards = dict(
+        get_user_model().objects.filter(pk__in=[account_id for account_id, _ in top])
+        .values_list('id', 'balance_shards')
+    )
+    return [
+        {
+            'account': account_id,
+            'credits_per_minute': round(count * 60 / window, 1),
+            'balance_shards': shards.get(account_id, 0),
+        }
+        for account_id, count in top
+    ]
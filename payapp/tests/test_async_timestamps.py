@@ -0,0 +1,131 @@
+import asyncio
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from payapp import timestamps
+from payapp.async_timestamps import AsyncTimestampPool, aget_remote_timestamp, aget_remote_timestamps
+from payapp.timestamps import TimestampBalancer, TimestampClientPool, TimestampUnavailable
+
+from .utils import start_timestamp_server
+
+
+class AsyncTimestampPoolTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.port = start_timestamp_server()
+        cls.framed_port = start_timestamp_server('nonblocking')
+
+    async def test_buffered_replies_are_decoded(self):
+        pool = AsyncTimestampPool('127.0.0.1', self.port)
+        first = await pool.call('getTimestamp')
+        # Large enough to arrive over several reads.
+        block = await pool.call('getTimestamps', 2000)
+        self.assertEqual(len(block), 2000)
+        self.assertEqual([first] + block, sorted(set([first] + block)))
+
+    async def test_framed_replies_are_decoded(self):
+        pool = AsyncTimestampPool('127.0.0.1', self.framed_port, framed=True)
+        self.assertEqual(len(await pool.call('getTimestamps', 2000)), 2000)
+        self.assertIsInstance(await pool.call('getEpochMillis'), int)
+
+    async def test_connection_is_reused(self):
+        pool = AsyncTimestampPool('127.0.0.1', self.port)
+        await pool.call('getTimestamp')
+        conn = pool._idle[0]
+        await pool.call('getTimestamp')
+        self.assertEqual(pool._idle, [conn])
+
+    async def test_closed_connection_is_replaced(self):
+        pool = AsyncTimestampPool('127.0.0.1', self.port)
+        await pool.call('getTimestamp')
+        broken = pool._idle[0]
+        broken.close()
+        self.assertTrue(await pool.call('getTimestamp'))
+        self.assertIsNot(pool._idle[0], broken)
+
+    async def test_call_on_a_broken_connection_is_retried(self):
+        pool = AsyncTimestampPool('127.0.0.1', self.port)
+        await pool.call('getTimestamp')
+        broken = pool._idle[0]
+        broken.reader.feed_eof()
+        # Let it past the checkout check, as a connection dropped mid-call would be.
+        broken.is_closing = lambda: False
+        self.assertTrue(await pool.call('getTimestamp'))
+        self.assertIsNot(pool._idle[0], broken)
+
+    async def test_unreachable_server_raises_unavailable(self):
+        pool = AsyncTimestampPool('127.0.0.1', 1, timeout=0.5)
+        with self.assertRaises(TimestampUnavailable):
+            await pool.call('getTimestamp')
+
+    async def test_remote_timestamps_from_the_configured_servers(self):
+        with mock.patch.object(timestamps, '_pool', None), \
+                override_settings(TIMESTAMP_SERVICE_ENDPOINTS=[f'127.0.0.1:{self.port}']):
+            stamps = await aget_remote_timestamps(3)
+        self.assertEqual(stamps, sorted(set(stamps)))
+
+    async def test_unreachable_service_gives_no_timestamp(self):
+        with mock.patch.object(timestamps, '_pool', None), \
+                override_settings(TIMESTAMP_SERVICE_ENDPOINTS=['127.0.0.1:1'], TIMESTAMP_TIMEOUT_MS=500):
+            self.assertIsNone(await aget_remote_timestamp())
+
+
+class FakeAsyncPool:
+    def __init__(self, answer='stamp', delay=0.0):
+        self.answer = answer
+        self.delay = delay
+        self.calls = 0
+        self.cancelled = 0
+
+    async def call(self, method, *args):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if isinstance(self.answer, Exception):
+            raise self.answer
+        return self.answer
+
+
+class AsyncBalancerTests(SimpleTestCase):
+    def make_balancer(self, *async_pools, **kwargs):
+        sync_pools = [TimestampClientPool('127.0.0.1', 20000 + i) for i in range(len(async_pools))]
+        balancer = TimestampBalancer(sync_pools, **kwargs)
+        return balancer, {e.name: pool for e, pool in zip(balancer.endpoints, async_pools)}
+
+    async def test_async_failures_eject_the_endpoint_for_sync_calls_too(self):
+        down = FakeAsyncPool(TimestampUnavailable('down'))
+        balancer, pools = self.make_balancer(down, FakeAsyncPool('ok'), eject_after=2)
+        for _ in range(2):
+            self.assertEqual(await balancer.acall(pools, 'getTimestamp'), 'ok')
+        self.assertEqual(down.calls, 2)
+        self.assertTrue(balancer.stats()['endpoints']['127.0.0.1:20000']['ejected'])
+        self.assertEqual(await balancer.acall(pools, 'getTimestamp'), 'ok')
+        self.assertEqual(down.calls, 2)
+
+    async def test_every_endpoint_failing_raises_unavailable(self):
+        balancer, pools = self.make_balancer(FakeAsyncPool(TimestampUnavailable('a')),
+                                             FakeAsyncPool(TimestampUnavailable('b')))
+        with self.assertRaises(TimestampUnavailable):
+            await balancer.acall(pools, 'getTimestamp')
+
+    async def test_slow_call_is_hedged_and_the_loser_cancelled(self):
+        slow = FakeAsyncPool('slow', delay=5.0)
+        balancer, pools = self.make_balancer(slow, FakeAsyncPool('fast'), hedge_after_ms=20)
+        self.assertEqual(await asyncio.wait_for(balancer.acall(pools, 'getTimestamp'), 2.0), 'fast')
+        self.assertEqual(balancer.hedges, 1)
+        await asyncio.sleep(0)
+        self.assertEqual(slow.cancelled, 1)
+        self.assertEqual(balancer.stats()['endpoints']['127.0.0.1:20000']['inflight'], 0)
+
+    @override_settings(TIMESTAMP_LEASE_SIZE=10)
+    async def test_leased_stamps_come_from_the_shared_lease(self):
+        lease = mock.Mock()
+        lease.take.return_value = ['a', 'b']
+        with mock.patch.object(timestamps, '_lease', lease), mock.patch.object(timestamps, '_pool', mock.Mock()):
+            self.assertEqual(await aget_remote_timestamps(2), ['a', 'b'])
+        lease.take.assert_called_once_with(2)
@@ -0,0 +1,102 @@
+import json
+from decimal import Decimal
+
+from django.test import SimpleTestCase, override_settings
+
+from .utils import use_rates
+
+QUOTES = {('GBP', 'USD'): Decimal('1.20'), ('GBP', 'EUR'): Decimal('1.13')}
+
+
+class BatchConversionTests(SimpleTestCase):
+    def setUp(self):
+        use_rates(self, QUOTES, version=7)
+
+    def post(self, payload):
+        return self.client.post('/conversion/batch/', json.dumps(payload), content_type='application/json')
+
+    def test_items_are_converted_in_input_order(self):
+        response = self.post([
+            {'from': 'gbp', 'to': 'usd', 'amount': 10},
+            {'from': 'GBP', 'to': 'EUR', 'amount': '2'},
+        ])
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body['rate_version'], 7)
+        self.assertEqual([r['converted_amount'] for r in body['results']], [12.0, 2.26])
+        self.assertEqual(body['results'][0]['from_currency'], 'GBP')
+
+    def test_items_wrapped_in_an_object_are_accepted(self):
+        response = self.post({'items': [{'from': 'GBP', 'to': 'USD', 'amount': 1}]})
+        self.assertEqual(response.json()['results'][0]['rate'], 1.2)
+
+    def test_bad_items_get_their_own_error(self):
+        results = self.post([
+            {'from': 'GBP', 'to': 'USD', 'amount': 'lots'},
+            {'from': 'GBP', 'to': 'USD', 'amount': 'inf'},
+            {'from': 'GBP'},
+            {'from': 'GBP', 'to': 'ZZZ', 'amount': 1},
+            {'from': 'GBP', 'to': 'USD', 'amount': 1},
+        ]).json()['results']
+        self.assertEqual([r.get('error') for r in results], [
+            'Invalid conversion item',
+            'Invalid conversion item',
+            'Invalid conversion item',
+            'Unsupported currency conversion',
+            None,
+        ])
+
+    def test_malformed_bodies_are_rejected(self):
+        self.assertEqual(self.client.post('/conversion/batch/', 'not json',
+                                          content_type='application/json').status_code, 400)
+        self.assertEqual(self.post({'from': 'GBP'}).status_code, 400)
+
+    @override_settings(RATE_BATCH_MAX_ITEMS=2)
+    def test_oversized_batches_are_rejected(self):
+        self.assertEqual(self.post([{'from': 'GBP', 'to': 'USD', 'amount': 1}] * 3).status_code, 400)
+
+    def test_only_post_is_allowed(self):
+        self.assertEqual(self.client.get('/conversion/batch/').status_code, 405)
+
+
+@override_settings(RATE_REFRESH_INTERVAL=30)
+class ConversionCachingTests(SimpleTestCase):
+    url = '/conversion/GBP/USD/10/'
+
+    def setUp(self):
+        use_rates(self, QUOTES, version=7)
+
+    def test_response_carries_the_version_etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], '"rates-v7"')
+        self.assertIn('max-age=30', response['Cache-Control'])
+        self.assertIn('public', response['Cache-Control'])
+        self.assertEqual(response.json()['converted_amount'], 12.0)
+
+    def test_matching_etag_gets_not_modified(self):
+        for if_none_match in ('"rates-v7"', '"rates-v6", "rates-v7"', '*'):
+            with self.subTest(if_none_match=if_none_match):
+                response = self.client.get(self.url, HTTP_IF_NONE_MATCH=if_none_match)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], '"rates-v7"')
+                self.assertEqual(response.content, b'')
+
+    def test_stale_etag_gets_a_fresh_response(self):
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='"rates-v6"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], '"rates-v7"')
+
+    def test_new_snapshot_changes_the_etag(self):
+        use_rates(self, {('GBP', 'USD'): Decimal('1.30')}, version=8)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='"rates-v7"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['rate'], 1.3)
+
+    def test_unsupported_pair_is_cacheable_too(self):
+        response = self.client.get('/conversion/GBP/ZZZ/10/')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response['ETag'], '"rates-v7"')
+
+    def test_invalid_amount_is_rejected(self):
+        self.assertEqual(self.client.get('/conversion/GBP/USD/ten/').status_code, 400)
@@ -0,0 +1,75 @@
+from datetime import datetime
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from payapp.hlc import LOGICAL_LIMIT, HybridLogicalClock, format_hlc
+
+WALL_MS = 1_700_000_000_000.0
+
+
+class HybridLogicalClockTests(SimpleTestCase):
+    def make_clock(self, service_ms=WALL_MS, **kwargs):
+        self.service_ms = service_ms
+        clock = HybridLogicalClock(lambda: self.service_ms, sync_interval=3600, **kwargs)
+        patcher = mock.patch.object(clock, '_wall_ms', return_value=WALL_MS)
+        self.wall = patcher.start()
+        self.addCleanup(patcher.stop)
+        return clock
+
+    def test_stamps_increase_while_the_wall_clock_stands_still(self):
+        clock = self.make_clock()
+        clock.sync()
+        stamps = clock.now(5)
+        self.assertEqual(stamps, sorted(set(stamps)))
+        self.assertEqual(clock.metrics['stamps'], 5)
+
+    def test_logical_overflow_carries_into_the_physical_part(self):
+        clock = self.make_clock()
+        clock.sync()
+        stamps = clock.now(LOGICAL_LIMIT + 10)
+        self.assertEqual(stamps, sorted(set(stamps)))
+        # The sync starts one millisecond after the service time, and the
+        # counter has since wrapped once into the next millisecond.
+        self.assertEqual(stamps[-1], format_hlc(int(WALL_MS) + 2, 10))
+
+    def test_stamps_never_go_back_when_the_wall_clock_does(self):
+        clock = self.make_clock()
+        clock.sync()
+        first = clock.now()[0]
+        self.wall.return_value = WALL_MS - 60_000
+        self.assertGreater(clock.now()[0], first)
+
+    def test_stamps_follow_the_service_clock(self):
+        clock = self.make_clock(service_ms=WALL_MS + 5_000)
+        clock.sync()
+        self.wall.return_value = WALL_MS + 1_000
+        self.assertEqual(clock.now()[0], format_hlc(int(WALL_MS) + 6_000, 0))
+
+    def test_observed_service_stamps_are_never_passed_backwards(self):
+        clock = self.make_clock()
+        clock.sync()
+        ahead = format_hlc(int(WALL_MS) + 500, 123)
+        clock.observe(ahead)
+        self.assertGreater(clock.now()[0], ahead)
+
+    def test_stamps_parse_as_timestamps(self):
+        self.assertEqual(format_hlc(int(WALL_MS) + 123, 456),
+                         datetime.fromtimestamp(WALL_MS / 1000).replace(microsecond=123456).isoformat())
+
+    def test_unhealthy_until_synced(self):
+        clock = HybridLogicalClock(mock.Mock(side_effect=OSError('down')), sync_interval=3600)
+        self.assertFalse(clock.healthy())
+        self.assertEqual(clock.metrics['sync_failures'], 1)
+
+    def test_unhealthy_when_drift_exceeds_the_limit(self):
+        clock = self.make_clock(max_drift_ms=50.0)
+        clock.sync()
+        self.assertTrue(clock.healthy())
+        self.service_ms += 40
+        clock.sync()
+        self.assertTrue(clock.healthy())
+        self.service_ms += 100
+        clock.sync()
+        self.assertFalse(clock.healthy())
+        self.assertEqual(clock.metrics['drift_ms'], 100.0)
@@ -0,0 +1,80 @@
+import io
+import json
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from payapp.models import IdempotencyKey, Transaction
+
+from .utils import BACKGROUND_OFF, make_user
+
+
+@BACKGROUND_OFF
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        self.alice = make_user('alice', '50.00')
+        make_user('bob', '10.00')
+        self.client.force_login(self.alice)
+
+    def pay(self, amount, key):
+        return self.client.post('/webapps2025/pay/make/',
+                                {'recipient': 'bob', 'amount': amount, 'idempotency_key': key})
+
+    def balance(self):
+        self.alice.refresh_from_db()
+        return self.alice.balance
+
+    def test_repeated_submission_replays_the_outcome(self):
+        first = self.pay('10.00', 'k1')
+        second = self.pay('10.00', 'k1')
+        self.assertEqual((first.status_code, second.status_code), (302, 302))
+        self.assertEqual(second['Location'], first['Location'])
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertNotIn('Idempotent-Replayed', first)
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.assertEqual(self.balance(), Decimal('40.00'))
+
+    def test_key_reused_for_a_different_request_is_refused(self):
+        self.pay('10.00', 'k1')
+        self.assertEqual(self.pay('11.00', 'k1').status_code, 422)
+        self.assertEqual(self.balance(), Decimal('40.00'))
+
+    def test_invalid_form_releases_the_key(self):
+        self.assertEqual(self.pay('abc', 'k1').status_code, 200)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.pay('10.00', 'k1').status_code, 302)
+        self.assertEqual(self.balance(), Decimal('40.00'))
+
+    def test_json_outcomes_are_replayed_from_the_header(self):
+        payload = json.dumps([{'recipient': 'bob', 'amount': '5.00'}])
+        responses = [self.client.post('/webapps2025/pay/bulk/', payload, content_type='application/json',
+                                      HTTP_IDEMPOTENCY_KEY='batch-1') for _ in range(2)]
+        self.assertEqual(responses[1].json(), responses[0].json())
+        self.assertEqual(responses[1]['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.balance(), Decimal('45.00'))
+
+    def test_overlong_key_is_rejected(self):
+        self.assertEqual(self.pay('10.00', 'k' * 256).status_code, 400)
+        self.assertFalse(Transaction.objects.exists())
+
+    @override_settings(IDEMPOTENCY_KEY_TTL=60)
+    def test_expired_key_counts_as_new(self):
+        self.pay('10.00', 'k1')
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(seconds=61))
+        response = self.pay('11.00', 'k1')
+        self.assertEqual(response.status_code, 302)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Transaction.objects.count(), 2)
+        self.assertEqual(self.balance(), Decimal('29.00'))
+        self.assertEqual(IdempotencyKey.objects.get().status_code, 302)
+        self.assertEqual(self.pay('11.00', 'k1')['Idempotent-Replayed'], 'true')
+
+    def test_sweep_deletes_only_expired_keys(self):
+        self.pay('10.00', 'old')
+        self.pay('10.00', 'new')
+        IdempotencyKey.objects.filter(key='old').update(created_at=timezone.now() - timedelta(days=2))
+        call_command('sweep_idempotency_keys', stdout=io.StringIO())
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['new'])
@@ -0,0 +1,69 @@
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+
+from payapp import ledger, transfers
+from payapp.models import BalanceSnapshot, LedgerEntry, Transaction
+
+from .utils import BACKGROUND_OFF, LedgerTestMixin, make_user
+
+
+@BACKGROUND_OFF
+class LedgerTests(LedgerTestMixin, TestCase):
+    def setUp(self):
+        self.alice = make_user('alice', '50.00')
+        self.bob = make_user('bob', '10.00')
+
+    def pay(self, amount):
+        record = Transaction(sender=self.alice, recipient=self.bob, transaction_type='PAYMENT',
+                             amount=Decimal(amount), converted_amount=Decimal(amount), status='Completed')
+        transfers.transfer(self.alice.pk, self.bob.pk, Decimal(amount), Decimal(amount), record)
+        return record
+
+    def test_new_accounts_open_with_a_snapshot(self):
+        snapshot = BalanceSnapshot.objects.get(account=self.alice)
+        self.assertEqual((snapshot.sequence, snapshot.balance), (0, Decimal('50.00')))
+
+    def test_transfer_writes_one_entry_per_side(self):
+        record = self.pay('5.00')
+        entries = LedgerEntry.objects.filter(transaction=record).order_by('amount')
+        self.assertEqual([(e.account_id, e.amount, e.sequence) for e in entries],
+                         [(self.alice.pk, Decimal('-5.00'), 1), (self.bob.pk, Decimal('5.00'), 1)])
+        self.assertLedgerMatches()
+
+    def test_overdraft_leaves_no_entries(self):
+        with self.assertRaises(transfers.InsufficientFunds):
+            self.pay('60.00')
+        self.assertFalse(LedgerEntry.objects.exists())
+        sequences = get_user_model().objects.filter(pk__in=[self.alice.pk, self.bob.pk]).values_list(
+            'ledger_sequence', flat=True)
+        self.assertEqual(list(sequences), [0, 0])
+
+    def test_snapshot_every_interval_entries(self):
+        for _ in range(4):
+            self.pay('1.00')
+        snapshot = BalanceSnapshot.objects.filter(account=self.alice).latest('sequence')
+        self.assertEqual((snapshot.sequence, snapshot.balance), (3, Decimal('47.00')))
+        self.assertLedgerMatches()
+
+    def test_balance_at_replays_up_to_the_instant(self):
+        self.pay('5.00')
+        self.assertEqual(ledger.balance_at(self.alice.pk, timezone.now()), Decimal('45.00'))
+        self.assertIsNone(ledger.balance_at(self.alice.pk, timezone.now() - timedelta(days=1)))
+
+    def test_making_an_admin_keeps_balance_and_ledger(self):
+        admin = make_user('root')
+        get_user_model().objects.filter(pk=admin.pk).update(is_staff=True)
+        stale = get_user_model().objects.get(pk=self.bob.pk)
+        self.pay('5.00')
+        self.client.force_login(admin)
+        with mock.patch('payapp.views.get_object_or_404', return_value=stale):
+            self.client.get(f'/webapps2025/admin/make_admin/{self.bob.pk}/')
+        self.bob.refresh_from_db()
+        self.assertTrue(self.bob.is_staff)
+        self.assertEqual((self.bob.balance, self.bob.ledger_sequence), (Decimal('15.00'), 1))
+        self.assertLedgerMatches()
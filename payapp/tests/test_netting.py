@@ -0,0 +1,63 @@
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from payapp import settlement
+from payapp.models import QueuedPayment, Transaction
+
+from .utils import BACKGROUND_OFF, LedgerTestMixin, make_user
+
+
+def queued(sender, recipient, amount):
+    return QueuedPayment(sender_id=sender, recipient_id=recipient, amount=Decimal(amount),
+                         converted_amount=Decimal(amount), status='Queued')
+
+
+class NettingCheckTests(SimpleTestCase):
+    def check(self, batch, balances):
+        return settlement._check_net(batch, {k: Decimal(v) for k, v in balances.items()}, {})
+
+    def test_chatty_pair_settles_on_its_net_position(self):
+        batch = [queued(1, 2, '8'), queued(2, 1, '8'), queued(1, 2, '8')]
+        self.assertEqual(self.check(batch, {1: '8', 2: '0'}), batch)
+
+    def test_newest_outgoing_payment_fails_first(self):
+        batch = [queued(1, 2, '4'), queued(1, 3, '4'), queued(1, 2, '4')]
+        settled = self.check(batch, {1: '8', 2: '0', 3: '0'})
+        self.assertEqual(settled, batch[:2])
+        self.assertEqual(batch[2].status, 'Failed')
+
+    def test_failures_cascade_to_recipients_left_short(self):
+        batch = [queued(1, 2, '10'), queued(2, 3, '10'), queued(3, 4, '10'), queued(4, 1, '1')]
+        self.assertEqual(self.check(batch, {1: '5', 2: '0', 3: '0', 4: '0'}), [])
+        self.assertEqual({p.status for p in batch}, {'Failed'})
+
+
+@BACKGROUND_OFF
+@override_settings(PAYMENT_QUEUE_ENABLED=True, PAYMENT_NETTING_WINDOW=1)
+class NettedSettlementTests(LedgerTestMixin, TestCase):
+    def test_window_settles_each_account_once(self):
+        alice = make_user('alice', '5.00')
+        bob = make_user('bob', '5.00')
+        carol = make_user('carol', '3.00')
+        dave = make_user('dave', '0.00')
+        for _ in range(5):
+            settlement.enqueue(alice, bob, Decimal('8.00'), Decimal('8.00'))
+            settlement.enqueue(bob, alice, Decimal('8.00'), Decimal('8.00'))
+        settlement.enqueue(carol, dave, Decimal('2.00'), Decimal('2.00'))
+        settlement.enqueue(carol, dave, Decimal('2.00'), Decimal('2.00'))
+
+        self.assertEqual(settlement.settle_all(), 12)
+        self.assertEqual(QueuedPayment.objects.filter(status='Failed').get().sender, carol)
+        self.assertEqual(Transaction.objects.count(), 11)
+        balances = dict(get_user_model().objects.filter(username__in=['alice', 'bob', 'carol', 'dave'])
+                        .values_list('username', 'balance'))
+        self.assertEqual(balances, {'alice': Decimal('5.00'), 'bob': Decimal('5.00'),
+                                    'carol': Decimal('1.00'), 'dave': Decimal('2.00')})
+        self.assertLedgerMatches()
+
+    def test_settler_waits_for_the_window(self):
+        settler = settlement.PaymentSettler(1, netting=True)
+        settler.wake()
+        self.assertFalse(settler._wake.is_set())
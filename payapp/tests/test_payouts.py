@@ -0,0 +1,92 @@
+import json
+from decimal import Decimal
+
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from payapp import payouts
+from payapp.models import LedgerEntry, Transaction
+from payapp.transfers import InsufficientFunds
+
+from .utils import BACKGROUND_OFF, LedgerTestMixin, make_user, use_rates
+
+
+@BACKGROUND_OFF
+class BulkPayoutTests(LedgerTestMixin, TestCase):
+    def setUp(self):
+        use_rates(self, {('GBP', 'USD'): Decimal('1.20')})
+        self.alice = make_user('alice', '50.00')
+        self.bob = make_user('bob', '10.00')
+        self.carol = make_user('carol', '0.00', currency='USD')
+
+    def balances(self):
+        for user in (self.alice, self.bob, self.carol):
+            user.refresh_from_db()
+        return self.alice.balance, self.bob.balance, self.carol.balance
+
+    def test_every_payout_is_made_and_converted(self):
+        created = payouts.bulk_payout(self.alice, [('bob', Decimal('1.00')), ('carol', Decimal('2.00')),
+                                                   ('bob', Decimal('3.00'))])
+        self.assertEqual([(p.recipient_id, p.amount, p.converted_amount) for p in created], [
+            (self.bob.pk, Decimal('1.00'), Decimal('1.00')),
+            (self.carol.pk, Decimal('2.00'), Decimal('2.40')),
+            (self.bob.pk, Decimal('3.00'), Decimal('3.00')),
+        ])
+        self.assertEqual(self.alice.balance, Decimal('44.00'))
+        self.assertEqual(self.balances(), (Decimal('44.00'), Decimal('14.00'), Decimal('2.40')))
+        self.assertEqual(LedgerEntry.objects.count(), 6)
+        self.assertLedgerMatches()
+
+    def test_batch_over_the_balance_writes_nothing(self):
+        with self.assertRaises(InsufficientFunds):
+            payouts.bulk_payout(self.alice, [('bob', Decimal('30.00')), ('carol', Decimal('30.00'))])
+        self.assertEqual(self.balances(), (Decimal('50.00'), Decimal('10.00'), Decimal('0.00')))
+        self.assertFalse(Transaction.objects.exists())
+        self.assertFalse(LedgerEntry.objects.exists())
+
+    def test_bad_recipients_reject_the_whole_batch(self):
+        make_user('dave', currency='JPY')
+        with self.assertRaises(payouts.PayoutError) as caught:
+            payouts.bulk_payout(self.alice, [('bob', Decimal('1.00')), ('nobody', Decimal('1.00')),
+                                             ('alice', Decimal('1.00'))])
+        self.assertEqual([i for i, _ in caught.exception.errors], [1, 2])
+        with self.assertRaises(payouts.PayoutError) as caught:
+            payouts.bulk_payout(self.alice, [('bob', Decimal('1.00')), ('dave', Decimal('1.00'))])
+        self.assertEqual([i for i, _ in caught.exception.errors], [1])
+        self.assertFalse(Transaction.objects.exists())
+
+    def post(self, payload):
+        self.client.force_login(self.alice)
+        return self.client.post('/webapps2025/pay/bulk/', json.dumps(payload), content_type='application/json')
+
+    def test_view_reports_the_batch(self):
+        items = [{'recipient': 'bob', 'amount': '2.50'}, {'recipient': 'carol', 'amount': 1}]
+        body = self.post({'items': items}).json()
+        self.assertEqual((body['count'], body['balance']), (2, '46.50'))
+        self.assertEqual(len(body['transaction_ids']), 2)
+
+    def test_view_rejects_bad_batches(self):
+        response = self.post([{'recipient': 'bob', 'amount': '1.005'}, {'recipient': 'bob'}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([e['item'] for e in response.json()['errors']], [0, 1])
+        self.assertEqual(self.post([{'recipient': 'bob', 'amount': '60'}]).status_code, 409)
+        self.assertFalse(Transaction.objects.exists())
+
+
+class PayoutParsingTests(SimpleTestCase):
+    def parse(self, amount):
+        return payouts.parse_payouts([{'recipient': 'bob', 'amount': amount}])
+
+    def test_amounts_outside_the_column_are_rejected(self):
+        for amount in ('1e100', '99999999999.99', '0', '-1', 'NaN', 'Infinity', '1.005', 'lots'):
+            with self.subTest(amount=amount), self.assertRaises(payouts.PayoutError):
+                self.parse(amount)
+
+    def test_largest_amount_is_accepted(self):
+        self.assertEqual(self.parse('99999999.99'), [('bob', Decimal('99999999.99'))])
+        self.assertEqual(self.parse(12), [('bob', Decimal('12'))])
+
+    @override_settings(PAYOUT_MAX_ITEMS=2)
+    def test_batch_must_be_a_bounded_non_empty_list(self):
+        for items in ([], {'recipient': 'bob'}, [{'recipient': 'bob', 'amount': 1}] * 3):
+            with self.subTest(items=items), self.assertRaises(payouts.PayoutError):
+                payouts.parse_payouts(items)
@@ -0,0 +1,150 @@
+import json
+from decimal import Decimal
+from unittest import mock
+
+import requests
+from django.test import SimpleTestCase, TestCase
+
+from payapp import rates
+from payapp.models import ExchangeRate, RateHistory, RateTableVersion
+from payapp.rate_client import CircuitBreaker, CircuitOpenError, RateSourceClient, RateSourceError
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('payapp.rate_client.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10.0)
+
+    def fail(self, times):
+        for _ in range(times):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record_failure()
+
+    def test_opens_after_threshold_consecutive_failures(self):
+        self.fail(2)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.fail(1)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_success_resets_the_failure_count(self):
+        self.fail(2)
+        self.breaker.record_success()
+        self.fail(2)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_lets_one_trial_through(self):
+        self.fail(3)
+        self.clock.now += 10.0
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+
+    def test_successful_trial_closes_the_breaker(self):
+        self.fail(3)
+        self.clock.now += 10.0
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_trial_reopens_for_another_timeout(self):
+        self.fail(3)
+        self.clock.now += 10.0
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.clock.now += 9.9
+        self.assertFalse(self.breaker.allow())
+        self.clock.now += 0.1
+        self.assertTrue(self.breaker.allow())
+
+
+def json_response(payload, status=200):
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps(payload).encode()
+    return response
+
+
+class RateSourceClientTests(SimpleTestCase):
+    def setUp(self):
+        self.client = RateSourceClient('http://rates.invalid/', breaker=CircuitBreaker(failure_threshold=2))
+        patcher = mock.patch.object(self.client.session, 'get')
+        self.get = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_base_rates_are_parsed_as_decimals(self):
+        self.get.return_value = json_response({'base': 'GBP', 'rates': {'usd': 1.2, 'EUR': '1.13'}})
+        self.assertEqual(self.client.fetch_base_rates('GBP'), {'USD': Decimal('1.2'), 'EUR': Decimal('1.13')})
+        self.assertEqual(self.get.call_args.kwargs['timeout'], self.client.timeout)
+
+    def test_wrong_base_is_rejected(self):
+        self.get.return_value = json_response({'base': 'USD', 'rates': {}})
+        with self.assertRaises(RateSourceError):
+            self.client.fetch_base_rates('GBP')
+
+    def test_malformed_body_is_rejected(self):
+        self.get.return_value = json_response({'base': 'GBP', 'rates': {'USD': 'lots'}})
+        with self.assertRaises(RateSourceError):
+            self.client.fetch_base_rates('GBP')
+
+    def test_open_breaker_fails_fast_without_a_request(self):
+        self.get.side_effect = requests.ConnectionError('down')
+        for _ in range(2):
+            with self.assertRaises(RateSourceError):
+                self.client.get_json()
+        self.get.reset_mock()
+        with self.assertRaises(CircuitOpenError):
+            self.client.get_json()
+        self.get.assert_not_called()
+
+    def test_http_errors_count_as_failures(self):
+        self.get.return_value = json_response({}, status=503)
+        for _ in range(2):
+            with self.assertRaises(RateSourceError):
+                self.client.get_json()
+        self.assertEqual(self.client.breaker.state, CircuitBreaker.OPEN)
+
+
+class StoreBaseRatesTests(TestCase):
+    def setUp(self):
+        for from_currency, to_currency, rate in [('USD', 'GBP', '0.83'), ('USD', 'EUR', '0.94'),
+                                                 ('USD', 'XAU', '0.0005')]:
+            ExchangeRate.objects.create(from_currency=from_currency, to_currency=to_currency, rate=Decimal(rate))
+
+    def test_cross_quotes_follow_the_new_base_rates(self):
+        rates.store_base_rates({'USD': Decimal('1.50'), 'EUR': Decimal('1.25')}, pivot='GBP')
+        stored = dict(((f, t), r) for f, t, r in ExchangeRate.objects.values_list('from_currency', 'to_currency', 'rate'))
+        self.assertEqual(stored[('GBP', 'USD')], Decimal('1.50'))
+        self.assertEqual(stored[('USD', 'GBP')], Decimal('0.66666667'))
+        self.assertEqual(stored[('USD', 'EUR')], Decimal('0.83333333'))
+        # No GBP rate for XAU, so its direct quote is still the only price.
+        self.assertEqual(stored[('USD', 'XAU')], Decimal('0.0005'))
+
+    def test_round_trip_returns_the_amount(self):
+        rates.store_base_rates({'USD': Decimal('1.50'), 'EUR': Decimal('1.25')}, pivot='GBP')
+        quotes = {(f, t): r for f, t, r in ExchangeRate.objects.values_list('from_currency', 'to_currency', 'rate')}
+        snapshot = rates.build_snapshot(1, quotes, pivot='GBP')
+        there = (Decimal('100.00') * snapshot.rate('GBP', 'USD')).quantize(Decimal('0.01'))
+        back = (there * snapshot.rate('USD', 'GBP')).quantize(Decimal('0.01'))
+        self.assertEqual(back, Decimal('100.00'))
+
+    def test_one_version_bump_and_history_for_every_rewritten_rate(self):
+        before = RateTableVersion.current()
+        history = RateHistory.objects.count()
+        self.assertEqual(rates.store_base_rates({'USD': Decimal('1.50'), 'EUR': Decimal('1.25')}, pivot='GBP'), 2)
+        self.assertEqual(RateTableVersion.current(), before + 1)
+        # Two base rates plus the two cross quotes they can price.
+        self.assertEqual(RateHistory.objects.count(), history + 4)
@@ -0,0 +1,109 @@
+import io
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from django.test import SimpleTestCase, TestCase
+
+from payapp import rates
+from payapp.models import RateHistory, Transaction
+from payapp.rate_history import RateHistoryIndex, import_csv, revalue_transactions
+
+from .utils import make_user
+
+T0 = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def at(hours):
+    return T0 + timedelta(hours=hours)
+
+
+class RateHistoryIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = RateHistoryIndex(pivot='GBP')
+        self.index.append('GBP', 'USD', at(0), Decimal('1.20'))
+        self.index.append('GBP', 'USD', at(2), Decimal('1.30'))
+        self.index.append('GBP', 'EUR', at(1), Decimal('1.10'))
+
+    def test_rate_in_effect_at_each_instant(self):
+        self.assertIsNone(self.index.rate_as_of('GBP', 'USD', at(-1)))
+        self.assertEqual(self.index.rate_as_of('GBP', 'USD', at(0)), Decimal('1.20'))
+        self.assertEqual(self.index.rate_as_of('GBP', 'USD', at(1.99)), Decimal('1.20'))
+        self.assertEqual(self.index.rate_as_of('gbp', 'usd', at(2)), Decimal('1.30'))
+        self.assertEqual(self.index.rate_as_of('USD', 'USD', at(-1)), Decimal('1'))
+
+    def test_naive_times_are_taken_as_utc(self):
+        self.assertEqual(self.index.rate_as_of('GBP', 'USD', datetime(2025, 1, 1, 2)), Decimal('1.30'))
+
+    def test_pairs_are_triangulated_as_of_the_same_instant(self):
+        self.assertIsNone(self.index.rate_as_of('USD', 'EUR', at(0.5)))
+        self.assertEqual(self.index.rate_as_of('USD', 'EUR', at(1)), Decimal('0.91666667'))
+        self.assertEqual(self.index.rate_as_of('USD', 'EUR', at(3)), Decimal('0.84615385'))
+        self.assertEqual(self.index.rate_as_of('USD', 'GBP', at(3)), Decimal('0.76923077'))
+
+    def test_direct_quote_wins_over_triangulation(self):
+        self.index.append('USD', 'EUR', at(1), Decimal('0.90'))
+        self.assertEqual(self.index.rate_as_of('USD', 'EUR', at(3)), Decimal('0.90'))
+
+    def test_reverse_quotes_are_not_inverted(self):
+        self.index.append('EUR', 'JPY', at(0), Decimal('160'))
+        self.assertIsNone(self.index.rate_as_of('JPY', 'EUR', at(1)))
+
+    def test_matches_the_snapshot_for_every_pair(self):
+        quotes = {('GBP', 'USD'): Decimal('1.25'), ('GBP', 'EUR'): Decimal('1.15'),
+                  ('USD', 'EUR'): Decimal('0.90'), ('EUR', 'JPY'): Decimal('160')}
+        index = RateHistoryIndex(pivot='GBP')
+        for (base, quote), rate in quotes.items():
+            index.append(base, quote, T0, rate)
+        snapshot = rates.build_snapshot(1, quotes, pivot='GBP')
+        for a in snapshot.currencies:
+            for b in snapshot.currencies:
+                with self.subTest(pair=(a, b)):
+                    self.assertEqual(index.rate_as_of(a, b, T0), snapshot.rate(a, b))
+
+    def test_quotes_must_arrive_in_time_order(self):
+        with self.assertRaises(ValueError):
+            self.index.append('GBP', 'USD', at(1), Decimal('1.25'))
+
+
+class RateHistoryTableTests(TestCase):
+    def test_history_rows_are_append_only(self):
+        row = RateHistory.objects.create(base_currency='GBP', quote_currency='USD', rate=Decimal('1.2'),
+                                         effective_at=T0)
+        row.rate = Decimal('1.3')
+        with self.assertRaises(ValueError):
+            row.save()
+
+    def test_csv_import_streams_in_batches(self):
+        before = RateHistory.objects.count()
+        data = io.StringIO(
+            "effective_at,base_currency,quote_currency,rate\n"
+            "2025-01-01T00:00:00,gbp,usd,1.20\n"
+            "2025-01-02T00:00:00+00:00,GBP,USD,1.25\n"
+            "2025-01-03T00:00:00,GBP,EUR,1.10\n"
+        )
+        self.assertEqual(import_csv(data, batch_size=2), 3)
+        self.assertEqual(RateHistory.objects.count(), before + 3)
+        self.assertTrue(RateHistory.objects.filter(base_currency='GBP', quote_currency='USD',
+                                                   effective_at=T0).exists())
+
+    def test_csv_import_rejects_bad_times(self):
+        with self.assertRaises(ValueError):
+            import_csv(io.StringIO("effective_at,base_currency,quote_currency,rate\nyesterday,GBP,USD,1\n"))
+
+    def test_transactions_are_revalued_at_their_own_time(self):
+        alice = make_user('alice', currency='GBP')
+        bob = make_user('bob', currency='USD')
+        early = Transaction.objects.create(sender=alice, recipient=bob, amount=Decimal('10.00'),
+                                           converted_amount=Decimal('12.00'), status='Completed')
+        late = Transaction.objects.create(sender=alice, recipient=bob, amount=Decimal('10.00'),
+                                          converted_amount=Decimal('13.00'), status='Completed')
+        Transaction.objects.filter(pk=early.pk).update(timestamp=at(1))
+        Transaction.objects.filter(pk=late.pk).update(timestamp=at(3))
+        index = RateHistoryIndex(pivot='GBP')
+        index.append('GBP', 'USD', at(0), Decimal('1.20'))
+        index.append('GBP', 'USD', at(2), Decimal('1.30'))
+        rows = list(revalue_transactions(Transaction.objects.all(), index))
+        self.assertEqual(rows, [
+            (early.pk, Decimal('1.20'), Decimal('12.00'), Decimal('12.00')),
+            (late.pk, Decimal('1.30'), Decimal('13.00'), Decimal('13.00')),
+        ])
@@ -0,0 +1,288 @@
+import json
+import threading
+import time
+from decimal import Decimal
+from unittest import mock
+
+from django.db import DatabaseError
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from payapp import rate_providers, rates, views
+from payapp.models import ExchangeRate, RateTableVersion
+from payapp.rate_client import RateSourceError
+from payapp.rate_providers import DatabaseRateProvider
+from payapp.singleflight import SingleFlight
+
+from .utils import use_rates
+
+QUOTES = {('GBP', 'USD'): Decimal('1.20'), ('GBP', 'EUR'): Decimal('1.13')}
+
+
+class RateEngineTests(SimpleTestCase):
+    def setUp(self):
+        use_rates(self, QUOTES)
+
+    def test_same_currency_converts_at_one(self):
+        self.assertEqual(rates.get_rate('usd', 'USD'), Decimal('1'))
+
+    def test_lookups_are_case_insensitive(self):
+        self.assertEqual(rates.get_rate('gbp', 'usd'), Decimal('1.20'))
+
+    def test_unknown_pair_is_unsupported(self):
+        with self.assertRaises(rates.UnsupportedConversion):
+            rates.get_rate('GBP', 'ZZZ')
+
+    def test_convert_rounds_half_up_to_cents(self):
+        self.assertEqual(rates.convert(Decimal('10.125'), 'GBP', 'GBP'), Decimal('10.13'))
+        self.assertEqual(rates.convert(Decimal('10.00'), 'GBP', 'EUR'), Decimal('11.30'))
+
+    def test_payments_price_through_the_engine(self):
+        self.assertEqual(views.get_transaction_rate('GBP', 'USD'), rates.get_rate('GBP', 'USD'))
+
+
+class DatabaseRateTests(TestCase):
+    def setUp(self):
+        self.provider = DatabaseRateProvider()
+
+    def test_snapshot_is_built_from_the_table_at_its_version(self):
+        snapshot = self.provider.fetch(known_version=None)
+        self.assertEqual(snapshot.version, RateTableVersion.current())
+        self.assertEqual(snapshot.rate('GBP', 'USD'), Decimal('1.20'))
+
+    def test_unchanged_table_is_not_reloaded(self):
+        self.assertIsNone(self.provider.fetch(RateTableVersion.current()))
+
+    def test_saving_a_rate_bumps_the_version(self):
+        before = RateTableVersion.current()
+        ExchangeRate.objects.create(from_currency='GBP', to_currency='JPY', rate=Decimal('190'))
+        self.assertEqual(RateTableVersion.current(), before + 1)
+        snapshot = self.provider.fetch(before)
+        self.assertEqual(snapshot.rate('GBP', 'JPY'), Decimal('190'))
+
+    def test_refresh_installs_the_new_snapshot(self):
+        use_rates(self, QUOTES, version=-1)
+        with mock.patch.object(rate_providers, '_provider', self.provider):
+            snapshot = rates.refresh_snapshot()
+        self.assertEqual(snapshot.version, RateTableVersion.current())
+        self.assertIs(rates.current_snapshot(), snapshot)
+
+    def test_failed_refresh_keeps_the_last_good_snapshot(self):
+        use_rates(self, QUOTES, version=-1)
+        good = rates.current_snapshot()
+        broken = mock.Mock(**{'fetch.side_effect': DatabaseError('no such table')})
+        with mock.patch.object(rate_providers, '_provider', broken):
+            self.assertIs(rates.refresh_snapshot(), good)
+
+
+class CrossRateMatrixTests(SimpleTestCase):
+    def test_pairs_are_triangulated_through_the_pivot(self):
+        snapshot = rates.build_snapshot(1, {('GBP', 'USD'): '1.25', ('GBP', 'JPY'): '190'}, pivot='GBP')
+        self.assertEqual(snapshot.currencies, ('GBP', 'JPY', 'USD'))
+        self.assertEqual(snapshot.rate('USD', 'JPY'), Decimal('152.00000000'))
+        self.assertEqual(snapshot.rate('USD', 'GBP'), Decimal('0.80000000'))
+        self.assertEqual(snapshot.rate('JPY', 'JPY'), Decimal('1'))
+
+    def test_triangulated_rates_keep_eight_places(self):
+        snapshot = rates.build_snapshot(1, {('GBP', 'USD'): '3'}, pivot='GBP')
+        self.assertEqual(snapshot.rate('USD', 'GBP'), Decimal('0.33333333'))
+
+    def test_direct_quote_overrides_its_pair_only(self):
+        quotes = {('GBP', 'USD'): '1.25', ('GBP', 'EUR'): '1.10', ('USD', 'EUR'): '0.90'}
+        snapshot = rates.build_snapshot(1, quotes, pivot='GBP')
+        self.assertEqual(snapshot.rate('USD', 'EUR'), Decimal('0.90'))
+        self.assertEqual(snapshot.rate('EUR', 'USD'), Decimal('1.13636364'))
+
+    def test_currency_without_a_pivot_rate_is_only_priced_directly(self):
+        snapshot = rates.build_snapshot(1, {('GBP', 'USD'): '1.25', ('USD', 'XAU'): '0.0005'}, pivot='GBP')
+        self.assertEqual(snapshot.rate('USD', 'XAU'), Decimal('0.0005'))
+        self.assertIsNone(snapshot.rate('GBP', 'XAU'))
+        self.assertIsNone(snapshot.rate('XAU', 'USD'))
+
+    def test_unknown_currency_has_no_rate(self):
+        snapshot = rates.build_snapshot(1, QUOTES, pivot='GBP')
+        self.assertIsNone(snapshot.rate('GBP', 'JPY'))
+
+
+class FakeProvider:
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.fetched = threading.Event()
+
+    def fetch(self, known_version):
+        self.fetched.set()
+        return self.snapshot if self.snapshot.version != known_version else None
+
+
+@override_settings(RATE_REFRESHER_ENABLED=False, RATE_REFRESH_INTERVAL=30)
+class BackgroundRefreshTests(SimpleTestCase):
+    def setUp(self):
+        use_rates(self, QUOTES, version=1)
+        self.newer = rates.build_snapshot(2, {('GBP', 'USD'): Decimal('1.30')}, pivot='GBP')
+        self.provider = FakeProvider(self.newer)
+        patcher = mock.patch.object(rate_providers, '_provider', self.provider)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_first_lookup_loads_synchronously(self):
+        with mock.patch.object(rates, '_loaded_at', None):
+            self.assertIs(rates.current_snapshot(), self.newer)
+
+    def test_fresh_snapshot_is_served_without_a_refresh(self):
+        with mock.patch.object(rates, '_refresh_in_background') as refresh:
+            self.assertEqual(rates.current_snapshot().version, 1)
+        refresh.assert_not_called()
+
+    def test_stale_snapshot_is_served_while_refreshing_in_background(self):
+        with mock.patch.object(rates, '_loaded_at', time.monotonic() - 31), \
+                mock.patch.object(rates, '_refresh_in_background') as refresh:
+            self.assertEqual(rates.current_snapshot().version, 1)
+        refresh.assert_called_once_with()
+
+    def test_background_refresh_installs_the_new_snapshot(self):
+        with mock.patch.object(rates, '_refresher', None), \
+                mock.patch.object(rates, 'close_old_connections') as close:
+            rates._refresh_in_background()
+            self.assertTrue(self.provider.fetched.wait(5))
+            for _ in range(100):
+                if not rates._background_refresh.locked():
+                    break
+                time.sleep(0.01)
+        self.assertIs(rates._snapshot, self.newer)
+        # The refresh thread owns (and closes) its own connection.
+        close.assert_called_once_with()
+
+    def test_refresh_leaves_the_callers_connection_open(self):
+        with mock.patch.object(rates, 'close_old_connections') as close:
+            rates.refresh_snapshot()
+        close.assert_not_called()
+
+    def test_refresher_thread_refreshes_on_wake(self):
+        refresher = rates.RateRefresher(interval=60)
+        with mock.patch.object(rates, 'close_old_connections'):
+            refresher.start()
+            refresher.wake()
+            self.assertTrue(self.provider.fetched.wait(5))
+            refresher.stop()
+            refresher.join(5)
+        self.assertFalse(refresher.is_alive())
+        self.assertIs(rates._snapshot, self.newer)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_concurrent_calls_share_one_run(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        runs = []
+
+        def slow():
+            runs.append(1)
+            release.wait(5)
+            return 'rate'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flights.do('pair', slow))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for _ in range(500):
+            if flights.stats()['coalesced'] == 7:
+                break
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(runs), 1)
+        self.assertEqual(results, ['rate'] * 8)
+        self.assertEqual(flights.stats(), {'calls': 1, 'coalesced': 7, 'in_flight': 0})
+
+    def test_waiters_get_the_leaders_error(self):
+        flights = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+
+        def failing():
+            started.set()
+            release.wait(5)
+            raise RateSourceError('down')
+
+        errors = []
+
+        def call():
+            try:
+                flights.do('pair', failing)
+            except RateSourceError as e:
+                errors.append(e)
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(target=call)
+        follower.start()
+        for _ in range(500):
+            if flights.stats()['coalesced']:
+                break
+            time.sleep(0.01)
+        release.set()
+        leader.join(5)
+        follower.join(5)
+        self.assertEqual(len(errors), 2)
+        self.assertIs(errors[0], errors[1])
+
+    def test_later_calls_and_other_keys_run_again(self):
+        flights = SingleFlight()
+        self.assertEqual(flights.do('a', lambda: 1), 1)
+        self.assertEqual(flights.do('a', lambda: 2), 2)
+        self.assertEqual(flights.do('b', lambda: 3), 3)
+        self.assertEqual(flights.stats()['calls'], 3)
+
+
+class MissingPairTests(SimpleTestCase):
+    def setUp(self):
+        use_rates(self, QUOTES, version=1)
+        self.provider = mock.Mock(**{'fetch_pair.return_value': Decimal('190')})
+        patcher = mock.patch.object(rate_providers, '_provider', self.provider)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_miss_is_looked_up_once_and_remembered(self):
+        self.assertEqual(rates.get_rate('GBP', 'JPY'), Decimal('190'))
+        self.assertEqual(rates.get_rate('GBP', 'JPY'), Decimal('190'))
+        self.provider.fetch_pair.assert_called_once_with('GBP', 'JPY')
+
+    def test_unsupported_answer_is_remembered_too(self):
+        self.provider.fetch_pair.return_value = None
+        for _ in range(2):
+            with self.assertRaises(rates.UnsupportedConversion):
+                rates.get_rate('GBP', 'JPY')
+        self.provider.fetch_pair.assert_called_once_with('GBP', 'JPY')
+
+    def test_new_snapshot_forgets_remembered_pairs(self):
+        rates.get_rate('GBP', 'JPY')
+        with mock.patch.object(rates, '_snapshot', rates.build_snapshot(2, QUOTES, pivot='GBP')):
+            rates.get_rate('GBP', 'JPY')
+        self.assertEqual(self.provider.fetch_pair.call_count, 2)
+
+    def test_non_iso_codes_are_refused_without_a_lookup(self):
+        for pair in [('GBP', 'ZZZ'), ('ABCD', 'GBP'), ('GBP', '<script>')]:
+            with self.subTest(pair=pair), self.assertRaises(rates.UnsupportedConversion):
+                rates.get_rate(*pair)
+        self.provider.fetch_pair.assert_not_called()
+        self.assertEqual(len(rates._pair_cache), 0)
+
+    @override_settings(RATE_PAIR_CACHE_SIZE=2)
+    def test_remembered_pairs_are_bounded(self):
+        for code in ('JPY', 'CHF', 'CAD'):
+            rates.get_rate('GBP', code)
+        self.assertEqual(list(rates._pair_cache), [('GBP', 'CHF'), ('GBP', 'CAD')])
+
+    def test_batches_never_look_pairs_up(self):
+        version, batch = rates.batch_rates([('GBP', 'USD'), ('GBP', 'JPY'), ('gbp', 'gbp'), ('USD', 'CHF')])
+        self.assertEqual(version, 1)
+        self.assertEqual(batch, [Decimal('1.20'), None, Decimal('1.0'), None])
+        self.provider.fetch_pair.assert_not_called()
+
+    def test_batch_endpoint_reports_uncovered_pairs_per_item(self):
+        items = [{'from': 'GBP', 'to': code, 'amount': 1} for code in ('USD', 'JPY', 'CHF', 'CAD')]
+        response = self.client.post('/conversion/batch/', json.dumps(items), content_type='application/json')
+        self.assertEqual([r.get('error') for r in response.json()['results']],
+                         [None] + ['Unsupported currency conversion'] * 3)
+        self.provider.fetch_pair.assert_not_called()
@@ -0,0 +1,85 @@
+from decimal import Decimal
+
+from django.test import TestCase, override_settings
+
+from payapp import settlement
+from payapp.models import QueuedPayment, Transaction
+
+from .utils import BACKGROUND_OFF, LedgerTestMixin, make_user
+
+
+@BACKGROUND_OFF
+@override_settings(PAYMENT_QUEUE_ENABLED=True)
+class SettlementTests(LedgerTestMixin, TestCase):
+    def setUp(self):
+        self.alice = make_user('alice', '10.00')
+        self.bob = make_user('bob', '0.00')
+        self.carol = make_user('carol', '0.00')
+
+    def balances(self):
+        for user in (self.alice, self.bob, self.carol):
+            user.refresh_from_db()
+        return self.alice.balance, self.bob.balance, self.carol.balance
+
+    def queue(self, sender, recipient, amount):
+        return settlement.enqueue(sender, recipient, Decimal(amount), Decimal(amount))
+
+    def test_view_queues_and_the_settler_moves_the_money(self):
+        self.client.force_login(self.alice)
+        response = self.client.post('/webapps2025/pay/make/', {'recipient': 'bob', 'amount': '4.00'})
+        self.assertEqual(response.status_code, 302)
+        queued = QueuedPayment.objects.get()
+        self.assertEqual(self.balances(), (Decimal('10.00'), Decimal('0.00'), Decimal('0.00')))
+        self.assertFalse(Transaction.objects.exists())
+        status_url = f'/webapps2025/pay/queued/{queued.pk}/'
+        self.assertEqual(self.client.get(status_url).json()['status'], 'Queued')
+
+        self.assertEqual(settlement.settle_all(), 1)
+        status = self.client.get(status_url).json()
+        self.assertEqual(status['status'], 'Settled')
+        self.assertEqual(status['transaction_id'], Transaction.objects.get().pk)
+        self.assertEqual(self.balances(), (Decimal('6.00'), Decimal('4.00'), Decimal('0.00')))
+        self.assertLedgerMatches()
+
+    def test_status_is_only_shown_to_the_sender(self):
+        queued = self.queue(self.alice, self.bob, '1.00')
+        self.client.force_login(self.bob)
+        self.assertEqual(self.client.get(f'/webapps2025/pay/queued/{queued.pk}/').status_code, 404)
+
+    def test_payments_settle_in_order_and_uncovered_ones_fail(self):
+        first = self.queue(self.alice, self.bob, '6.00')
+        second = self.queue(self.alice, self.carol, '6.00')
+        third = self.queue(self.alice, self.carol, '4.00')
+        self.assertEqual(settlement.settle_batch(), 3)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        third.refresh_from_db()
+        self.assertEqual([first.status, second.status, third.status], ['Settled', 'Failed', 'Settled'])
+        self.assertEqual(second.failure_reason, 'Insufficient funds')
+        self.assertIsNone(second.transaction)
+        self.assertEqual(self.balances(), (Decimal('0.00'), Decimal('6.00'), Decimal('4.00')))
+        self.assertEqual(Transaction.objects.count(), 2)
+        self.assertLedgerMatches()
+
+    def test_credit_earlier_in_the_batch_funds_a_later_payment(self):
+        self.queue(self.alice, self.bob, '5.00')
+        self.queue(self.bob, self.carol, '5.00')
+        settlement.settle_batch()
+        self.assertEqual(self.balances(), (Decimal('5.00'), Decimal('0.00'), Decimal('5.00')))
+        self.assertFalse(QueuedPayment.objects.exclude(status='Settled').exists())
+        self.assertLedgerMatches()
+
+    def test_batches_are_bounded(self):
+        for _ in range(3):
+            self.queue(self.alice, self.bob, '1.00')
+        self.assertEqual(settlement.settle_batch(batch_size=2), 2)
+        self.assertEqual(settlement.queued_payments().count(), 1)
+        self.assertEqual(settlement.settle_all(batch_size=2), 1)
+        self.assertEqual(settlement.settle_batch(), 0)
+
+    def test_settled_payments_are_left_for_the_stamper(self):
+        self.queue(self.alice, self.bob, '1.00')
+        with self.captureOnCommitCallbacks() as callbacks:
+            settlement.settle_batch()
+        self.assertIn(settlement.request_stamp, callbacks)
+        self.assertIsNone(Transaction.objects.get().remote_timestamp)
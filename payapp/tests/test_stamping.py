@@ -0,0 +1,84 @@
+from decimal import Decimal
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from payapp import stamping
+from payapp.models import Transaction
+from payapp.timestamps import epoch_millis
+
+from .utils import BACKGROUND_OFF, make_user
+
+STAMPS = ['2025-01-01T12:00:00.000001', '2025-01-01T12:00:00.000002']
+
+
+@BACKGROUND_OFF
+class StampOrDeferTests(TestCase):
+    def test_async_stamping_defers_to_the_stamper(self):
+        with mock.patch.object(stamping, 'get_remote_timestamp') as fetch, \
+                self.captureOnCommitCallbacks() as callbacks:
+            self.assertIsNone(stamping.stamp_or_defer())
+        fetch.assert_not_called()
+        self.assertEqual(callbacks, [stamping.request_stamp])
+
+    @override_settings(TIMESTAMP_ASYNC_STAMPING=False)
+    def test_reachable_service_stamps_now(self):
+        with mock.patch.object(stamping, 'get_remote_timestamp', return_value=STAMPS[0]), \
+                self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(stamping.stamp_or_defer(), STAMPS[0])
+        self.assertEqual(callbacks, [])
+
+    @override_settings(TIMESTAMP_ASYNC_STAMPING=False)
+    def test_unreachable_service_leaves_the_stamp_to_the_stamper(self):
+        with mock.patch.object(stamping, 'get_remote_timestamp', return_value=None), \
+                self.captureOnCommitCallbacks() as callbacks:
+            self.assertIsNone(stamping.stamp_or_defer())
+        self.assertEqual(callbacks, [stamping.request_stamp])
+        with mock.patch.object(stamping, 'get_remote_timestamps', return_value=None), \
+                self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(stamping.stamp_or_defer_many(3), [None] * 3)
+        self.assertEqual(callbacks, [stamping.request_stamp])
+
+    @override_settings(TIMESTAMP_ASYNC_STAMPING=False, TIMESTAMP_STAMPER_IN_PROCESS=True)
+    def test_payment_made_while_the_service_is_down_wakes_the_stamper(self):
+        alice = make_user('alice', '50.00')
+        make_user('bob', '10.00')
+        self.client.force_login(alice)
+        with mock.patch.object(stamping, 'get_remote_timestamp', return_value=None), \
+                mock.patch.object(stamping, 'start_stamper') as start_stamper, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/webapps2025/pay/make/', {'recipient': 'bob', 'amount': '5.00'})
+        self.assertIsNone(Transaction.objects.get().remote_timestamp)
+        start_stamper.return_value.wake.assert_called_once_with()
+
+
+@BACKGROUND_OFF
+class StampPendingTests(TestCase):
+    def setUp(self):
+        alice = make_user('alice')
+        bob = make_user('bob')
+        self.pending = [
+            Transaction.objects.create(sender=alice, recipient=bob, amount=Decimal('1.00'),
+                                       converted_amount=Decimal('1.00'), status='Completed')
+            for _ in range(2)
+        ]
+
+    def test_pending_rows_are_stamped_in_id_order(self):
+        with mock.patch.object(stamping, 'get_remote_timestamps', return_value=STAMPS) as fetch:
+            self.assertEqual(stamping.stamp_all_pending(), 2)
+        fetch.assert_called_once_with(2)
+        for tx, stamp in zip(self.pending, STAMPS):
+            tx.refresh_from_db()
+            self.assertEqual((tx.remote_timestamp, tx.remote_epoch_ms), (stamp, epoch_millis(stamp)))
+        self.assertFalse(stamping.pending_transactions().exists())
+
+    def test_batches_are_bounded(self):
+        with mock.patch.object(stamping, 'get_remote_timestamps', return_value=STAMPS[:1]):
+            self.assertEqual(stamping.stamp_pending(batch_size=1), 1)
+        self.assertEqual(stamping.pending_transactions().get(), self.pending[1])
+
+    def test_unreachable_service_leaves_rows_pending(self):
+        with mock.patch.object(stamping, 'get_remote_timestamps', return_value=None):
+            with self.assertRaises(RuntimeError):
+                stamping.stamp_pending()
+        self.assertEqual(stamping.pending_transactions().count(), 2)
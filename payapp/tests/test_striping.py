@@ -0,0 +1,82 @@
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+
+from payapp import payouts, settlement, striping, transfers
+from payapp.models import AccountShard, LedgerEntry
+
+from .utils import BACKGROUND_OFF, LedgerTestMixin, make_user
+
+
+@BACKGROUND_OFF
+class StripingTests(LedgerTestMixin, TestCase):
+    def setUp(self):
+        self.alice = make_user('alice', '50.00')
+        self.bob = make_user('bob', '10.00')
+        self.carol = make_user('carol', '0.00')
+        striping.set_shards(self.bob.pk, 4)
+
+    def bob_state(self):
+        self.bob.refresh_from_db()
+        return self.bob.balance, striping.unconsolidated_balance(self.bob.pk)
+
+    def test_set_shards_creates_the_shard_rows(self):
+        self.assertEqual(AccountShard.objects.filter(account=self.bob).count(), 4)
+        self.bob.refresh_from_db()
+        self.assertEqual(self.bob.balance_shards, 4)
+
+    def test_credits_wait_in_shards_until_consolidated(self):
+        for _ in range(6):
+            _, payee = transfers.transfer(self.alice.pk, self.bob.pk, Decimal('1.25'), Decimal('1.25'),
+                                          payee_shards=4)
+            self.assertIsNone(payee)
+        self.assertEqual(self.bob_state(), (Decimal('10.00'), Decimal('7.50')))
+        self.assertLedgerMatches()
+        self.assertEqual(striping.consolidate(self.bob.pk), Decimal('7.50'))
+        self.assertEqual(self.bob_state(), (Decimal('17.50'), Decimal('0.00')))
+        self.assertLedgerMatches()
+
+    def test_payouts_credit_striped_recipients_through_their_shards(self):
+        with mock.patch.object(payouts, 'lock_balances', wraps=transfers.lock_balances) as lock:
+            payouts.bulk_payout(self.alice, [('bob', Decimal('2.00')), ('carol', Decimal('1.00')),
+                                             ('bob', Decimal('3.00'))])
+        self.assertNotIn(self.bob.pk, lock.call_args.args[0])
+        self.assertEqual(self.bob_state(), (Decimal('10.00'), Decimal('5.00')))
+        self.assertEqual(self.bob.ledger_sequence, 0)
+        self.assertFalse(LedgerEntry.objects.filter(account=self.bob).exists())
+        self.assertLedgerMatches()
+        striping.consolidate(self.bob.pk)
+        self.assertEqual(self.bob_state(), (Decimal('15.00'), Decimal('0.00')))
+        self.assertLedgerMatches()
+
+    @override_settings(PAYMENT_QUEUE_ENABLED=True)
+    def test_settlement_credits_striped_recipients_through_their_shards(self):
+        settlement.enqueue(self.alice, self.bob, Decimal('4.00'), Decimal('4.00'))
+        settlement.enqueue(self.carol, self.alice, Decimal('1.00'), Decimal('1.00'))
+        with mock.patch.object(settlement, 'lock_balances', wraps=transfers.lock_balances) as lock:
+            settlement.settle_batch()
+        self.assertNotIn(self.bob.pk, lock.call_args.args[0])
+        self.assertEqual(self.bob_state(), (Decimal('10.00'), Decimal('4.00')))
+        self.assertFalse(LedgerEntry.objects.filter(account=self.bob).exists())
+        self.assertLedgerMatches()
+
+    @override_settings(PAYMENT_QUEUE_ENABLED=True)
+    def test_shard_credits_cannot_be_spent_in_the_same_batch(self):
+        get_user_model().objects.filter(pk=self.bob.pk).update(balance=Decimal('0.00'))
+        settlement.enqueue(self.alice, self.bob, Decimal('5.00'), Decimal('5.00'))
+        spend = settlement.enqueue(self.bob, self.carol, Decimal('5.00'), Decimal('5.00'))
+        settlement.settle_batch()
+        spend.refresh_from_db()
+        self.assertEqual(spend.status, 'Failed')
+        self.assertEqual(self.bob_state(), (Decimal('0.00'), Decimal('5.00')))
+
+    @override_settings(PAYMENT_QUEUE_ENABLED=True, PAYMENT_NETTING_WINDOW=1)
+    def test_netted_settlement_credits_shards_too(self):
+        settlement.enqueue(self.alice, self.bob, Decimal('4.00'), Decimal('4.00'))
+        settlement.enqueue(self.bob, self.alice, Decimal('14.00'), Decimal('14.00'))
+        settlement.settle_batch()
+        # Bob's incoming 4.00 is in a shard, so it cannot cover his 14.00.
+        self.assertEqual(self.bob_state(), (Decimal('10.00'), Decimal('4.00')))
+        self.assertLedgerMatches()
@@ -0,0 +1,290 @@
+import io
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest import mock
+
+from django.apps import apps
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, override_settings
+from thrift.Thrift import TApplicationException
+
+from payapp.timestamp_server import (MAX_TIMESTAMP_BATCH, TimestampHandler, build_server, uses_framed_transport,
+                                     wait_until_ready)
+from payapp.timestamps import TimestampBalancer, TimestampClientPool, TimestampLease, TimestampUnavailable, epoch_millis
+
+from .utils import start_timestamp_server
+
+
+class TimestampClientPoolTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.port = start_timestamp_server()
+
+    def make_pool(self, **kwargs):
+        pool = TimestampClientPool('127.0.0.1', self.port, **kwargs)
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_connection_is_reused_between_calls(self):
+        pool = self.make_pool()
+        with mock.patch.object(pool, '_connect', wraps=pool._connect) as connect:
+            first = pool.call('getTimestamp')
+            second = pool.call('getTimestamp')
+        self.assertEqual(connect.call_count, 1)
+        self.assertLess(datetime.fromisoformat(first), datetime.fromisoformat(second))
+
+    def test_concurrent_calls_open_at_most_size_connections(self):
+        pool = self.make_pool(size=2)
+        with mock.patch.object(pool, '_connect', wraps=pool._connect) as connect:
+            threads = [threading.Thread(target=pool.call, args=('getTimestamp',)) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertLessEqual(connect.call_count, 2)
+
+    def test_stale_idle_connection_is_replaced(self):
+        pool = self.make_pool(max_idle=0.0)
+        pool.call('getTimestamp')
+        with mock.patch.object(pool, '_connect', wraps=pool._connect) as connect:
+            pool.call('getTimestamp')
+        self.assertEqual(connect.call_count, 1)
+
+    def test_call_on_a_broken_connection_is_retried_on_a_fresh_one(self):
+        pool = self.make_pool()
+        pool.call('getTimestamp')
+        broken = pool._idle.queue[0]
+        broken.transport.close()
+        # Let the broken connection past the health check, as a socket that
+        # dies between checkout and the call would be.
+        with mock.patch.object(type(broken), 'is_healthy', return_value=True):
+            self.assertTrue(pool.call('getTimestamp'))
+        self.assertIsNot(pool._idle.queue[0], broken)
+
+    def test_exhausted_pool_gives_up_after_the_timeout(self):
+        pool = self.make_pool(size=1, timeout_ms=50)
+        with pool.connection():
+            with self.assertRaises(TimestampUnavailable):
+                pool.call('getTimestamp')
+
+    def test_unreachable_server_raises_unavailable(self):
+        pool = TimestampClientPool('127.0.0.1', 1, timeout_ms=200)
+        with self.assertRaises(TimestampUnavailable):
+            pool.call('getTimestamp')
+
+
+class ServerModeTests(SimpleTestCase):
+    def test_unknown_mode_is_rejected(self):
+        with self.assertRaises(ValueError):
+            build_server('forking')
+
+    def test_only_the_nonblocking_server_needs_framed_transport(self):
+        self.assertTrue(uses_framed_transport('nonblocking'))
+        for mode in ('simple', 'threaded', 'threadpool'):
+            self.assertFalse(uses_framed_transport(mode))
+
+    def test_concurrent_modes_serve_pooled_clients(self):
+        for mode in ('threadpool', 'nonblocking'):
+            with self.subTest(mode=mode):
+                pool = TimestampClientPool('127.0.0.1', start_timestamp_server(mode),
+                                           framed=uses_framed_transport(mode))
+                self.addCleanup(pool.close)
+                results = []
+                threads = [threading.Thread(target=lambda: results.append(pool.call('getTimestamps', 5)))
+                           for _ in range(4)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                stamps = sorted(stamp for block in results for stamp in block)
+                self.assertEqual(len(set(stamps)), 20)
+
+
+class TimestampHandlerTests(SimpleTestCase):
+    def test_stamps_are_strictly_increasing_across_calls(self):
+        handler = TimestampHandler()
+        stamps = [handler.getTimestamp()] + handler.getTimestamps(50) + [handler.getTimestamp()]
+        self.assertEqual(stamps, sorted(set(stamps)))
+        self.assertGreaterEqual(handler.getEpochMillis(), int(datetime.fromisoformat(stamps[-1]).timestamp() * 1000))
+
+    def test_block_size_is_bounded(self):
+        handler = TimestampHandler()
+        for count in (0, MAX_TIMESTAMP_BATCH + 1):
+            with self.assertRaises(TApplicationException):
+                handler.getTimestamps(count)
+
+
+class SkewedServer:
+    """Stands in for a balancer whose server clock runs skew ahead of ours."""
+
+    def __init__(self, skew=timedelta()):
+        self.handler = TimestampHandler()
+        self.skew = skew
+        self.calls = 0
+
+    def call(self, method, *args):
+        self.calls += 1
+        stamps = getattr(self.handler, method)(*args)
+        return [(datetime.fromisoformat(stamp) + self.skew).isoformat(timespec='microseconds') for stamp in stamps]
+
+
+def parse(stamps):
+    return [datetime.fromisoformat(stamp) for stamp in stamps]
+
+
+class TimestampLeaseTests(SimpleTestCase):
+    def test_one_rpc_per_block(self):
+        server = SkewedServer()
+        lease = TimestampLease(server, size=5, ttl=60)
+        stamps = [lease.take()[0] for _ in range(5)]
+        self.assertEqual(server.calls, 1)
+        stamps += lease.take(2)
+        self.assertEqual(server.calls, 2)
+        self.assertEqual(stamps, sorted(set(stamps)))
+
+    def test_stamps_record_when_they_were_taken(self):
+        lease = TimestampLease(SkewedServer(), size=100, ttl=60)
+        first, = parse(lease.take())
+        time.sleep(0.05)
+        second, = parse(lease.take())
+        self.assertGreaterEqual(second - first, timedelta(milliseconds=50))
+        self.assertLess(abs(second - datetime.now()), timedelta(seconds=1))
+
+    def test_stamps_follow_the_server_clock(self):
+        server = SkewedServer(skew=timedelta(minutes=5))
+        lease = TimestampLease(server, size=100, ttl=60)
+        lease.take()
+        taken, = parse(lease.take())
+        self.assertLess(abs(taken - datetime.now() - timedelta(minutes=5)), timedelta(seconds=1))
+
+    def test_stamps_never_fall_behind_a_block_or_each_other(self):
+        server = SkewedServer(skew=timedelta(minutes=5))
+        lease = TimestampLease(server, size=3, ttl=60)
+        stamps = lease.take(2)
+        # The server's clock steps back; stamps keep increasing regardless.
+        server.skew = timedelta()
+        stamps += lease.take(2)
+        self.assertEqual(server.calls, 2)
+        self.assertEqual(stamps, sorted(set(stamps)))
+
+    def test_expired_block_is_renewed(self):
+        server = SkewedServer()
+        lease = TimestampLease(server, size=100, ttl=0)
+        lease.take()
+        lease.take()
+        self.assertEqual(server.calls, 2)
+
+
+class EpochMillisTests(SimpleTestCase):
+    def test_service_stamps_convert_to_epoch_milliseconds(self):
+        handler = TimestampHandler()
+        before = handler.getEpochMillis()
+        stamp = handler.getTimestamp()
+        self.assertLessEqual(before, epoch_millis(stamp))
+        self.assertLessEqual(epoch_millis(stamp), handler.getEpochMillis())
+        self.assertEqual(epoch_millis(stamp), int(datetime.fromisoformat(stamp).timestamp() * 1000))
+
+    def test_missing_stamp_has_no_epoch(self):
+        self.assertIsNone(epoch_millis(None))
+        self.assertIsNone(epoch_millis(''))
+
+
+class StartupTests(SimpleTestCase):
+    def test_loading_the_app_starts_no_server(self):
+        config = apps.get_app_config('payapp')
+        with override_settings(TIMESTAMP_SERVER_EMBEDDED=False), \
+                mock.patch.object(type(config), 'start_thrift_server') as start:
+            config.ready()
+        start.assert_not_called()
+
+    def test_ready_means_the_server_answers(self):
+        self.assertTrue(wait_until_ready('127.0.0.1', start_timestamp_server(), timeout=1.0))
+        started = time.monotonic()
+        self.assertFalse(wait_until_ready('127.0.0.1', 1, timeout=0.2))
+        self.assertLess(time.monotonic() - started, 2.0)
+
+    def test_check_command_probes_the_configured_server(self):
+        out = io.StringIO()
+        with override_settings(TIMESTAMP_SERVICE_HOST='127.0.0.1', TIMESTAMP_SERVICE_PORT=start_timestamp_server()):
+            call_command('runtimestampserver', '--check', '--mode', 'threaded', stdout=out)
+        self.assertIn('is ready', out.getvalue())
+        with override_settings(TIMESTAMP_SERVICE_HOST='127.0.0.1', TIMESTAMP_SERVICE_PORT=1):
+            with self.assertRaises(CommandError):
+                call_command('runtimestampserver', '--check', '--mode', 'threaded', '--ready-timeout', '0.2')
+
+
+class FakePool:
+    """Stands in for one server's TimestampClientPool."""
+
+    def __init__(self, port, answer='stamp', delay=0.0):
+        self.host = '127.0.0.1'
+        self.port = port
+        self.size = 2
+        self.answer = answer
+        self.delay = delay
+        self.calls = 0
+
+    def call(self, method, *args):
+        self.calls += 1
+        time.sleep(self.delay)
+        if isinstance(self.answer, Exception):
+            raise self.answer
+        return self.answer
+
+    def close(self):
+        pass
+
+
+class TimestampBalancerTests(SimpleTestCase):
+    def test_failed_call_fails_over(self):
+        down, up = FakePool(1, TimestampUnavailable('down')), FakePool(2, 'ok')
+        balancer = TimestampBalancer([down, up])
+        self.assertEqual(balancer.call('getTimestamp'), 'ok')
+        self.assertEqual((down.calls, up.calls), (1, 1))
+
+    def test_every_endpoint_failing_raises_unavailable(self):
+        balancer = TimestampBalancer([FakePool(1, TimestampUnavailable('a')), FakePool(2, TimestampUnavailable('b'))])
+        with self.assertRaises(TimestampUnavailable):
+            balancer.call('getTimestamp')
+
+    def test_failing_endpoint_is_ejected_until_the_cooldown_ends(self):
+        down, up = FakePool(1, TimestampUnavailable('down')), FakePool(2, 'ok')
+        balancer = TimestampBalancer([down, up], eject_after=2, eject_cooldown=0.05)
+        balancer.call('getTimestamp')
+        balancer.call('getTimestamp')
+        self.assertTrue(balancer.stats()['endpoints']['127.0.0.1:1']['ejected'])
+        balancer.call('getTimestamp')
+        self.assertEqual(down.calls, 2)
+        time.sleep(0.06)
+        down.answer = 'back'
+        self.assertEqual(balancer.call('getTimestamp'), 'back')
+        self.assertFalse(balancer.stats()['endpoints']['127.0.0.1:1']['ejected'])
+
+    def test_less_loaded_endpoint_is_preferred(self):
+        slow, fast = FakePool(1, 'slow'), FakePool(2, 'fast')
+        balancer = TimestampBalancer([slow, fast])
+        balancer.endpoints[0].ewma = 0.5
+        balancer.endpoints[1].ewma = 0.01
+        self.assertEqual({balancer.call('getTimestamp') for _ in range(10)}, {'fast'})
+        # A busy endpoint loses even with the lower latency.
+        balancer.endpoints[1].ewma = 0.01
+        balancer.endpoints[1].inflight = 100
+        self.assertEqual(balancer.call('getTimestamp'), 'slow')
+
+    def test_latency_is_tracked_per_endpoint(self):
+        pool = FakePool(1, delay=0.01)
+        balancer = TimestampBalancer([pool])
+        balancer.call('getTimestamp')
+        stats = balancer.stats()['endpoints']['127.0.0.1:1']
+        self.assertGreaterEqual(stats['ewma_ms'], 10)
+        self.assertEqual((stats['calls'], stats['failures'], stats['inflight']), (1, 0, 0))
+
+    def test_slow_call_is_hedged_to_another_endpoint(self):
+        slow, fast = FakePool(1, 'slow', delay=0.5), FakePool(2, 'fast')
+        balancer = TimestampBalancer([slow, fast], hedge_after_ms=20)
+        started = time.monotonic()
+        self.assertEqual(balancer.call('getTimestamp'), 'fast')
+        self.assertLess(time.monotonic() - started, 0.4)
+        self.assertEqual(balancer.hedges, 1)
@@ -0,0 +1,83 @@
+from decimal import Decimal
+
+from django.test import TestCase
+
+from payapp import transfers, views
+from payapp.models import Transaction
+from payapp.timestamps import epoch_millis
+
+from .utils import BACKGROUND_OFF, make_user
+
+
+@BACKGROUND_OFF
+class TransferTests(TestCase):
+    def setUp(self):
+        self.alice = make_user('alice', '50.00')
+        self.bob = make_user('bob', '10.00')
+
+    def payment(self, amount):
+        return Transaction(sender=self.alice, recipient=self.bob, transaction_type='PAYMENT',
+                           amount=Decimal(amount), converted_amount=Decimal(amount), status='Completed')
+
+    def test_transfer_moves_money_and_saves_the_record(self):
+        record = self.payment('20.00')
+        payer, payee = transfers.transfer(self.alice.pk, self.bob.pk, Decimal('20.00'), Decimal('20.00'), record)
+        self.assertEqual((payer, payee), (Decimal('30.00'), Decimal('30.00')))
+        self.assertIsNotNone(record.pk)
+        self.alice.refresh_from_db()
+        self.bob.refresh_from_db()
+        self.assertEqual((self.alice.balance, self.bob.balance), (Decimal('30.00'), Decimal('30.00')))
+
+    def test_debit_and_credit_may_differ(self):
+        transfers.transfer(self.alice.pk, self.bob.pk, Decimal('10.00'), Decimal('12.00'))
+        self.alice.refresh_from_db()
+        self.bob.refresh_from_db()
+        self.assertEqual((self.alice.balance, self.bob.balance), (Decimal('40.00'), Decimal('22.00')))
+
+    def test_whole_balance_can_be_spent(self):
+        payer, _ = transfers.transfer(self.alice.pk, self.bob.pk, Decimal('50.00'), Decimal('50.00'))
+        self.assertEqual(payer, Decimal('0.00'))
+
+    def test_overdraft_is_refused_and_leaves_no_trace(self):
+        record = self.payment('50.01')
+        with self.assertRaises(transfers.InsufficientFunds):
+            transfers.transfer(self.alice.pk, self.bob.pk, Decimal('50.01'), Decimal('50.01'), record)
+        self.assertIsNone(record.pk)
+        self.assertFalse(Transaction.objects.exists())
+        self.alice.refresh_from_db()
+        self.bob.refresh_from_db()
+        self.assertEqual((self.alice.balance, self.bob.balance), (Decimal('50.00'), Decimal('10.00')))
+
+    def test_unknown_payee_is_refused(self):
+        with self.assertRaises(transfers.UnknownAccount):
+            transfers.transfer(self.alice.pk, self.bob.pk + 1000, Decimal('1.00'), Decimal('1.00'))
+        self.alice.refresh_from_db()
+        self.assertEqual(self.alice.balance, Decimal('50.00'))
+
+    def test_transfer_to_self_is_refused(self):
+        with self.assertRaises(ValueError):
+            transfers.transfer(self.alice.pk, self.alice.pk, Decimal('1.00'), Decimal('1.00'))
+
+    def test_payment_view_refuses_an_overdraft(self):
+        self.client.force_login(self.alice)
+        response = self.client.post('/webapps2025/pay/make/', {'recipient': 'bob', 'amount': '60.00'})
+        self.assertRedirects(response, '/webapps2025/pay/make/', fetch_redirect_response=False)
+        self.assertFalse(Transaction.objects.exists())
+        self.alice.refresh_from_db()
+        self.assertEqual(self.alice.balance, Decimal('50.00'))
+
+    def test_payment_view_moves_money(self):
+        self.client.force_login(self.alice)
+        self.client.post('/webapps2025/pay/make/', {'recipient': 'bob', 'amount': '12.50'})
+        self.alice.refresh_from_db()
+        self.bob.refresh_from_db()
+        self.assertEqual((self.alice.balance, self.bob.balance), (Decimal('37.50'), Decimal('22.50')))
+        self.assertEqual(Transaction.objects.get().amount, Decimal('12.50'))
+
+    def test_payment_stores_its_stamp_as_epoch_milliseconds(self):
+        stamp = '2025-01-01T12:00:00.123456'
+        payment = views.record_payment(self.alice, self.bob, Decimal('5.00'), Decimal('5.00'), stamp)
+        payment.refresh_from_db()
+        self.assertEqual(payment.remote_timestamp, stamp)
+        self.assertEqual(payment.remote_epoch_ms, epoch_millis(stamp))
+        self.assertEqual(Transaction.objects.filter(remote_epoch_ms__gte=epoch_millis(stamp)).get(), payment)
@@ -0,0 +1,64 @@
+"""Helpers shared by the payapp test modules."""
+
+import socket
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import override_settings
+
+from payapp import rates
+from payapp.ledger import audit_account
+from payapp.timestamp_server import build_server, uses_framed_transport, wait_until_ready
+
+# Keep the timestamp RPC and every background thread out of the tests:
+# transactions are left for the stamper, which never runs.
+BACKGROUND_OFF = override_settings(
+    TIMESTAMP_ASYNC_STAMPING=True,
+    TIMESTAMP_STAMPER_IN_PROCESS=False,
+    PAYMENT_SETTLER_IN_PROCESS=False,
+    RATE_REFRESHER_ENABLED=False,
+    LEDGER_SNAPSHOT_INTERVAL=3,
+)
+
+
+def make_user(username, balance='100.00', currency='GBP'):
+    return get_user_model().objects.create_user(username, f'{username}@example.com', 'pw',
+                                                currency=currency, balance=Decimal(balance))
+
+
+class LedgerTestMixin:
+    def assertLedgerMatches(self):
+        """Every account's ledger replays to its stored balance."""
+        for account_id in get_user_model().objects.values_list('id', flat=True):
+            ledger_balance, stored = audit_account(account_id)
+            self.assertEqual(ledger_balance, stored, f"account {account_id}")
+
+
+def use_rates(test, quotes, version=1, pivot='GBP'):
+    """
+    Serves quotes as this process's freshly loaded rate snapshot until test
+    ends, so lookups neither load nor refresh anything.
+    """
+    patcher = mock.patch.multiple(rates, _snapshot=rates.build_snapshot(version, quotes, pivot),
+                                  _loaded_at=time.monotonic(), _pair_cache=OrderedDict())
+    patcher.start()
+    test.addCleanup(patcher.stop)
+
+
+def start_timestamp_server(mode='threaded', handler=None):
+    """
+    Serves the timestamp service on a free local port from a daemon thread
+    and returns the port once the server answers.
+    """
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    server = build_server(mode, host='127.0.0.1', port=port, workers=4, handler=handler)
+    threading.Thread(target=server.serve, daemon=True).start()
+    if not wait_until_ready('127.0.0.1', port, framed=uses_framed_transport(mode)):
+        raise RuntimeError(f"timestamp server on port {port} did not start")
+    return port
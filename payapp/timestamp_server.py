@@ -0,0 +1,141 @@
+"""
+Server side of the Thrift remote timestamp service.
+
+build_server() creates a TimestampService server in one of several modes,
+selected by TIMESTAMP_SERVER_MODE:
+
+- 'simple':      TSimpleServer, one connection at a time (debugging only).
+- 'threaded':    TThreadedServer, one thread per open connection.
+- 'threadpool':  TThreadPoolServer with TIMESTAMP_SERVER_WORKERS threads. Each
+                 open connection occupies a worker, so the pool must be at
+                 least as large as the total number of pooled client
+                 connections across all Django processes.
+- 'nonblocking': TNonblockingServer. A select loop multiplexes all connections
+                 and TIMESTAMP_SERVER_WORKERS threads run the handlers. It
+                 requires framed transport, which clients use automatically
+                 in this mode.
+"""
+
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from thrift.Thrift import TApplicationException
+from thrift.protocol import TBinaryProtocol
+from thrift.server import TNonblockingServer, TServer
+from thrift.transport import TSocket, TTransport
+
+from payapp.gen import TimestampService
+
+SERVER_MODES = ('simple', 'threaded', 'threadpool', 'nonblocking')
+
+
+# Largest block a single getTimestamps() call may reserve.
+MAX_TIMESTAMP_BATCH = 10000
+
+
+class TimestampHandler:
+    """
+    Implements the TimestampService interface.
+
+    Every timestamp handed out, singly or in a block, is strictly greater than
+    the previous one: a block of N reserves N consecutive microseconds
+    starting no earlier than the current time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_us = 0
+
+    def _reserve(self, count):
+        with self._lock:
+            start = max(time.time_ns() // 1000, self._last_us + 1)
+            self._last_us = start + count - 1
+        return start
+
+    def getTimestamp(self):
+        return self.getTimestamps(1)[0]
+
+    def getEpochMillis(self):
+        # Drawn from the same sequence, so it never runs behind an issued timestamp.
+        return self._reserve(1) // 1000
+
+    def getTimestamps(self, count):
+        if not 0 < count <= MAX_TIMESTAMP_BATCH:
+            raise TApplicationException(
+                TApplicationException.UNKNOWN, f"count must be between 1 and {MAX_TIMESTAMP_BATCH}")
+        start = self._reserve(count)
+        first = datetime.fromtimestamp(start // 1_000_000).replace(microsecond=start % 1_000_000)
+        return [(first + timedelta(microseconds=i)).isoformat(timespec='microseconds') for i in range(count)]
+
+
+def uses_framed_transport(mode):
+    """Returns True if clients of a server in this mode must use framed transport."""
+    return mode == 'nonblocking'
+
+
+def wait_until_ready(host, port, framed=False, timeout=5.0):
+    """
+    Polls a timestamp server until it answers a getEpochMillis() call.
+
+    This is a real round trip through the handler, not just a TCP connect, so a
+    True result means the server can stamp transactions. Returns False if it
+    does not answer within timeout seconds.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        # A bare connect first: TSocket logs every refused connection as an error.
+        try:
+            socket.create_connection((host, port), timeout=0.5).close()
+        except OSError:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+            continue
+        sock = TSocket.TSocket(host, port)
+        sock.setTimeout(500)
+        transport = TTransport.TFramedTransport(sock) if framed else TTransport.TBufferedTransport(sock)
+        try:
+            transport.open()
+            TimestampService.Client(TBinaryProtocol.TBinaryProtocol(transport)).getEpochMillis()
+            return True
+        except (TTransport.TTransportException, OSError, EOFError):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        finally:
+            transport.close()
+
+
+def build_server(mode='threaded', host=None, port=10000, workers=16, handler=None):
+    """
+    Builds (but does not start) a TimestampService server.
+
+    Args:
+        mode: One of SERVER_MODES.
+        host: Interface to bind (None binds all interfaces).
+        port: TCP port to listen on.
+        workers: Handler threads for the 'threadpool' and 'nonblocking' modes.
+        handler: Service implementation; defaults to TimestampHandler().
+
+    Returns:
+        A server object whose serve() method runs until the process exits.
+    """
+    if mode not in SERVER_MODES:
+        raise ValueError(f"Unknown timestamp server mode {mode!r}; expected one of {', '.join(SERVER_MODES)}")
+    processor = TimestampService.Processor(handler or TimestampHandler())
+    transport = TSocket.TServerSocket(host=host, port=port)
+    pfactory = TBinaryProtocol.TBinaryProtocolFactory()
+
+    if mode == 'nonblocking':
+        return TNonblockingServer.TNonblockingServer(processor, transport, pfactory, pfactory, threads=workers)
+
+    tfactory = TTransport.TBufferedTransportFactory()
+    if mode == 'simple':
+        return TServer.TSimpleServer(processor, transport, tfactory, pfactory)
+    if mode == 'threaded':
+        return TServer.TThreadedServer(processor, transport, tfactory, pfactory, daemon=True)
+    server = TServer.TThreadPoolServer(processor, transport, tfactory, pfactory, daemon=True)
+    server.setNumThreads(workers)
+    return server
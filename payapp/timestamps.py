@@ -0,0 +1,552 @@
+"""
+Client side of the Thrift remote timestamp service.
+
+Transactions are stamped through a process-wide TimestampClientPool per
+timestamp server. Each pool keeps up to TIMESTAMP_POOL_SIZE long-lived
+TimestampService.Client connections open and lends one to each call, so a
+payment no longer pays for a TCP handshake. Idle connections are
+health-checked before reuse, and a call that fails on a broken connection is
+retried once on a fresh one. With several servers in
+TIMESTAMP_SERVICE_ENDPOINTS, a TimestampBalancer spreads calls over them and
+fails over between them.
+
+With TIMESTAMP_LEASE_SIZE above 1, stamps are leased in blocks through
+getTimestamps(), so a busy worker makes one RPC per block rather than one per
+transaction, at some cost in accuracy (see TimestampLease).
+With TIMESTAMP_MODE = 'hlc' stamps come from a local hybrid logical clock
+(payapp/hlc.py) instead, and the RPC is only the fallback.
+"""
+
+import asyncio
+import queue
+import random
+import select
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import datetime
+
+from django.conf import settings
+from thrift.Thrift import TException
+from thrift.protocol import TBinaryProtocol
+from thrift.transport import TSocket, TTransport
+
+from payapp.gen import TimestampService
+from payapp.timestamp_server import MAX_TIMESTAMP_BATCH, uses_framed_transport
+
+
+class TimestampUnavailable(Exception):
+    """Raised when no timestamp could be obtained from the remote service."""
+
+
+def epoch_millis(iso):
+    """
+    Converts an ISO timestamp from the service (naive local time) into epoch
+    milliseconds, or None if iso is empty.
+    """
+    if not iso:
+        return None
+    return int(datetime.fromisoformat(iso).timestamp() * 1000)
+
+
+class _Connection:
+    __slots__ = ('socket', 'transport', 'client', 'last_used')
+
+    def __init__(self, sock, transport, client):
+        self.socket = sock
+        self.transport = transport
+        self.client = client
+        self.last_used = time.monotonic()
+
+    def is_healthy(self, max_idle):
+        """
+        Cheap liveness check for a connection taken from the idle list: an idle
+        socket that is readable has been closed (or poisoned) by the server.
+        """
+        if not self.transport.isOpen():
+            return False
+        if time.monotonic() - self.last_used > max_idle:
+            return False
+        try:
+            readable, _, _ = select.select([self.socket.handle], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+    def close(self):
+        try:
+            self.transport.close()
+        except Exception:
+            pass
+
+
+class TimestampClientPool:
+    """
+    Thread-safe pool of open TimestampService clients for one endpoint.
+
+    Args:
+        host, port: Address of the timestamp server.
+        size: Maximum number of connections (idle plus in use).
+        timeout_ms: Socket connect/read timeout in milliseconds.
+        framed: Use TFramedTransport instead of TBufferedTransport.
+        max_idle: Seconds after which an idle connection is discarded rather than reused.
+    """
+
+    def __init__(self, host, port, size=8, timeout_ms=2000, framed=False, max_idle=60.0):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.timeout_ms = timeout_ms
+        self.framed = framed
+        self.max_idle = max_idle
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        sock = TSocket.TSocket(self.host, self.port)
+        sock.setTimeout(self.timeout_ms)
+        if self.framed:
+            transport = TTransport.TFramedTransport(sock)
+        else:
+            transport = TTransport.TBufferedTransport(sock)
+        client = TimestampService.Client(TBinaryProtocol.TBinaryProtocol(transport))
+        transport.open()
+        return _Connection(sock, transport, client)
+
+    def _checkout(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if conn.is_healthy(self.max_idle):
+                return conn
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        """Lends a connection; it goes back to the pool unless the body raised."""
+        if not self._slots.acquire(timeout=self.timeout_ms / 1000.0):
+            raise TimestampUnavailable(f"Timestamp pool for {self.host}:{self.port} is exhausted")
+        conn = None
+        try:
+            conn = self._checkout()
+            yield conn.client
+        except BaseException:
+            if conn is not None:
+                conn.close()
+            raise
+        else:
+            conn.last_used = time.monotonic()
+            self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    def call(self, method, *args):
+        """
+        Invokes a TimestampService method on a pooled client, reconnecting and
+        retrying once if the connection turns out to be broken.
+        """
+        for attempt in range(2):
+            try:
+                with self.connection() as client:
+                    return getattr(client, method)(*args)
+            except (TException, socket.error, EOFError) as e:
+                if attempt:
+                    raise TimestampUnavailable(f"{method} failed on {self.host}:{self.port}: {e}") from e
+
+    def close(self):
+        """Closes every idle connection."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class _Endpoint:
+    """One timestamp server as seen by the balancer: its pool and health."""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.name = f"{pool.host}:{pool.port}"
+        self.lock = threading.Lock()
+        self.ewma = 0.0
+        self.inflight = 0
+        self.calls = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+
+    def load(self):
+        # Expected wait: smoothed latency scaled by the queue already in front of us.
+        return self.ewma * (self.inflight + 1)
+
+
+class TimestampBalancer:
+    """
+    Spreads timestamp RPCs over several servers, each with its own pool.
+
+    Each call goes to the less loaded of two randomly chosen healthy endpoints
+    (power of two choices), judged by an EWMA of their latency times their
+    in-flight calls. An endpoint that fails eject_after calls in a row is
+    skipped for eject_cooldown seconds, then tried again. A failed call fails
+    over to the next endpoint. If hedge_after_ms is set and a call has not
+    answered by then, a second copy goes to another endpoint and the first
+    answer wins.
+
+    The balancer has the same call()/close() interface as TimestampClientPool.
+    acall() is the asyncio counterpart used by payapp/async_timestamps.py; it
+    shares the endpoints' health, so async and sync calls avoid the same
+    failing servers.
+    """
+
+    EWMA_WEIGHT = 0.3
+
+    def __init__(self, pools, eject_after=3, eject_cooldown=10.0, hedge_after_ms=None):
+        self.endpoints = [_Endpoint(pool) for pool in pools]
+        self.eject_after = eject_after
+        self.eject_cooldown = eject_cooldown
+        self.hedge_after = hedge_after_ms / 1000.0 if hedge_after_ms and len(pools) > 1 else None
+        self.hedges = 0
+        self._executor = None
+        if self.hedge_after is not None:
+            self._executor = ThreadPoolExecutor(sum(pool.size for pool in pools), thread_name_prefix='ts-hedge')
+
+    def _pick(self, exclude):
+        now = time.monotonic()
+        candidates = [e for e in self.endpoints if e not in exclude and e.ejected_until <= now]
+        if not candidates:
+            # Everything left is ejected: try whichever comes back soonest rather than fail outright.
+            candidates = sorted((e for e in self.endpoints if e not in exclude), key=lambda e: e.ejected_until)[:1]
+        if len(candidates) <= 2:
+            return min(candidates, key=_Endpoint.load)
+        return min(random.sample(candidates, 2), key=_Endpoint.load)
+
+    @contextmanager
+    def _tracked(self, endpoint):
+        """Counts a call on endpoint and records its latency or failure."""
+        with endpoint.lock:
+            endpoint.inflight += 1
+            endpoint.calls += 1
+        started = time.perf_counter()
+        try:
+            yield
+        except TimestampUnavailable:
+            with endpoint.lock:
+                endpoint.failures += 1
+                endpoint.consecutive_failures += 1
+                if endpoint.consecutive_failures >= self.eject_after:
+                    endpoint.ejected_until = time.monotonic() + self.eject_cooldown
+            raise
+        else:
+            elapsed = time.perf_counter() - started
+            with endpoint.lock:
+                endpoint.consecutive_failures = 0
+                endpoint.ejected_until = 0.0
+                if endpoint.ewma:
+                    endpoint.ewma += self.EWMA_WEIGHT * (elapsed - endpoint.ewma)
+                else:
+                    endpoint.ewma = elapsed
+        finally:
+            with endpoint.lock:
+                endpoint.inflight -= 1
+
+    def _call_on(self, endpoint, method, *args):
+        with self._tracked(endpoint):
+            return endpoint.pool.call(method, *args)
+
+    async def _acall_on(self, endpoint, pool, method, *args):
+        with self._tracked(endpoint):
+            return await pool.call(method, *args)
+
+    def call(self, method, *args):
+        """Invokes a TimestampService method on the best available endpoint."""
+        tried = set()
+        error = None
+        while len(tried) < len(self.endpoints):
+            primary = self._pick(tried)
+            tried.add(primary)
+            if self.hedge_after is None or len(tried) == len(self.endpoints):
+                try:
+                    return self._call_on(primary, method, *args)
+                except TimestampUnavailable as e:
+                    error = e
+                    continue
+            pending = {self._executor.submit(self._call_on, primary, method, *args)}
+            done, _ = wait(pending, timeout=self.hedge_after)
+            if not done:
+                backup = self._pick(tried)
+                tried.add(backup)
+                self.hedges += 1
+                pending.add(self._executor.submit(self._call_on, backup, method, *args))
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        return future.result()
+                    except TimestampUnavailable as e:
+                        error = e
+        raise TimestampUnavailable(f"All timestamp endpoints failed; last error: {error}")
+
+    async def acall(self, pools, method, *args):
+        """
+        Async call(): picks, fails over and hedges exactly as call() does and
+        shares its health state, but runs each call on pools[endpoint.name],
+        the running event loop's AsyncTimestampPool for that endpoint. A
+        hedged call that loses is cancelled.
+        """
+        tried = set()
+        error = None
+        while len(tried) < len(self.endpoints):
+            primary = self._pick(tried)
+            tried.add(primary)
+            pending = {asyncio.ensure_future(self._acall_on(primary, pools[primary.name], method, *args))}
+            try:
+                if self.hedge_after is not None and len(tried) < len(self.endpoints):
+                    done, _ = await asyncio.wait(pending, timeout=self.hedge_after)
+                    if not done:
+                        backup = self._pick(tried)
+                        tried.add(backup)
+                        self.hedges += 1
+                        pending.add(asyncio.ensure_future(self._acall_on(backup, pools[backup.name], method, *args)))
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        try:
+                            return task.result()
+                        except TimestampUnavailable as e:
+                            error = e
+            finally:
+                for task in pending:
+                    task.cancel()
+        raise TimestampUnavailable(f"All timestamp endpoints failed; last error: {error}")
+
+    def stats(self):
+        """Per-endpoint latency and health, for the metrics view."""
+        now = time.monotonic()
+        return {
+            'hedges': self.hedges,
+            'endpoints': {
+                e.name: {
+                    'ewma_ms': round(e.ewma * 1000, 3),
+                    'inflight': e.inflight,
+                    'calls': e.calls,
+                    'failures': e.failures,
+                    'ejected': e.ejected_until > now,
+                }
+                for e in self.endpoints
+            },
+        }
+
+    def close(self):
+        for endpoint in self.endpoints:
+            endpoint.pool.close()
+
+
+def configured_endpoints():
+    """
+    Returns the timestamp servers as (host, port) pairs: TIMESTAMP_SERVICE_ENDPOINTS
+    ("host:port" strings) if set, else TIMESTAMP_SERVICE_HOST:TIMESTAMP_SERVICE_PORT.
+    """
+    endpoints = getattr(settings, 'TIMESTAMP_SERVICE_ENDPOINTS', None)
+    if not endpoints:
+        return [(getattr(settings, 'TIMESTAMP_SERVICE_HOST', 'localhost'),
+                 getattr(settings, 'TIMESTAMP_SERVICE_PORT', 10000))]
+    pairs = []
+    for endpoint in endpoints:
+        host, _, port = endpoint.rpartition(':')
+        pairs.append((host, int(port)))
+    return pairs
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Returns the process-wide TimestampBalancer configured from settings."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                framed = uses_framed_transport(getattr(settings, 'TIMESTAMP_SERVER_MODE', 'threaded'))
+                pools = [
+                    TimestampClientPool(
+                        host, port,
+                        size=getattr(settings, 'TIMESTAMP_POOL_SIZE', 8),
+                        timeout_ms=getattr(settings, 'TIMESTAMP_TIMEOUT_MS', 2000),
+                        framed=framed,
+                        max_idle=getattr(settings, 'TIMESTAMP_POOL_MAX_IDLE', 60.0),
+                    )
+                    for host, port in configured_endpoints()
+                ]
+                _pool = TimestampBalancer(
+                    pools,
+                    eject_after=getattr(settings, 'TIMESTAMP_EJECT_AFTER', 3),
+                    eject_cooldown=getattr(settings, 'TIMESTAMP_EJECT_COOLDOWN', 10.0),
+                    hedge_after_ms=getattr(settings, 'TIMESTAMP_HEDGE_AFTER_MS', None),
+                )
+    return _pool
+
+
+def endpoint_stats():
+    """Returns the balancer's per-endpoint metrics."""
+    return get_pool().stats()
+
+
+def _fetch_block(pool, count):
+    """Calls getTimestamps() for count stamps, split into server-sized chunks."""
+    stamps = []
+    while len(stamps) < count:
+        stamps.extend(pool.call('getTimestamps', min(count - len(stamps), MAX_TIMESTAMP_BATCH)))
+    return stamps
+
+
+def _micros(iso):
+    """Converts a service timestamp (naive local ISO) into epoch microseconds."""
+    moment = datetime.fromisoformat(iso)
+    return int(moment.replace(microsecond=0).timestamp()) * 1_000_000 + moment.microsecond
+
+
+def _iso(micros):
+    """Formats epoch microseconds the way TimestampHandler does."""
+    moment = datetime.fromtimestamp(micros // 1_000_000).replace(microsecond=micros % 1_000_000)
+    return moment.isoformat(timespec='microseconds')
+
+
+class TimestampLease:
+    """
+    Client-side lease on blocks of timestamps from the server.
+
+    Each getTimestamps() call reserves a block of size stamps and tells the
+    lease how far the local clock is from the server's. take() then stamps
+    the current time, corrected by that offset, at the moment it is called,
+    and only goes back to the server once a block's worth of stamps has been
+    taken or the block is older than ttl seconds. Stamps from one lease are
+    strictly increasing and never behind the last block the server handed
+    out.
+
+    This trades accuracy for throughput: between RPCs a stamp is only as good
+    as the local clock, and stamps are no longer reserved on the server, so
+    two processes can issue the same one.
+    """
+
+    def __init__(self, pool, size=1, ttl=1.0):
+        self.pool = pool
+        self.size = size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._remaining = 0
+        self._offset_us = 0
+        self._last_us = 0
+        self._expires = 0.0
+
+    def take(self, count=1):
+        """Returns a list of count strictly increasing timestamps."""
+        with self._lock:
+            if count > self._remaining or time.monotonic() >= self._expires:
+                block = _fetch_block(self.pool, max(count, self.size))
+                first = _micros(block[0])
+                self._offset_us = first - time.time_ns() // 1000
+                self._last_us = max(self._last_us, first - 1)
+                self._remaining = len(block)
+                self._expires = time.monotonic() + self.ttl
+            start = max(time.time_ns() // 1000 + self._offset_us, self._last_us + 1)
+            self._last_us = start + count - 1
+            self._remaining -= count
+            return [_iso(start + i) for i in range(count)]
+
+
+_lease = None
+
+
+def get_lease():
+    """Returns the process-wide TimestampLease, or None if leasing is disabled."""
+    global _lease
+    size = getattr(settings, 'TIMESTAMP_LEASE_SIZE', 1)
+    if size <= 1:
+        return None
+    if _lease is None:
+        pool = get_pool()
+        with _pool_lock:
+            if _lease is None:
+                _lease = TimestampLease(pool, size, getattr(settings, 'TIMESTAMP_LEASE_TTL', 1.0))
+    return _lease
+
+
+_clock = None
+
+
+def get_clock():
+    """
+    Returns the process-wide HybridLogicalClock, or None unless
+    TIMESTAMP_MODE is 'hlc'.
+    """
+    global _clock
+    if getattr(settings, 'TIMESTAMP_MODE', 'rpc') != 'hlc':
+        return None
+    if _clock is None:
+        from .hlc import HybridLogicalClock
+
+        pool = get_pool()
+        with _pool_lock:
+            if _clock is None:
+                _clock = HybridLogicalClock(
+                    lambda: pool.call('getEpochMillis'),
+                    sync_interval=getattr(settings, 'HLC_SYNC_INTERVAL', 5.0),
+                    max_drift_ms=getattr(settings, 'HLC_MAX_DRIFT_MS', 50.0),
+                )
+    return _clock
+
+
+def clock_stats():
+    """Returns the HLC metrics, or None if the clock is not in use."""
+    clock = get_clock()
+    return dict(clock.metrics) if clock is not None else None
+
+
+def get_remote_timestamps(count):
+    """
+    Returns count strictly increasing ISO timestamps from the remote service,
+    using one RPC per MAX_TIMESTAMP_BATCH stamps at most, or None if the service
+    could not be reached.
+
+    In 'hlc' mode the stamps come from the local hybrid logical clock instead,
+    falling back to the RPC whenever the clock is out of sync.
+    """
+    clock = get_clock()
+    if clock is not None:
+        if clock.healthy():
+            return clock.now(count)
+        clock.metrics['fallbacks'] += 1
+    try:
+        # Leased blocks may be older than stamps the clock already issued, so
+        # the fallback always asks the service directly.
+        stamps = _fetch_block(get_pool(), count) if clock is not None else _fetch_remote(count)
+    except TimestampUnavailable as e:
+        print("Error retrieving remote timestamp:", e)
+        return None
+    if clock is not None:
+        clock.observe(stamps[-1])
+    return stamps
+
+
+def _fetch_remote(count):
+    lease = get_lease()
+    if lease is not None:
+        return lease.take(count)
+    if count == 1:
+        return [get_pool().call('getTimestamp')]
+    return _fetch_block(get_pool(), count)
+
+
+def get_remote_timestamp():
+    """
+    Returns an ISO timestamp from the remote Thrift service, or None if the
+    service could not be reached.
+    """
+    stamps = get_remote_timestamps(1)
+    return stamps[0] if stamps else None
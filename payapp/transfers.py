@@ -0,0 +1,124 @@
+"""
+Balance transfer engine.
+
+Every movement of money between two accounts goes through transfer(), which
+runs a fixed number of statements however busy the accounts are:
+
+1. SELECT ... FOR UPDATE on both account rows in one query, ordered by id, so
+   two transfers between the same pair of accounts (in either direction)
+   always lock in the same order and cannot deadlock. Only the balances are
+   read.
+2. One UPDATE that debits the payer and credits the payee with
+   CASE/WHEN over F('balance') (apply_balance_deltas, shared with bulk
+   payouts). It touches no column except balance and the ledger_sequence
+   counter.
+3. The INSERT of the Transaction being settled, if it is not saved yet.
+4. One INSERT of the two ledger entries (payapp/ledger.py), plus a snapshot
+   insert every LEDGER_SNAPSHOT_INTERVAL entries.
+
+The row locks make the funds check and the update one atomic step, so
+concurrent payments can no longer overwrite each other's balance changes.
+
+A payee with striping enabled (payapp/striping.py) is not locked at all:
+step 1 locks only the payer, step 4 writes only the payer's entry, and one
+more UPDATE credits one of the payee's AccountShard rows instead. The credit
+reaches the payee's balance and ledger when the shards are consolidated.
+"""
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Case, F, PositiveBigIntegerField, When
+
+from . import ledger, striping
+
+
+class InsufficientFunds(Exception):
+    """Raised when the payer's balance does not cover the debit."""
+
+
+class UnknownAccount(Exception):
+    """Raised when the payer or the payee no longer exists."""
+
+
+def lock_balances(account_ids):
+    """
+    Locks the given accounts in id order and returns {id: (balance, ledger_sequence)}.
+    Must run inside a transaction.
+    """
+    User = get_user_model()
+    return {
+        account_id: (balance, sequence)
+        for account_id, balance, sequence in User.objects.select_for_update()
+        .filter(id__in=account_ids)
+        .order_by('id')
+        .values_list('id', 'balance', 'ledger_sequence')
+    }
+
+
+def apply_balance_deltas(deltas, entry_counts, chunk_size=1000):
+    """
+    Adds deltas[id] to each account's balance and entry_counts[id] to its
+    ledger_sequence with set-based CASE/WHEN F() updates: one UPDATE per
+    chunk_size accounts, touching only those two columns. The accounts must
+    already be locked (see lock_balances).
+    """
+    User = get_user_model()
+    account_ids = sorted(deltas)
+    for i in range(0, len(account_ids), chunk_size):
+        chunk = account_ids[i:i + chunk_size]
+        User.objects.filter(id__in=chunk).update(
+            balance=Case(
+                *[When(id=account_id, then=F('balance') + deltas[account_id]) for account_id in chunk],
+                default=F('balance'),
+            ),
+            ledger_sequence=Case(
+                *[When(id=account_id, then=F('ledger_sequence') + entry_counts[account_id]) for account_id in chunk],
+                default=F('ledger_sequence'),
+                output_field=PositiveBigIntegerField(),
+            ),
+        )
+
+
+def transfer(payer_id, payee_id, debit, credit, record=None, payee_shards=0):
+    """
+    Debits debit from payer_id and credits credit to payee_id (each in that
+    account's own currency), atomically, and writes the ledger entries.
+
+    record is the Transaction this transfer settles. If it has not been saved
+    yet it is saved once the funds are confirmed, so a refused transfer leaves
+    no trace. payee_shards is the payee's CustomUser.balance_shards; if it is
+    non-zero the credit goes to one of the payee's shards. Runs in the
+    caller's transaction if there is one. Raises InsufficientFunds (and
+    changes nothing) if the payer cannot cover the debit. Returns the new
+    payer balance and the new payee balance (None for a striped payee, whose
+    balance is only known after consolidation).
+    """
+    if payer_id == payee_id:
+        raise ValueError("Cannot transfer between an account and itself")
+    striped = payee_shards > 0
+    # No savepoint inside the caller's transaction: that would cost two more
+    # statements. Errors are therefore raised only after the block has exited
+    # cleanly, so they never doom the caller's transaction.
+    with transaction.atomic(savepoint=False):
+        balances = lock_balances([payer_id] if striped else [payer_id, payee_id])
+        missing = ({payer_id} if striped else {payer_id, payee_id}) - balances.keys()
+        covered = not missing and balances[payer_id][0] >= debit
+        if covered and striped and not striping.credit_shard(payee_id, payee_shards, credit):
+            missing = {payee_id}
+        if covered and not missing:
+            if striped:
+                apply_balance_deltas({payer_id: -debit}, {payer_id: 1})
+            else:
+                apply_balance_deltas({payer_id: -debit, payee_id: credit}, {payer_id: 1, payee_id: 1})
+            if record is not None and record.pk is None:
+                record.save()
+            movements = [(payer_id, -debit, record)]
+            if not striped:
+                movements.append((payee_id, credit, record))
+            ledger.record_entries(balances, movements)
+    if missing:
+        raise UnknownAccount(f"Account {min(missing)} does not exist")
+    if not covered:
+        raise InsufficientFunds(f"Balance {balances[payer_id][0]} does not cover {debit}")
+    striping.note_credits([payee_id])
+    return balances[payer_id][0] - debit, None if striped else balances[payee_id][0] + credit
@@ -8,18 +8,26 @@ This module defines view functions for:
 - Admin functionalities: viewing all users, transactions, and promoting users to admin.
 - Integrating a remote Thrift timestamp service for transaction timestamping.
 """
-import requests
+import json
+import math
 from django import forms
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.db import transaction
-from django.http import JsonResponse, HttpResponse
+from django.db.models import F
+from django.http import JsonResponse, HttpResponse, HttpResponseNotModified
 from django.shortcuts import render, redirect, get_object_or_404
-from django.views.decorators.http import require_GET
-from thrift.protocol import TBinaryProtocol
-from thrift.transport import TSocket, TTransport
-from .models import Transaction
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from . import payouts, rates, settlement, striping, transfers
+from .idempotency import idempotency_stats, idempotent, new_key
+from .models import QueuedPayment, Transaction
+from .stamping import stamp_or_defer, stamping_stats
+from .timestamps import clock_stats, endpoint_stats, epoch_millis, get_remote_timestamp
 from decimal import Decimal, ROUND_HALF_UP
 from django.utils.dateparse import parse_datetime
 
@@ -34,66 +42,203 @@ def conversion(request, currency1, currency2, amount):
     """
     A RESTful service to convert an amount from one currency to another.
     URL pattern: /conversion/<currency1>/<currency2>/<amount>/
+
+    The response only depends on the path and the rate table version, so it
+    carries a strong ETag for that version and may be cached for one rate
+    refresh interval. A matching If-None-Match gets a 304 without any work.
     """
+    snapshot = rates.current_snapshot()
+    etag = f'"rates-v{snapshot.version}"'
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match and (if_none_match.strip() == '*' or etag in parse_etags(if_none_match)):
+        return _cache_conversion(HttpResponseNotModified(), etag)
+
     try:
         amount = float(amount)
     except ValueError:
         return JsonResponse({'error': 'Invalid amount value'}, status=400)
 
-    # Define hard-coded conversion rates
-    rates = {
-        ('GBP', 'USD'): 1.20,
-        ('GBP', 'EUR'): 1.13,
-        ('USD', 'GBP'): 0.83,
-        ('USD', 'EUR'): 0.94,
-        ('EUR', 'GBP'): 0.88,
-        ('EUR', 'USD'): 1.06,
-    }
-
-    # Allow same currency conversion (rate = 1)
-    if currency1.upper() == currency2.upper():
-        return JsonResponse({
-            'from_currency': currency1.upper(),
-            'to_currency': currency2.upper(),
-            'original_amount': amount,
-            'rate': 1.0,
-            'converted_amount': amount
-        })
-
-    rate = rates.get((currency1.upper(), currency2.upper()))
-    if rate is None:
-        return JsonResponse({'error': 'Unsupported currency conversion'}, status=400)
+    try:
+        rate = float(rates.get_rate(currency1, currency2, snapshot))
+    except rates.UnsupportedConversion:
+        return _cache_conversion(JsonResponse({'error': 'Unsupported currency conversion'}, status=400), etag)
 
     converted_amount = amount * rate
-    return JsonResponse({
+    return _cache_conversion(JsonResponse({
         'from_currency': currency1.upper(),
         'to_currency': currency2.upper(),
         'original_amount': amount,
         'rate': rate,
         'converted_amount': round(converted_amount, 2)
+    }), etag)
+
+def _cache_conversion(response, etag):
+    """Adds the validator and freshness headers shared by conversion responses."""
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=getattr(settings, 'RATE_REFRESH_INTERVAL', 30))
+    return response
+
+@csrf_exempt
+@require_POST
+def conversion_batch(request):
+    """
+    Converts many amounts in a single request.
+    URL pattern: /conversion/batch/
+
+    Accepts a JSON array of {"from": ..., "to": ..., "amount": ...} items (or an
+    object with that array under "items"). Results are returned in input order;
+    an invalid item gets an "error" entry instead of failing the whole batch.
+    Every item is priced from the current snapshot alone, so a pair it cannot
+    price is reported as unsupported rather than looked up upstream.
+    """
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid JSON body'}, status=400)
+    items = payload.get('items') if isinstance(payload, dict) else payload
+    if not isinstance(items, list):
+        return JsonResponse({'error': 'Expected a list of conversion items'}, status=400)
+    max_items = getattr(settings, 'RATE_BATCH_MAX_ITEMS', 10000)
+    if len(items) > max_items:
+        return JsonResponse({'error': f'At most {max_items} items per batch'}, status=400)
+
+    # Validate every item first, then price all valid items against one snapshot.
+    parsed = []
+    for item in items:
+        try:
+            amount = float(item['amount'])
+            if not math.isfinite(amount):
+                raise ValueError(amount)
+            parsed.append((str(item['from']).upper(), str(item['to']).upper(), amount))
+        except (KeyError, TypeError, ValueError):
+            parsed.append(None)
+    version, batch = rates.batch_rates([(p[0], p[1]) for p in parsed if p is not None])
+
+    results = []
+    batch_iter = iter(batch)
+    for item in parsed:
+        if item is None:
+            results.append({'error': 'Invalid conversion item'})
+            continue
+        from_currency, to_currency, amount = item
+        rate = next(batch_iter)
+        if rate is None:
+            results.append({
+                'from_currency': from_currency,
+                'to_currency': to_currency,
+                'error': 'Unsupported currency conversion',
+            })
+            continue
+        rate = float(rate)
+        results.append({
+            'from_currency': from_currency,
+            'to_currency': to_currency,
+            'original_amount': amount,
+            'rate': rate,
+            'converted_amount': round(amount * rate, 2),
+        })
+    return JsonResponse({'rate_version': version, 'results': results})
+
+def record_payment(sender, recipient, amount, converted_amount, remote_ts):
+    """
+    Moves the money and records a completed payment: the sender is debited
+    amount (their currency) and the recipient credited converted_amount.
+    Raises transfers.InsufficientFunds, recording nothing, if the sender's
+    balance (read under lock) does not cover amount.
+    """
+    # Store original amount and converted amount; transfer() saves it once the funds are confirmed
+    payment = Transaction(
+        sender=sender,
+        recipient=recipient,
+        transaction_type='PAYMENT',
+        amount=amount,  # amount in sender's currency
+        converted_amount=converted_amount,  # record the converted amount
+        status='Completed',
+        remote_timestamp=remote_ts,
+        remote_epoch_ms=epoch_millis(remote_ts),
+    )
+    # Debit and credit both balances in one locked, conditional update
+    # (a striped recipient is credited through one of its shards instead)
+    sender.balance, recipient_balance = transfers.transfer(
+        sender.id, recipient.id, amount, converted_amount, record=payment, payee_shards=recipient.balance_shards)
+    if recipient_balance is not None:
+        recipient.balance = recipient_balance
+    return payment
+
+def queued_message(queued, sender, recipient):
+    return (f"Payment of {queued.amount} {sender.currency} to {recipient.username} queued "
+            f"(reference {queued.id}); it will appear below once settled.")
+
+
+def record_request(sender, recipient, amount, converted_amount, remote_ts):
+    """Records a "Pending" payment request with its conversion info."""
+    return Transaction.objects.create(
+        sender=sender,
+        recipient=recipient,
+        transaction_type='REQUEST',
+        amount=amount,
+        converted_amount=converted_amount,
+        status='Pending',
+        remote_timestamp=remote_ts,
+        remote_epoch_ms=epoch_millis(remote_ts),
+    )
+
+@login_required
+@require_GET
+def queued_payment_status(request, payment_id):
+    """
+    Reports a queued payment's progress, for clients to poll.
+    URL pattern: /webapps2025/pay/queued/<payment_id>/
+    """
+    queued = get_object_or_404(QueuedPayment, id=payment_id, sender=request.user)
+    if queued.status == 'Queued':
+        # Payments left queued by a restart need a running settler.
+        settlement.request_settlement()
+    return JsonResponse({
+        'id': queued.id,
+        'status': queued.status,
+        'failure_reason': queued.failure_reason or None,
+        'transaction_id': queued.transaction_id,
+        'settled_at': queued.settled_at,
     })
 
-def get_transaction_rate(from_currency, to_currency):
+@login_required
+@require_POST
+@idempotent
+def bulk_payout(request):
     """
-    Fetches the conversion rate from from_currency to to_currency.
-    For transactions, we pass an amount of 1 so that the returned rate is directly usable.
-    Returns a Decimal conversion multiplier.
+    Pays many recipients from the logged-in user's account in one atomic batch.
+    URL pattern: /webapps2025/pay/bulk/
+
+    Accepts a JSON array of {"recipient": username, "amount": ...} items (or an
+    object with that array under "items"), amounts in the sender's currency.
+    Unlike conversion_batch, one bad item rejects the whole batch: the response
+    lists every offending item and no payout is made.
     """
-    if from_currency.upper() == to_currency.upper():
-        return Decimal('1.0')
     try:
-        url = f"http://127.0.0.1:8000/conversion/{from_currency.upper()}/{to_currency.upper()}/1/"
-        response = requests.get(url)
-        if response.status_code == 200:
-            data = response.json()
-            rate = data.get('rate', 1.0)
-            return Decimal(str(rate))
-        else:
-            print("Transaction conversion service returned error:", response.status_code)
-            return Decimal('1.0')
-    except Exception as e:
-        print("Error calling transaction conversion service:", e)
-        return Decimal('1.0')
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid JSON body'}, status=400)
+    items = payload.get('items') if isinstance(payload, dict) else payload
+    try:
+        created = payouts.bulk_payout(request.user, payouts.parse_payouts(items))
+    except payouts.PayoutError as e:
+        return JsonResponse({'errors': [{'item': i, 'error': msg} for i, msg in e.errors]}, status=400)
+    except transfers.InsufficientFunds:
+        return JsonResponse({'error': 'Insufficient funds for this batch'}, status=409)
+    return JsonResponse({
+        'count': len(created),
+        'transaction_ids': [payment.id for payment in created],
+        'balance': str(request.user.balance),
+    })
+
+def get_transaction_rate(from_currency, to_currency):
+    """
+    Returns the Decimal conversion multiplier from from_currency to to_currency.
+    Reads the shared in-process rate engine directly rather than calling the
+    conversion endpoint over HTTP. Raises rates.UnsupportedConversion for unknown pairs.
+    """
+    return rates.get_rate(from_currency, to_currency)
 
 # --------------------------
 # User Views
@@ -147,6 +292,7 @@ def requests_list(request):
 
 @transaction.atomic
 @login_required
+@idempotent
 def make_payment(request):
     """
         Allows a logged-in user to make a direct payment to another registered user.
@@ -175,35 +321,30 @@ def make_payment(request):
 
             # For transaction conversion, use sender.currency as the source and recipient.currency as the target.
             if sender.currency != recipient.currency:
-                conversion_rate = get_transaction_rate(sender.currency, recipient.currency)
+                try:
+                    conversion_rate = get_transaction_rate(sender.currency, recipient.currency)
+                except rates.UnsupportedConversion:
+                    messages.error(request, f"Cannot convert {sender.currency} to {recipient.currency}.")
+                    return redirect('make_payment')
                 amount_in_recipient_currency = amount * conversion_rate
                 amount_in_recipient_currency = amount_in_recipient_currency.quantize(Decimal('0.01'),rounding=ROUND_HALF_UP)
             else:
                 amount_in_recipient_currency = amount
 
-            # Get remote timestamp
-            remote_ts = get_remote_timestamp()
-
-            # Create the transaction (store original amount and converted amount)
-            transaction = Transaction.objects.create(
-                sender=sender,
-                recipient=recipient,
-                transaction_type='PAYMENT',
-                amount=amount,  # amount in sender's currency
-                converted_amount=amount_in_recipient_currency,  # record the converted amount
-                status='Completed',
-                remote_timestamp=remote_ts,
-            )
-
-            # Update sender's balance (deduct original amount)
-            sender.balance -= amount
-            sender.balance = sender.balance.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+            # In queued mode the settlement worker moves the money (and stamps it) later.
+            if settlement.queue_enabled():
+                queued = settlement.enqueue(sender, recipient, amount, amount_in_recipient_currency)
+                messages.success(request, queued_message(queued, sender, recipient))
+                return redirect('transaction_history')
 
-            # Update recipient's balance (add converted amount)
-            recipient.balance += amount_in_recipient_currency
+            # Get the remote timestamp (None if it is left to the background stamper)
+            remote_ts = stamp_or_defer()
 
-            sender.save()
-            recipient.save()
+            try:
+                record_payment(sender, recipient, amount, amount_in_recipient_currency, remote_ts)
+            except transfers.InsufficientFunds:
+                messages.error(request, "Insufficient funds.")
+                return redirect('make_payment')
 
             messages.success(request, f"Payment of {amount} {sender.currency} to {recipient.username} completed.")
             return redirect('transaction_history')
@@ -211,10 +352,11 @@ def make_payment(request):
             messages.error(request, "Please correct the errors below.")
     else:
         form = PaymentForm()
-    return render(request, 'payapp/make_payment.html', {'form': form})
+    return render(request, 'payapp/make_payment.html', {'form': form, 'idempotency_key': new_key()})
 
 @transaction.atomic
 @login_required
+@idempotent
 def request_payment(request):
     if request.method == 'POST':
         form = PaymentForm(request.POST)
@@ -236,25 +378,20 @@ def request_payment(request):
 
             # For transaction conversion, use sender.currency as source and recipient.currency as target.
             if sender.currency != recipient.currency:
-                conversion_rate = get_transaction_rate(sender.currency, recipient.currency)
+                try:
+                    conversion_rate = get_transaction_rate(sender.currency, recipient.currency)
+                except rates.UnsupportedConversion:
+                    messages.error(request, f"Cannot convert {sender.currency} to {recipient.currency}.")
+                    return redirect('request_payment')
                 amount_in_recipient_currency = amount * conversion_rate
                 amount_in_recipient_currency = amount_in_recipient_currency.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
             else:
                 amount_in_recipient_currency = amount
 
-            # Get the remote timestamp
-            remote_ts = get_remote_timestamp()
-
-            # Create a "Pending" transaction with conversion info stored
-            Transaction.objects.create(
-                sender=sender,
-                recipient=recipient,
-                transaction_type='REQUEST',
-                amount=amount,
-                converted_amount=amount_in_recipient_currency,
-                status='Pending',
-                remote_timestamp=remote_ts,
-            )
+            # Get the remote timestamp (None if it is left to the background stamper)
+            remote_ts = stamp_or_defer()
+
+            record_request(sender, recipient, amount, amount_in_recipient_currency, remote_ts)
             messages.success(
                 request,
                 f"Payment request of {amount} {sender.currency} (equivalent to {amount_in_recipient_currency} {recipient.currency}) sent to {recipient.username}."
@@ -264,42 +401,52 @@ def request_payment(request):
             messages.error(request, "Please correct the errors below.")
     else:
         form = PaymentForm()
-    return render(request, 'payapp/request_payment.html', {'form': form})
+    return render(request, 'payapp/request_payment.html', {'form': form, 'idempotency_key': new_key()})
 
 
 @login_required
 def handle_request(request, transaction_id):
-    transaction = Transaction.objects.filter(id=transaction_id, transaction_type='REQUEST').first()
-    if not transaction:
+    payment_request = (Transaction.objects.select_related('sender')
+                       .filter(id=transaction_id, transaction_type='REQUEST').first())
+    if not payment_request:
         messages.error(request, "Transaction not found or not a request.")
         return redirect('transaction_history')
 
     # Only allow the recipient to respond to the request
-    if request.user != transaction.recipient:
+    if request.user.id != payment_request.recipient_id:
         messages.error(request, "You are not the recipient of this request.")
         return redirect('transaction_history')
 
     if request.method == 'POST':
         action = request.POST.get('action')
-        if action == 'accept':
-            # Check if recipient has enough balance
-            if transaction.recipient.balance >= transaction.amount:
-                transaction.recipient.balance -= transaction.amount
-                transaction.sender.balance += transaction.amount
-                transaction.recipient.save()
-                transaction.sender.save()
-                transaction.status = 'Completed'
-                messages.success(request, "Payment request accepted and paid.")
+        with transaction.atomic():
+            # Lock the request so it can only be answered once.
+            status = Transaction.objects.select_for_update().filter(id=payment_request.id).values_list(
+                'status', flat=True).first()
+            if status != 'Pending':
+                messages.error(request, "This request has already been handled.")
+                return redirect('transaction_history')
+            if action == 'accept':
+                # The payer (recipient) pays the converted amount in their own
+                # currency; the requester (sender) receives the amount they asked for.
+                try:
+                    transfers.transfer(
+                        payment_request.recipient_id, payment_request.sender_id,
+                        payment_request.converted_amount or payment_request.amount, payment_request.amount,
+                        record=payment_request, payee_shards=payment_request.sender.balance_shards,
+                    )
+                    status = 'Completed'
+                    messages.success(request, "Payment request accepted and paid.")
+                except transfers.InsufficientFunds:
+                    status = 'Rejected'
+                    messages.error(request, "Not enough balance to accept this request.")
             else:
-                transaction.status = 'Rejected'
-                messages.error(request, "Not enough balance to accept this request.")
-        else:
-            transaction.status = 'Rejected'
-            messages.warning(request, "Payment request rejected.")
-        transaction.save()
+                status = 'Rejected'
+                messages.warning(request, "Payment request rejected.")
+            Transaction.objects.filter(id=payment_request.id).update(status=status)
         return redirect('transaction_history')
 
-    return render(request, 'payapp/handle_request.html', {'transaction': transaction})
+    return render(request, 'payapp/handle_request.html', {'transaction': payment_request})
 
 @login_required
 def transaction_history(request):
@@ -314,9 +461,15 @@ def transaction_history(request):
         else:
             tx.effective_amount = tx.amount
 
+    # Queued payments show here until they settle into a sent transaction.
+    queued = user.queued_payments.exclude(status='Settled').select_related('recipient')
+
     return render(request, 'payapp/transaction_history.html', {
         'sent': sent,
         'received': received,
+        'queued': queued,
+        # Credits to a striped account that have not reached its balance yet.
+        'unconsolidated': striping.unconsolidated_balance(user.id),
     })
 
 # --------------------------
@@ -333,9 +486,23 @@ def admin_users(request):
 @user_passes_test(is_staff_check)
 def admin_transactions(request):
     """View all payment transactions."""
-    all_txs = Transaction.objects.all()
+    # Newest first by remote time; unstamped rows last.
+    all_txs = Transaction.objects.order_by(F('remote_epoch_ms').desc(nulls_last=True), '-id')
     return render(request, 'admin_transactions.html', {'transactions': all_txs})
 
+@user_passes_test(is_staff_check)
+def metrics(request):
+    """Operational counters for this process, as JSON."""
+    return JsonResponse({
+        'rates': rates.lookup_stats(),
+        'clock': clock_stats(),
+        'timestamp_servers': endpoint_stats(),
+        'stamping': stamping_stats(),
+        'idempotency': idempotency_stats(),
+        'settlement': settlement.settlement_stats(),
+        'hot_accounts': striping.hot_accounts(),
+    })
+
 @user_passes_test(is_staff_check)
 @transaction.atomic
 def make_admin(request, user_id):
@@ -346,28 +513,15 @@ def make_admin(request, user_id):
         messages.warning(request, f"{user_to_promote.username} is already an admin.")
     else:
         user_to_promote.is_staff = True
-        user_to_promote.save()
+        # Only the flag: a full save would write back a balance and ledger
+        # sequence that a concurrent transfer may already have moved on.
+        user_to_promote.save(update_fields=['is_staff'])
         messages.success(request, f"{user_to_promote.username} has been made an admin!")
     return redirect('admin_users')
 
 # --------------------------
 # RTC
 # --------------------------
-def get_remote_timestamp():
-    transport = TSocket.TSocket('localhost', 10000)
-    transport = TTransport.TBufferedTransport(transport)
-    protocol = TBinaryProtocol.TBinaryProtocol(transport)
-    try:
-        from payapp.gen.TimestampService import Client
-    except ImportError as e:
-        print("Error importing Thrift generated code:", e)
-        return None
-    client = Client(protocol)
-    transport.open()
-    ts = client.getTimestamp()
-    transport.close()
-    return ts
-
 @login_required
 def remote_timestamp_view(request):
     ts = get_remote_timestamp()
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-17 00:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('register', '0003_alter_customuser_currency'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='ledger_sequence',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-17 00:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('register', '0004_customuser_ledger_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='balance_shards',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
@@ -8,23 +8,28 @@ from decimal import Decimal
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 
+from .currencies import CURRENCY_CHOICES
+
 class CustomUser(AbstractUser):
     """
        Custom user model that extends Django's AbstractUser.
 
        Additional Fields:
            currency (CharField): The currency in which the user's account is maintained.
-               Choices are 'GBP', 'USD', and 'EUR'. Defaults to 'GBP'.
+               Choices are the ISO 4217 codes in register.currencies. Defaults to 'GBP'.
            balance (DecimalField): The monetary balance of the user's account.
                Defaults to 750.00.
+           ledger_sequence (PositiveBigIntegerField): Number of ledger entries written
+               for this account; bumped in the same UPDATE as the balance.
+           balance_shards (PositiveSmallIntegerField): Number of AccountShard rows that
+               single payments to this account credit instead of balance (0, the
+               default, turns striping off). See payapp/striping.py.
        """
-    CURRENCY_CHOICES = [
-        ('GBP', 'Pounds'),
-        ('USD', 'US Dollars'),
-        ('EUR', 'Euros'),
-    ]
+    CURRENCY_CHOICES = CURRENCY_CHOICES
     currency = models.CharField(max_length=3, choices=CURRENCY_CHOICES, default='GBP')
     balance = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('750.00'))
+    ledger_sequence = models.PositiveBigIntegerField(default=0)
+    balance_shards = models.PositiveSmallIntegerField(default=0)
 
     def __str__(self):
         """
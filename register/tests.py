@@ -1 +1,33 @@
-# Create your tests here.
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from payapp.tests.utils import use_rates
+
+
+class RegistrationTests(TestCase):
+    def setUp(self):
+        use_rates(self, {('GBP', 'USD'): Decimal('1.20')})
+
+    def register(self, username, currency):
+        return self.client.post('/webapps2025/register/signup/', {
+            'username': username,
+            'email': f'{username}@example.com',
+            'currency': currency,
+            'password1': 'a-long-Passw0rd',
+            'password2': 'a-long-Passw0rd',
+        })
+
+    def test_opening_balance_is_converted_from_gbp(self):
+        self.assertRedirects(self.register('ann', 'USD'), '/webapps2025/', fetch_redirect_response=False)
+        self.assertEqual(get_user_model().objects.get(username='ann').balance, Decimal('900.00'))
+
+    def test_currency_without_a_rate_is_refused(self):
+        response = self.register('ann', 'JPY')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(get_user_model().objects.filter(username='ann').exists())
+
+    def test_only_iso_currencies_can_be_chosen(self):
+        self.assertEqual(self.register('ann', 'ZZZ').status_code, 200)
+        self.assertFalse(get_user_model().objects.filter(username='ann').exists())
@@ -4,15 +4,15 @@ Views for user registration and authentication.
 This module provides:
 - A custom login form (LoginForm)
 - A custom user creation form (CustomUserCreationForm) extending Django's UserCreationForm
-- A utility function get_conversion_rate() that calls a RESTful service to fetch a conversion rate
+- A utility function get_conversion_rate() that reads a conversion rate from the shared rate engine
 - View functions for user registration, login, and logout
 """
-import requests
 from django import forms
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.forms import UserCreationForm
 from django.shortcuts import render, redirect
+from payapp import rates
 from .models import CustomUser
 
 # Inline login form
@@ -37,26 +37,11 @@ class CustomUserCreationForm(UserCreationForm):
 
 def get_conversion_rate(target_currency):
     """
-    Calls the RESTful conversion service to get the conversion rate from GBP to the target currency.
-    If the target currency is GBP, returns 1.0.
+    Returns the conversion rate from GBP to the target currency using the shared
+    in-process rate engine. If the target currency is GBP, returns 1.0.
+    Raises payapp.rates.UnsupportedConversion if no rate is known.
     """
-    if target_currency.upper() == 'GBP':
-        return 1.0
-    try:
-
-        # /conversion/<currency1>/<currency2>/<amount>/
-        # Here we pass 750 as the amount to get the rate.
-        url = f'http://127.0.0.1:8000/conversion/GBP/{target_currency.upper()}/750/'
-        response = requests.get(url)
-        if response.status_code == 200:
-            data = response.json()
-            return data.get('rate', 1.0)
-        else:
-            print("Conversion service returned error code:", response.status_code)
-            return 1.0
-    except Exception as e:
-        print("Error calling conversion service:", e)
-        return 1.0
+    return float(rates.get_rate('GBP', target_currency))
 
 
 def register(request):
@@ -76,8 +61,13 @@ def register(request):
         if form.is_valid():
             # Get the chosen currency from the form
             chosen_currency = form.cleaned_data['currency']
-            # Call the REST service to get the conversion rate from GBP to chosen currency.
-            conversion_rate = get_conversion_rate(chosen_currency)
+            # Look up the conversion rate from GBP to the chosen currency.
+            try:
+                conversion_rate = get_conversion_rate(chosen_currency)
+            except rates.UnsupportedConversion:
+                form.add_error('currency', "Accounts in this currency are not available yet.")
+                messages.error(request, "Please correct the errors to continue.")
+                return render(request, 'register/register.html', {'form': form})
             baseline = 750.0  # The baseline amount in GBP.
             initial_balance = baseline * conversion_rate
 
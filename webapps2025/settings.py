@@ -137,3 +137,129 @@ CRISPY_TEMPLATE_PACK = "bootstrap5"
 # SECURE_HSTS_INCLUDE_SUBDOMAINS = True
 # SECURE_HSTS_PRELOAD = True
 # X_FRAME_OPTIONS = 'DENY'
+
+# Currency rates
+# Base rates in the ExchangeRate table are quoted against this currency; every
+# other pair is triangulated through it.
+RATE_PIVOT_CURRENCY = 'GBP'
+# Where rate snapshots come from: DatabaseRateProvider (the ExchangeRate table),
+# HttpRateProvider (RATE_SOURCE_URL) or StaticRateProvider (RATE_STATIC_RATES,
+# for offline use).
+RATE_PROVIDER = 'payapp.rate_providers.DatabaseRateProvider'
+RATE_STATIC_RATES = None
+# Run the background rate refresher, and the seconds between refreshes. This is
+# also the max-age of cached conversion responses.
+RATE_REFRESHER_ENABLED = True
+RATE_REFRESH_INTERVAL = 30
+# Maximum number of items accepted by the batch conversion endpoint.
+RATE_BATCH_MAX_ITEMS = 10000
+# Maximum number of currency pairs looked up outside the snapshot that are
+# remembered per process (least recently used are dropped first).
+RATE_PAIR_CACHE_SIZE = 1024
+# Maximum number of payouts accepted by the bulk payout endpoint.
+PAYOUT_MAX_ITEMS = 10000
+# Upstream exchange-rate source (None disables it). It must answer
+# GET <url>?base=<pivot> with {"base": ..., "rates": {code: rate}}.
+RATE_SOURCE_URL = None
+# (connect, read) timeouts in seconds for rate source requests.
+RATE_SOURCE_TIMEOUT = (3.05, 5.0)
+RATE_SOURCE_RETRIES = 2
+RATE_SOURCE_POOL_SIZE = 10
+# Consecutive failures before the circuit breaker opens, and seconds it stays open.
+RATE_SOURCE_BREAKER_THRESHOLD = 5
+RATE_SOURCE_BREAKER_RESET = 30.0
+
+# Remote timestamp service
+TIMESTAMP_SERVICE_HOST = 'localhost'
+TIMESTAMP_SERVICE_PORT = 10000
+# Several servers as "host:port" strings (overrides the host/port above). Calls
+# go to the less loaded of two random healthy servers; a server failing
+# TIMESTAMP_EJECT_AFTER calls in a row is skipped for TIMESTAMP_EJECT_COOLDOWN
+# seconds. With TIMESTAMP_HEDGE_AFTER_MS set, a call still unanswered after that
+# many milliseconds is also sent to a second server. Stamps from different
+# servers are only ordered as well as the servers' clocks agree.
+TIMESTAMP_SERVICE_ENDPOINTS = None
+TIMESTAMP_EJECT_AFTER = 3
+TIMESTAMP_EJECT_COOLDOWN = 10.0
+TIMESTAMP_HEDGE_AFTER_MS = None
+# Server mode: 'simple', 'threaded', 'threadpool' or 'nonblocking' (framed
+# transport), and handler threads for the threadpool/nonblocking modes. See
+# payapp/timestamp_server.py.
+TIMESTAMP_SERVER_MODE = 'threaded'
+TIMESTAMP_SERVER_WORKERS = 16
+# The server normally runs as its own process (`manage.py runtimestampserver`).
+# True also starts it inside each Django process, for local development only.
+TIMESTAMP_SERVER_EMBEDDED = False
+# Long-lived client connections kept per process, socket timeout, and seconds
+# an idle connection may sit in the pool before it is replaced.
+TIMESTAMP_POOL_SIZE = 8
+TIMESTAMP_TIMEOUT_MS = 2000
+TIMESTAMP_POOL_MAX_IDLE = 60.0
+# Timestamps leased per getTimestamps() call (1 disables leasing), and seconds
+# a leased block may be used before it is discarded. Leasing trades accuracy
+# for throughput: between RPCs a stamp is the local clock corrected by the
+# offset seen at the last RPC, and stamps are no longer reserved on the
+# server, so two processes may issue the same one.
+TIMESTAMP_LEASE_SIZE = 1
+TIMESTAMP_LEASE_TTL = 1.0
+# 'rpc' stamps every transaction through the service; 'hlc' stamps locally with
+# a hybrid logical clock synced every HLC_SYNC_INTERVAL seconds, falling back
+# to the RPC when drift between syncs exceeds HLC_MAX_DRIFT_MS. See payapp/hlc.py.
+TIMESTAMP_MODE = 'rpc'
+HLC_SYNC_INTERVAL = 5.0
+HLC_MAX_DRIFT_MS = 50.0
+# Commit payments with a NULL remote timestamp and stamp them afterwards in
+# batches of TIMESTAMP_STAMP_BATCH, keeping the RPC out of the payment's
+# transaction. The stamper runs as a thread in each web process unless
+# TIMESTAMP_STAMPER_IN_PROCESS is False (then run `manage.py
+# stamp_transactions`). Failed batches back off up to
+# TIMESTAMP_STAMP_MAX_BACKOFF seconds. The stamper also picks up transactions
+# committed unstamped while the service was down, even with async stamping
+# off. A backfilled stamp records when the transaction was stamped, not when
+# it was made. See payapp/stamping.py.
+TIMESTAMP_ASYNC_STAMPING = False
+TIMESTAMP_STAMPER_IN_PROCESS = True
+TIMESTAMP_STAMP_BATCH = 500
+TIMESTAMP_STAMP_INTERVAL = 1.0
+TIMESTAMP_STAMP_MAX_BACKOFF = 60.0
+# Serve make_payment, request_payment and remote-timestamp with the async views
+# in payapp/async_views.py, which use an asyncio Thrift client. Only useful
+# under ASGI (webapps2025/asgi.py); under WSGI each async view gets its own loop.
+ASYNC_PAYMENT_VIEWS = False
+
+# Ledger: an account's balance is also snapshotted every N ledger entries, so
+# historical balances and audits replay at most N entries. See payapp/ledger.py.
+LEDGER_SNAPSHOT_INTERVAL = 100
+
+# Idempotency keys: a repeated payment submission with the same key replays
+# the first outcome. Keys are honoured for this many seconds, after which a
+# submission with the same key counts as new; run `manage.py
+# sweep_idempotency_keys` periodically to delete older ones. See
+# payapp/idempotency.py.
+IDEMPOTENCY_KEY_TTL = 86400
+
+# Queued payments: make_payment only validates and queues the payment, and a
+# settlement worker settles PAYMENT_SETTLE_BATCH queued payments per database
+# commit. The worker runs as a thread in each web process unless
+# PAYMENT_SETTLER_IN_PROCESS is False (then run `manage.py settle_payments`,
+# as many copies as needed). The thread starts with the process's first
+# queued payment or status poll. Run settle_payments to drain payments left
+# queued across restarts without waiting for traffic. Settled payments are
+# stamped by the timestamp stamper afterwards. See payapp/settlement.py.
+PAYMENT_QUEUE_ENABLED = False
+PAYMENT_SETTLER_IN_PROCESS = True
+PAYMENT_SETTLE_BATCH = 500
+PAYMENT_SETTLE_INTERVAL = 1.0
+# Net queued payments over settlement windows of this many seconds (0 settles
+# them as they arrive). Funds are then checked against each account's net
+# position for the window. A larger PAYMENT_SETTLE_BATCH nets more payments
+# per balance update.
+PAYMENT_NETTING_WINDOW = 0
+
+# Hot accounts: the metrics view lists the accounts credited most often in the
+# last HOT_ACCOUNT_WINDOW seconds. Use `manage.py stripe_account` to spread
+# their credits over shard rows. Run `manage.py consolidate_shards`, which
+# repeats every STRIPE_CONSOLIDATE_INTERVAL seconds, to move shard credits
+# into the balance. See payapp/striping.py.
+HOT_ACCOUNT_WINDOW = 60
+STRIPE_CONSOLIDATE_INTERVAL = 5.0
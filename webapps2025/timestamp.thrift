@@ -2,5 +2,7 @@ namespace py payapp.gen
 
 service TimestampService {
     string getTimestamp(),
-    i64 getEpochMillis()
+    i64 getEpochMillis(),
+    // Returns count strictly increasing timestamps reserved in one call.
+    list<string> getTimestamps(1: i32 count)
 }
@@ -3,15 +3,21 @@ URL configuration for webapps2025 project.
 
 """
 
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path
 
 from payapp.views import (
-    home, make_payment, request_payment, requests_list, conversion, handle_request,
-    transaction_history, admin_users, admin_transactions, make_admin, remote_timestamp_view
+    home, make_payment, request_payment, bulk_payout, queued_payment_status, requests_list, conversion,
+    conversion_batch, handle_request, transaction_history, admin_users, admin_transactions, make_admin, metrics,
+    remote_timestamp_view
 )
 from register.views import register, user_login, user_logout
 
+if getattr(settings, 'ASYNC_PAYMENT_VIEWS', False):
+    # Native async views for ASGI deployments (see payapp/async_views.py).
+    from payapp.async_views import make_payment, request_payment, remote_timestamp_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('webapps2025/', home, name='home'),
@@ -19,6 +25,8 @@ urlpatterns = [
     # User routes
     path('webapps2025/pay/make/', make_payment, name='make_payment'),
     path('webapps2025/pay/request/', request_payment, name='request_payment'),
+    path('webapps2025/pay/bulk/', bulk_payout, name='bulk_payout'),
+    path('webapps2025/pay/queued/<int:payment_id>/', queued_payment_status, name='queued_payment_status'),
     path('webapps2025/pay/history/', transaction_history, name='transaction_history'),
     path('webapps2025/requests/', requests_list, name='requests_list'),
     path('webapps2025/pay/handle/<int:transaction_id>/', handle_request, name='handle_request'),
@@ -32,9 +40,11 @@ urlpatterns = [
     path('webapps2025/admin/users/', admin_users, name='admin_users'),
     path('webapps2025/admin/transactions/', admin_transactions, name='admin_transactions'),
     path('webapps2025/admin/make_admin/<int:user_id>/', make_admin, name='make_admin'),
+    path('webapps2025/admin/metrics/', metrics, name='metrics'),
 
     # Currency conversion RESTful service
     path('conversion/<str:currency1>/<str:currency2>/<str:amount>/', conversion, name='conversion'),
+    path('conversion/batch/', conversion_batch, name='conversion_batch'),
 
     # RTC
     path('remote-timestamp/', remote_timestamp_view, name='remote_timestamp'),